@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+"""
+Local server giving advice from solved Yahtzee widgets, and a
+load-test client for it.
+
+The server listens on localhost, and speaks a line protocol:
+each request is one line of JSON, like
+
+{"id": 7, "points": "yahtzee", "n_dice": 5, "n_faces": 6, "n_rolls": 3, "turn": 1, "roll": [4, 1, 5, 1, 4]}
+
+(n_dice, n_faces and n_rolls default to 5, 6 and 3, and turn
+starts at 1 as in Widget.advise), and each answer is one line
+of JSON, like
+
+{"id": 7, "keep": [1, 1], "keep_mask": [false, true, false, true, false], "expected": 0.0159}
+
+giving the dice to keep, (sorted, and as a mask over the roll
+in the order given), and the expected number of points, or
+{"id": 7, "error": "..."} if the request isn't valid.  The
+request {"stats": true} returns the server's counters (see
+ServerStats).  Answers to the requests on one connection are
+in the same order as the requests.
+
+Widgets are solved the first time they are asked for, (or
+before the server starts, with --preload), and the most
+recently used ones are kept, (see --max-widgets).  All of
+the requests that arrive together are answered together with
+one Widget.advise_batch call per Widget.
+
+Ex.
+python advice_server.py serve --port 8765 --preload yahtzee,5,6,3
+python advice_server.py loadtest --port 8765 --requests 100000 --concurrency 32
+python advice_server.py selftest
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+import time
+import json
+import socket
+import asyncore
+import asynchat
+import argparse
+import multiprocessing
+from collections import deque
+from numpy import *
+from widget_class import Widget, LRUCache, combo_points, n_multisets
+
+#-----------------------
+#Globals
+#-----------------------
+
+#Number of recent latencies kept for the percentiles in
+#ServerStats and load_test.
+LATENCY_WINDOW=100000
+
+#-----------------------
+#Classes
+#-----------------------
+class ServerStats:
+    """
+    Counters for an AdviceServer: the number of requests
+    answered, errors, batches of requests answered together,
+    and the latencies of the most recent requests, from
+    reading the request to queueing the answer.
+    """
+    def __init__(self):
+        self.start=time.time()
+        self.requests=0
+        self.errors=0
+        self.batches=0
+        self.latencies=deque(maxlen=LATENCY_WINDOW)
+
+    def record_batch(self,received_times,now):
+        """
+        Records a batch of requests received at the times in
+        received_times, and answered at time now.
+        """
+        self.batches+=1
+        self.requests+=len(received_times)
+        self.latencies.extend(now-t for t in received_times)
+
+    def summary(self):
+        """
+        Returns the counters as a dictionary that can be
+        written as JSON.
+        """
+        uptime=time.time()-self.start
+        result={'requests':self.requests,'errors':self.errors,'batches':self.batches,'uptime':uptime,
+                'throughput':self.requests/uptime if uptime>0 else 0.,
+                'mean_batch':float(self.requests)/self.batches if self.batches>0 else 0.}
+        result.update(latency_percentiles(self.latencies))
+        return result
+
+class AdviceServer(asyncore.dispatcher):
+    """
+    Listens for connections on (host,port), and answers
+    advice requests on them, (see the module docstring).
+
+    Requests are queued as they are read, and the queue is
+    answered each time the event loop has read everything
+    that has arrived, (after waiting up to batch_wait
+    seconds for more, if batch_wait is given), so that
+    requests arriving together from many connections are
+    answered with one Widget.advise_batch call per Widget.
+
+    self.widgets is an LRUCache of the max_widgets most
+    recently used solved Widgets, keyed by
+    (points,n_dice,n_faces,n_rolls).  Widgets are solved in
+    the event loop, so the first request for a large Widget
+    holds up the others; use preload to solve them before
+    serving.  max_dice, max_faces and max_rolls limit n_dice,
+    n_faces and n_rolls, and max_table limits the number of
+    possible rolls of the Widgets that can be asked for, so
+    that no request takes too long or too much memory to
+    solve.  If solving a Widget fails anyway, the requests
+    for it get an error, and the server goes on.
+    """
+    def __init__(self,host='127.0.0.1',port=8765,batch_wait=0.,preload=[],max_dice=10,
+                 max_faces=20,max_rolls=20,max_table=100000,max_widgets=32):
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host,port))
+        self.listen(128)
+        self.address=self.socket.getsockname()
+        self.batch_wait=batch_wait
+        self.max_dice=max_dice
+        self.max_faces=max_faces
+        self.max_rolls=max_rolls
+        self.max_table=max_table
+        self.widgets=LRUCache(max_widgets)
+        self.pending=[]
+        self.stats=ServerStats()
+        for key in preload:
+            self.widget(key)
+
+    def handle_accept(self):
+        pair=self.accept()
+        if pair!=None:
+            AdviceConnection(pair[0],self)
+
+    def widget(self,key):
+        """
+        Returns the Widget for key=(points,n_dice,n_faces,n_rolls),
+        solving it if it isn't in self.widgets.
+        """
+        def build():
+            points, n_dice, n_faces, n_rolls=key
+            w=Widget(points,n_dice,n_faces,n_rolls)
+            w.advice_table()
+            return w
+        return self.widgets.get(key,build)
+
+    def parse_request(self,request):
+        """
+        Checks a request, and returns (key,turn,roll), or
+        raises ValueError with a message for the client.  This
+        is checked here because Widget exits on invalid
+        arguments.
+        """
+        if type(request)!=dict:
+            raise ValueError("request must be a JSON object")
+        points=request.get('points')
+        if not isinstance(points,basestring) or points.lower() not in combo_points:
+            raise ValueError("points must be one of: "+", ".join(sorted(combo_points)))
+        n_dice=request.get('n_dice',5)
+        n_faces=request.get('n_faces',6)
+        n_rolls=request.get('n_rolls',3)
+        for name, n, upper in [('n_dice',n_dice,self.max_dice),('n_faces',n_faces,self.max_faces),('n_rolls',n_rolls,self.max_rolls)]:
+            if type(n)!=int or n<1 or n>upper:
+                raise ValueError("%s must be an integer from 1 to %d" % (name,upper))
+        if n_multisets(n_dice,n_faces)>self.max_table:
+            raise ValueError("%d dice with %d faces have more than %d possible rolls" % (n_dice,n_faces,self.max_table))
+        turn=request.get('turn')
+        if type(turn)!=int or turn<1 or turn>n_rolls:
+            raise ValueError("turn must be an integer from 1 to %d" % n_rolls)
+        roll=request.get('roll')
+        if type(roll)!=list or len(roll)!=n_dice or len([d for d in roll if type(d)==int and 1<=d<=n_faces])!=n_dice:
+            raise ValueError("roll must be a list of %d integers from 1 to %d" % (n_dice,n_faces))
+        #Strings from JSON are unicode, and Widget takes str.
+        return (str(points.lower()),n_dice,n_faces,n_rolls),turn,roll
+
+    def answer_pending(self):
+        """
+        Answers all of the queued requests, one batch per
+        Widget.  If solving a Widget or advising from it
+        fails, each request in its batch gets the error.  The
+        answers are written in the order the requests
+        arrived, so that each connection gets its answers in
+        the same order as its requests.
+        """
+        pending=self.pending
+        self.pending=[]
+        #groups[key] lists the positions in pending of the
+        #requests for the Widget with that key, and answers[p]
+        #is the answer to pending[p].
+        groups={}
+        for p, (connection,request,received) in enumerate(pending):
+            groups.setdefault(request[0],[]).append(p)
+        answers=[None]*len(pending)
+        for key, positions in groups.iteritems():
+            requests=[pending[p][1] for p in positions]
+            turns=array([request[1] for request in requests])
+            rolls=array([request[2] for request in requests])
+            try:
+                w=self.widget(key)
+                keep,expected=w.advise_batch(turns,rolls)
+            except (Exception,SystemExit), e:
+                #Widget exits on errors it prints itself.
+                message=str(e) if isinstance(e,Exception) and str(e)!='' else "could not solve %s with %d dice, %d faces and %d rolls" % key
+                self.stats.errors+=len(positions)
+                for p, request in zip(positions,requests):
+                    answers[p]={'id':request[3],'error':message}
+                continue
+            for p, request, k, e, roll in zip(positions,requests,keep.tolist(),expected.tolist(),rolls.tolist()):
+                kept=sorted(d for d, kd in zip(roll,k) if kd)
+                answers[p]={'id':request[3],'keep':kept,'keep_mask':k,'expected':e}
+            self.stats.record_batch([pending[p][2] for p in positions],time.time())
+        for (connection,request,received), answer in zip(pending,answers):
+            connection.answer(answer)
+
+    def serve(self,duration=None):
+        """
+        Runs the event loop, answering requests, for duration
+        seconds, (or forever if duration is None).
+        """
+        end=None if duration==None else time.time()+duration
+        while end==None or time.time()<end:
+            asyncore.loop(timeout=0.1,count=1)
+            if len(self.pending)>0 and self.batch_wait>0.:
+                #Wait a little longer for more requests to
+                #answer with these.
+                wait_end=time.time()+self.batch_wait
+                while time.time()<wait_end:
+                    asyncore.loop(timeout=max(wait_end-time.time(),0.),count=1)
+            if len(self.pending)>0:
+                self.answer_pending()
+
+class AdviceConnection(asynchat.async_chat):
+    """
+    One client connection to an AdviceServer.  Each line
+    read is a request, which is queued on the server, (or
+    answered at once if it is invalid or asks for stats).
+    """
+    def __init__(self,sock,server):
+        asynchat.async_chat.__init__(self,sock)
+        self.server=server
+        self.buffer=[]
+        self.set_terminator('\n')
+
+    def collect_incoming_data(self,data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line=''.join(self.buffer)
+        self.buffer=[]
+        received=time.time()
+        request_id=None
+        try:
+            request=json.loads(line)
+            if type(request)==dict:
+                request_id=request.get('id')
+                if request.get('stats'):
+                    self.answer_in_order({'id':request_id,'stats':self.server.stats.summary()})
+                    return
+            key, turn, roll=self.server.parse_request(request)
+        except ValueError, e:
+            self.server.stats.errors+=1
+            self.answer_in_order({'id':request_id,'error':str(e)})
+            return
+        self.server.pending.append((self,(key,turn,roll,request_id),received))
+
+    def answer_in_order(self,answer):
+        """
+        Answers a request that doesn't go through the queue,
+        after answering the requests queued before it on this
+        connection, so that answers stay in order.
+        """
+        for connection, request, received in self.server.pending:
+            if connection is self:
+                self.server.answer_pending()
+                break
+        self.answer(answer)
+
+    def answer(self,answer):
+        self.push(json.dumps(answer)+'\n')
+
+class LoadClient(asynchat.async_chat):
+    """
+    One connection of load_test, which sends requests one
+    at a time, (sending the next when the answer to the last
+    arrives), and records the round trip latencies.
+    """
+    def __init__(self,address,requests,latencies,answers):
+        asynchat.async_chat.__init__(self)
+        self.create_socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.requests=requests
+        self.latencies=latencies
+        self.answers=answers
+        self.buffer=[]
+        self.next=0
+        self.set_terminator('\n')
+        self.connect(address)
+
+    def handle_connect(self):
+        self.send_next()
+
+    def send_next(self):
+        if self.next<len(self.requests):
+            self.sent=time.time()
+            self.push(self.requests[self.next])
+            self.next+=1
+        else:
+            self.close()
+
+    def collect_incoming_data(self,data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        self.latencies.append(time.time()-self.sent)
+        self.answers.append(''.join(self.buffer))
+        self.buffer=[]
+        self.send_next()
+
+#-----------------------
+#Functions
+#-----------------------
+
+def latency_percentiles(latencies):
+    """
+    Returns a dictionary of the 50th, 90th, 99th and 100th
+    percentiles of latencies (in seconds), in milliseconds.
+    """
+    if len(latencies)==0:
+        return {'p50_ms':0.,'p90_ms':0.,'p99_ms':0.,'max_ms':0.}
+    p50, p90, p99, p100=percentile(array(latencies),[50,90,99,100])*1000.
+    return {'p50_ms':p50,'p90_ms':p90,'p99_ms':p99,'max_ms':p100}
+
+def make_requests(n_requests,points='yahtzee',n_dice=5,n_faces=6,n_rolls=3,seed=0):
+    """
+    Returns a list of n_requests random request lines for
+    the same Widget, for load_test.
+    """
+    rng=random.RandomState(seed)
+    turns=rng.randint(1,n_rolls+1,n_requests).tolist()
+    rolls=rng.randint(1,n_faces+1,(n_requests,n_dice)).tolist()
+    return [json.dumps({'id':i,'points':points,'n_dice':n_dice,'n_faces':n_faces,'n_rolls':n_rolls,'turn':turn,'roll':roll})+'\n' for i, (turn,roll) in enumerate(zip(turns,rolls))]
+
+def load_test(address,requests,concurrency=16):
+    """
+    Sends the request lines in the list requests to the
+    server at address over 'concurrency' connections, each
+    sending its next request when it gets the answer to the
+    last, and returns (summary,answers), where summary is a
+    dictionary giving the throughput and round trip latency
+    percentiles, and answers lists the answer lines received.
+    """
+    latencies=[]
+    answers=[]
+    start=time.time()
+    clients=[LoadClient(address,requests[i::concurrency],latencies,answers) for i in range(concurrency)]
+    asyncore.loop(timeout=0.1,map=None)
+    seconds=time.time()-start
+    summary={'requests':len(latencies),'seconds':seconds,'throughput':len(latencies)/seconds,'concurrency':concurrency}
+    summary.update(latency_percentiles(latencies))
+    return summary,answers
+
+def parse_preload(s):
+    """
+    Parses a --preload argument like 'yahtzee,5,6,3'.
+    """
+    parts=s.split(',')
+    return (parts[0].strip().lower(),int(parts[1]),int(parts[2]),int(parts[3]))
+
+def _serve(port_queue,batch_wait,preload,duration):
+    """
+    Runs a server on a free port for duration seconds, for
+    selftest, putting the port in port_queue once it is
+    listening.
+    """
+    server=AdviceServer(port=0,batch_wait=batch_wait,preload=preload)
+    port_queue.put(server.address[1])
+    server.serve(duration)
+
+#-----------------------
+#Main
+#-----------------------
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Serve advice from solved widgets on localhost, or load-test a server.")
+    parser.add_argument('command',choices=['serve','loadtest','selftest'])
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=8765)
+    parser.add_argument('--preload',action='append',type=parse_preload,default=[],help="widget to solve before serving, as points,n_dice,n_faces,n_rolls, e.g. yahtzee,5,6,3 (can be repeated)")
+    parser.add_argument('--batch-wait',type=float,default=0.,help="seconds to wait for more requests before answering a batch (default 0)")
+    parser.add_argument('--max-dice',type=int,default=10,help="largest n_dice that can be asked for (default 10)")
+    parser.add_argument('--max-faces',type=int,default=20,help="largest n_faces that can be asked for (default 20)")
+    parser.add_argument('--max-rolls',type=int,default=20,help="largest n_rolls that can be asked for (default 20)")
+    parser.add_argument('--max-table',type=int,default=100000,help="largest number of possible rolls of the widgets that can be asked for (default 100000)")
+    parser.add_argument('--max-widgets',type=int,default=32,help="number of solved widgets kept (default 32)")
+    parser.add_argument('--requests',type=int,default=100000,help="number of requests for loadtest (default 100000)")
+    parser.add_argument('--concurrency',type=int,default=16,help="number of connections for loadtest (default 16)")
+    parser.add_argument('--points',default='yahtzee',help="combination to ask about in loadtest (default yahtzee)")
+    args=parser.parse_args()
+
+    if args.command=='serve':
+        server=AdviceServer(args.host,args.port,args.batch_wait,args.preload,args.max_dice,
+                            args.max_faces,args.max_rolls,args.max_table,args.max_widgets)
+        print "Serving on %s:%d" % server.address
+        server.serve()
+
+    elif args.command=='loadtest':
+        summary,answers=load_test((args.host,args.port),make_requests(args.requests,args.points),args.concurrency)
+        print json.dumps(summary,indent=1,sort_keys=True)
+
+    else:
+        #Run a server in another process, load-test it, and
+        #check the answers against Widget.advise_batch.
+        port_queue=multiprocessing.Queue()
+        process=multiprocessing.Process(target=_serve,args=(port_queue,args.batch_wait,[('yahtzee',5,6,3)],60.))
+        process.start()
+        try:
+            address=('127.0.0.1',port_queue.get(timeout=30))
+            requests=make_requests(args.requests)
+            summary,answers=load_test(address,requests,args.concurrency)
+            assert(summary['requests']==len(requests))
+
+            w=Widget('yahtzee')
+            answers=dict((a['id'],a) for a in map(json.loads,answers))
+            parsed=[json.loads(r) for r in requests]
+            keep,expected=w.advise_batch([r['turn'] for r in parsed],[r['roll'] for r in parsed])
+            for r, k, e in zip(parsed,keep.tolist(),expected.tolist()):
+                assert(answers[r['id']]['keep_mask']==k)
+                assert(answers[r['id']]['expected']==e)
+
+            #Bad requests, and requests for widgets over the
+            #limits, get errors, and stats are reported.
+            bad=['{"id": 1, "points": "nonsense", "turn": 1, "roll": [1,2,3,4,5]}\n','not json\n',
+                 '{"id": 2, "points": "yahtzee", "n_rolls": 1000000000, "turn": 1, "roll": [1,2,3,4,5]}\n',
+                 '{"id": 3, "points": "yahtzee", "n_faces": 1000000, "turn": 1, "roll": [1,2,3,4,5]}\n',
+                 '{"id": 4, "points": "yahtzee", "n_dice": 10, "n_faces": 20, "turn": 1, "roll": [1,2,3,4,5,6,7,8,9,10]}\n',
+                 '{"stats": true}\n']
+            summary2,answers2=load_test(address,bad,1)
+            assert(all(['error' in json.loads(a) for a in answers2[:-1]]))
+            stats=json.loads(answers2[-1])['stats']
+            assert(stats['requests']==len(requests) and stats['errors']==len(bad)-1)
+
+            #Pipelined requests for different widgets, (including
+            #ones that weren't preloaded, solved on request), are
+            #answered in the order they were sent.
+            points=['chance','yahtzee','full house','chance','yahtzee','large straight']
+            pipelined=[json.dumps({'id':i,'points':p,'turn':2,'roll':[2,3,4,5,5]})+'\n' for i, p in enumerate(points)]
+            sock=socket.create_connection(address)
+            sock.sendall(''.join(pipelined))
+            received=''
+            while received.count('\n')<len(pipelined):
+                received+=sock.recv(65536)
+            sock.close()
+            answers3=map(json.loads,received.splitlines())
+            assert([a['id'] for a in answers3]==range(len(points)))
+            for p, a in zip(points,answers3):
+                assert(a['expected']==Widget(p).values[1][(2,3,4,5,5)])
+            print json.dumps(summary,indent=1,sort_keys=True)
+            print "Server batched", stats['requests'], "requests into", stats['batches'], "batches"
+        finally:
+            process.terminate()
+            process.join()
+
+        #A widget that fails to solve gets an error answer for
+        #each request for it, and the server keeps the others.
+        class Answers(list):
+            answer=list.append
+        server=AdviceServer(port=0,max_widgets=1)
+        answers=Answers()
+        server.pending=[(answers,(('yahtzee',5,0,3),1,[1,2,3,4,5],1),time.time()),
+                        (answers,(('yahtzee',5,6,3),1,[1,2,3,4,5],2),time.time())]
+        server.answer_pending()
+        assert([a['id'] for a in answers]==[1,2])
+        assert('error' in answers[0] and answers[1]['expected']==Widget('yahtzee').advise_batch([1],[[1,2,3,4,5]])[1][0])
+        assert(server.stats.errors==1 and len(server.widgets.entries)==1)
+        server.close()
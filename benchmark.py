@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Benchmarks for building and solving Yahtzee widgets.
+
+Times Widget construction, compute_strategy,
+expected_given_kept and advise for every built-in
+combination over a grid of numbers of dice, faces and rolls,
+and solving all of the combinations together with
+solve_batch against building their Widgets one at a time,
+records how much memory the Widgets and the shared tables
+use, and writes the results as JSON.  The results can be
+compared against a baseline file written by an earlier run,
+failing (with exit status 1) if anything got slower by more
+than a given fraction.
+
+Ex.
+python benchmark.py --n-dice 1-10 --output new.json --baseline old.json --threshold 0.25
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+import os
+import sys
+import time
+import json
+import platform
+import resource
+import argparse
+import numpy
+import scipy
+from widget_class import Widget, roll_table, table_cache, solve_batch, combos, combos_weighted
+
+#-----------------------
+#Globals
+#-----------------------
+
+#The timings recorded for each Widget, in seconds.
+timed_metrics=['build','compute_strategy','expected_given_kept','advise']
+
+#The timings recorded for each batch of Widgets, in seconds.
+batch_metrics=['batch','separate']
+
+#-----------------------
+#Functions
+#-----------------------
+
+def best_time(fn,repeat):
+    """
+    Returns the smallest time taken by fn() over 'repeat'
+    calls, which is the least noisy estimate of how long it
+    takes.
+    """
+    best=None
+    for i in range(repeat):
+        start=time.time()
+        fn()
+        elapsed=time.time()-start
+        if best==None or elapsed<best:
+            best=elapsed
+    return best
+
+def array_bytes(*arrays):
+    """
+    Total size in bytes of the given numpy arrays and
+    scipy sparse matrices.
+    """
+    total=0
+    for a in arrays:
+        if hasattr(a,'data') and hasattr(a,'indices'):
+            total+=a.data.nbytes+a.indices.nbytes+a.indptr.nbytes
+        else:
+            total+=a.nbytes
+    return total
+
+def widget_bytes(w):
+    """
+    Memory used by the arrays belonging to one Widget.
+    """
+    arrays=[w._values]
+    for indptr, indices in w._strategy:
+        arrays+=[indptr,indices]
+    return array_bytes(*arrays)
+
+def table_bytes(table):
+    """
+    Memory used by a RollTable, its TransitionKernel and its
+    SubrollIndex, which are shared by all Widgets with the
+    same dice.
+    """
+    arrays=table.multisets+table.weights+[table.counts,table.rank_offsets]
+    arrays+=[table.kernel.counts,table.kernel.denominators]
+    arrays+=[table.subrolls.indptr,table.subrolls.indices,table.subrolls.rows]
+    return array_bytes(*arrays)
+
+def benchmark_tables(n_dice,n_faces,repeat=1):
+    """
+    Times building the RollTable, TransitionKernel and
+    SubrollIndex for n_dice dice with n_faces faces, (with
+    the cache cleared each time), and returns a dictionary
+    of results.
+    """
+    def build():
+        table_cache.clear()
+        roll_table(n_dice,n_faces).subrolls
+    seconds=best_time(build,repeat)
+    table=roll_table(n_dice,n_faces)
+    return {'n_dice':n_dice,'n_faces':n_faces,'build':seconds,'bytes':table_bytes(table),'num_rolls':table.num_rolls,'num_keeps':int(table.num_keeps),'kernel_nnz':int(table.kernel.counts.nnz)}
+
+def benchmark_widget(combo,n_dice,n_faces,n_rolls,repeat=3,samples=50):
+    """
+    Times building a Widget for combo, (with the shared
+    tables already built), re-running compute_strategy on
+    it, and calling expected_given_kept and advise, and
+    returns a dictionary of results.  expected_given_kept
+    and advise are timed per call, averaged over (up to)
+    'samples' evenly spaced keeps and rolls.  advise prints
+    its advice, so its output is thrown away.
+    """
+    result={'combo':combo,'n_dice':n_dice,'n_faces':n_faces,'n_rolls':n_rolls}
+    roll_table(n_dice,n_faces).subrolls
+    result['build']=best_time(lambda: Widget(combo,n_dice,n_faces,n_rolls),repeat)
+    w=Widget(combo,n_dice,n_faces,n_rolls)
+    result['compute_strategy']=best_time(w.compute_strategy,repeat)
+
+    table=w.table
+    keeps=table.keep_tuples[::max(1,table.num_keeps//samples)]
+    rolls=table.roll_tuples[::max(1,table.num_rolls//samples)]
+    turn=max(n_rolls-2,0)
+    def call_expected_given_kept():
+        if n_rolls>1:
+            for kept in keeps:
+                w.expected_given_kept(kept,turn)
+    result['expected_given_kept']=best_time(call_expected_given_kept,repeat)/len(keeps)
+
+    def call_advise():
+        for roll in rolls:
+            w.advise(1,roll)
+    stdout=sys.stdout
+    sys.stdout=open(os.devnull,'w')
+    try:
+        result['advise']=best_time(call_advise,repeat)/len(rolls)
+    finally:
+        sys.stdout.close()
+        sys.stdout=stdout
+
+    result['widget_bytes']=widget_bytes(w)
+    result['peak_rss_kb']=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def benchmark_batch(points_list,n_dice,n_faces,n_rolls,repeat=3):
+    """
+    Times solving all of the point tables in points_list
+    together with solve_batch, and building a Widget for
+    each of them one at a time, (with the shared tables
+    already built), and returns a dictionary of results.
+    The two are timed in turn, so that both see the same
+    load.
+    """
+    roll_table(n_dice,n_faces).subrolls
+    def batch():
+        solve_batch(points_list,n_dice,n_faces,n_rolls)
+    def separate():
+        for points in points_list:
+            Widget(points,n_dice,n_faces,n_rolls)
+    times={'batch':[],'separate':[]}
+    for i in range(repeat):
+        times['batch'].append(best_time(batch,1))
+        times['separate'].append(best_time(separate,1))
+    result={'n_dice':n_dice,'n_faces':n_faces,'n_rolls':n_rolls,'num_tables':len(points_list)}
+    for metric in batch_metrics:
+        result[metric]=min(times[metric])
+    return result
+
+def run_benchmarks(n_dice_list,n_faces_list,n_rolls_list,points_list,repeat=3,samples=50,log=None):
+    """
+    Runs benchmark_tables, benchmark_widget and
+    benchmark_batch over the whole grid, and returns the results as a dictionary that can
+    be written as JSON.  If log is given, a line is written
+    to it for each result.
+    """
+    results={'meta':{'python':platform.python_version(),'numpy':numpy.__version__,'scipy':scipy.__version__,'machine':platform.machine(),'time':time.time(),'repeat':repeat,'samples':samples},'tables':[],'widgets':[],'batches':[]}
+    for n_faces in n_faces_list:
+        for n_dice in n_dice_list:
+            r=benchmark_tables(n_dice,n_faces)
+            results['tables'].append(r)
+            if log!=None:
+                print >> log, "tables n_dice=%d n_faces=%d: %.4fs, %d bytes" % (n_dice,n_faces,r['build'],r['bytes'])
+            for n_rolls in n_rolls_list:
+                for combo in points_list:
+                    r=benchmark_widget(combo,n_dice,n_faces,n_rolls,repeat,samples)
+                    results['widgets'].append(r)
+                    if log!=None:
+                        print >> log, "%-26s n_dice=%d n_faces=%d n_rolls=%d:" % (combo,n_dice,n_faces,n_rolls), " ".join("%s=%.2e" % (m,r[m]) for m in timed_metrics)
+                r=benchmark_batch(points_list,n_dice,n_faces,n_rolls,repeat)
+                results['batches'].append(r)
+                if log!=None:
+                    print >> log, "%-26s n_dice=%d n_faces=%d n_rolls=%d:" % ('solve_batch',n_dice,n_faces,n_rolls), " ".join("%s=%.2e" % (m,r[m]) for m in batch_metrics)
+    return results
+
+def compare(results,baseline,threshold,min_time=1.E-4):
+    """
+    Compares results against baseline, (both as returned by
+    run_benchmarks), and returns a list of slowdowns, each a
+    dictionary giving the configuration, the metric, the
+    baseline and current times, and their ratio.  A slowdown
+    is a time more than (1+threshold) times the baseline
+    time.  Times below min_time seconds in the baseline are
+    too noisy to compare, and are skipped, as are
+    configurations that aren't in both.
+    """
+    def key(r):
+        return tuple(r.get(k) for k in ['combo','n_dice','n_faces','n_rolls'])
+
+    slowdowns=[]
+    pairs=[(r,b,['build']) for r, b in match(results['tables'],baseline.get('tables',[]),key)]
+    pairs+=[(r,b,timed_metrics) for r, b in match(results['widgets'],baseline.get('widgets',[]),key)]
+    pairs+=[(r,b,batch_metrics) for r, b in match(results['batches'],baseline.get('batches',[]),key)]
+    for r, b, metrics in pairs:
+        for metric in metrics:
+            if b[metric]<min_time:
+                continue
+            ratio=r[metric]/b[metric]
+            if ratio>1.+threshold:
+                slowdown=dict((k,r.get(k)) for k in ['combo','n_dice','n_faces','n_rolls'])
+                slowdown.update({'metric':metric,'baseline':b[metric],'current':r[metric],'ratio':ratio})
+                slowdowns.append(slowdown)
+    return slowdowns
+
+def match(results,baseline,key):
+    """
+    Returns the list of pairs of entries of results and
+    baseline with the same key.
+    """
+    by_key=dict((key(b),b) for b in baseline)
+    return [(r,by_key[key(r)]) for r in results if key(r) in by_key]
+
+def parse_range(s):
+    """
+    Parses a list of integers given on the command line,
+    like '1-10' or '4,6,8'.
+    """
+    values=[]
+    for part in s.split(','):
+        if '-' in part:
+            lo, hi=part.split('-')
+            values+=range(int(lo),int(hi)+1)
+        else:
+            values.append(int(part))
+    return values
+
+#-----------------------
+#Main
+#-----------------------
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Benchmark Widget construction, compute_strategy, expected_given_kept and advise.")
+    parser.add_argument('--n-dice',type=parse_range,default=range(1,11),help="numbers of dice, e.g. 1-10 (default) or 3,5")
+    parser.add_argument('--n-faces',type=parse_range,default=[6],help="numbers of faces (default 6)")
+    parser.add_argument('--n-rolls',type=parse_range,default=[3],help="numbers of rolls (default 3)")
+    parser.add_argument('--combos',default=None,help="comma separated combinations (default all built-in combinations, weighted and unweighted)")
+    parser.add_argument('--repeat',type=int,default=3,help="number of times to repeat each timing, keeping the best (default 3)")
+    parser.add_argument('--samples',type=int,default=50,help="number of keeps and rolls to time expected_given_kept and advise on (default 50)")
+    parser.add_argument('--output',default=None,help="file to write the results to, as JSON")
+    parser.add_argument('--baseline',default=None,help="results of an earlier run to compare against")
+    parser.add_argument('--threshold',type=float,default=0.25,help="fail if anything is slower than the baseline by more than this fraction (default 0.25)")
+    parser.add_argument('--min-time',type=float,default=1.E-4,help="don't compare times shorter than this many seconds in the baseline (default 1e-4)")
+    args=parser.parse_args()
+
+    points_list=combos+combos_weighted if args.combos==None else [c.strip() for c in args.combos.split(',')]
+    results=run_benchmarks(args.n_dice,args.n_faces,args.n_rolls,points_list,args.repeat,args.samples,log=sys.stdout)
+
+    if args.output!=None:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1,sort_keys=True)
+
+    if args.baseline!=None:
+        with open(args.baseline) as f:
+            baseline=json.load(f)
+        slowdowns=compare(results,baseline,args.threshold,args.min_time)
+        for s in slowdowns:
+            print "SLOWER: %s n_dice=%s n_faces=%s n_rolls=%s %s: %.2e s -> %.2e s (x%.2f)" % (s['combo'],s['n_dice'],s['n_faces'],s['n_rolls'],s['metric'],s['baseline'],s['current'],s['ratio'])
+        if len(slowdowns)>0:
+            print len(slowdowns), "slowdowns of more than", "%d%%" % (100*args.threshold), "compared to", args.baseline
+            sys.exit(1)
+        print "No slowdowns of more than", "%d%%" % (100*args.threshold), "compared to", args.baseline
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Memory-bounded version of Widget, for turns with many rolls:
+only two turns of values are kept while solving, and the
+strategy is only kept for the turns you ask for.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+from numpy import *
+import sys
+import resource
+from collections import Mapping, namedtuple
+from widget_class import Widget, RollDict, parse_int, eql_floats
+
+#-----------------------
+#Globals
+#-----------------------
+
+#Memory used by BoundedWidget.compute_strategy, in bytes:
+#working_bytes = the most held at once by the solver's own
+#arrays, (not counting the shared RollTable, TransitionKernel
+#and SubrollIndex, which don't depend on n_rolls), including
+#what is kept.
+#stored_bytes = the values and strategy kept for the turns
+#asked for.
+#peak_rss = the peak resident set size of the whole process
+#so far, (from getrusage, so it includes everything the
+#process did before solving).
+MemoryUsage=namedtuple('MemoryUsage',['working_bytes','stored_bytes','peak_rss'])
+
+#-----------------------
+#Classes
+#-----------------------
+class BoundedWidget:
+    """
+    Same as Widget, except that the values and strategy are
+    only kept for the turns listed in 'turns', so that the
+    memory used doesn't grow with n_rolls.
+
+    Widget.compute_strategy keeps self._values for every turn,
+    every set of optimal kept dice for every roll at every
+    turn, and self._keep_values, so its memory grows with the
+    number of rolls.  But each turn of backward induction only
+    needs the values of the next turn, so here only two rows
+    of values are kept while solving, (the turn being solved
+    and the one after it), and the buffer of candidate values
+    for each roll's sets of kept dice is reused from turn to
+    turn.  The values are the same, bit for bit, as
+    Widget's.
+
+    For each turn in turns, self.values[turn] is a RollDict of
+    the expected number of points for each roll, as for
+    Widget, and self._policy[turn] is the compact strategy:
+    the index of one optimal set of kept dice for each roll,
+    chosen by tie_break, 'fewest' or 'most' (see tie_breaks),
+    in the smallest unsigned integer type that holds every
+    keep index.  self.strategy[turn] gives dictionary-like
+    access to it, (a list of one sorted tuple per roll).  The
+    last turn, n_rolls-1, has values, (the points), but no
+    strategy.
+
+    self.memory is a MemoryUsage (see above) for the solve.
+    Only the point tables of RollTables are supported, (not
+    CountWidget's).
+    """
+    def __init__(self,points,n_dice=5,n_faces=6,n_rolls=3,turns=(0,),tie_break='fewest',probs=None):
+        """
+        points, n_dice, n_faces, n_rolls and probs are as for
+        Widget.
+
+        turns = list of the turns, (counting from 0), to keep
+        the values and strategy for.
+
+        tie_break = 'fewest' or 'most', which of the optimal
+        sets of kept dice to keep for each roll.
+        """
+        self.n_rolls=parse_int(n_rolls,"n_rolls",1)
+        if tie_break not in ['fewest','most']:
+            print >> sys.stderr, "Error in BoundedWidget.__init__: tie_break must be 'fewest' or 'most'."
+            exit()
+        self.tie_break=tie_break
+        self.turns=sorted(set(parse_int(turn,"turn",0,self.n_rolls-1) for turn in turns))
+
+        #A Widget with one roll just parses the points, without
+        #allocating anything for the other turns.
+        w=Widget(points,n_dice,n_faces,1,compute=False,probs=probs)
+        self.n_dice=w.n_dice
+        self.n_faces=w.n_faces
+        self.probs=w.probs
+        self.table=w.table
+        self.points=w._values[-1]
+
+        self._values={}
+        self._policy={}
+        self.values={}
+        self.strategy={}
+        self.compute_strategy()
+
+    def compute_strategy(self):
+        """
+        Solves by backward induction, keeping the values and
+        strategy for self.turns, and computes self.expected
+        and self.memory.
+        """
+        table=self.table
+        kernel=table.kernel
+        subrolls=table.subrolls
+        starts=subrolls.indptr[:-1]
+        n_subrolls=len(subrolls.indices)
+        policy_type=min_scalar_type(table.num_keeps-1)
+
+        self._values={}
+        self._policy={}
+        stored_bytes=0
+        if self.n_rolls-1 in self.turns:
+            self._values[self.n_rolls-1]=self.points
+            stored_bytes+=self.points.nbytes
+
+        #next_values is the row for the turn after the one
+        #being solved, and values the row being solved.
+        next_values=self.points
+        values=zeros(table.num_rolls)
+        candidates=zeros(n_subrolls)
+        working_bytes=0
+        for turn in range(self.n_rolls-2,-1,-1):
+            expected_pts=kernel.expectation(next_values)
+            expected_pts.take(subrolls.indices,out=candidates)
+            maximum.reduceat(candidates,starts,out=values)
+            working=next_values.nbytes+values.nbytes+candidates.nbytes+expected_pts.nbytes
+            if turn in self.turns:
+                #The first or last optimal set of kept dice in
+                #each roll's segment.
+                optimal=eql_floats(candidates,values[subrolls.rows])
+                if self.tie_break=='fewest':
+                    chosen=minimum.reduceat(where(optimal,arange(n_subrolls),n_subrolls),starts)
+                else:
+                    chosen=maximum.reduceat(where(optimal,arange(n_subrolls),-1),starts)
+                working+=optimal.nbytes+chosen.nbytes
+                self._policy[turn]=subrolls.indices[chosen].astype(policy_type)
+                self._values[turn]=values.copy()
+                stored_bytes+=self._policy[turn].nbytes+self._values[turn].nbytes
+            working_bytes=max(working_bytes,working+stored_bytes)
+            #The row just solved is the next turn's next row.
+            if next_values is self.points:
+                next_values=values
+                values=zeros(table.num_rolls)
+            else:
+                next_values, values=values, next_values
+        if self.n_rolls==1:
+            next_values=self.points
+
+        weights=table.roll_weights
+        self.expected=float(dot(weights,next_values))/float(weights.sum())
+        self.values=dict((turn,RollDict(table,row)) for turn, row in self._values.items())
+        self.strategy=dict((turn,PolicyDict(table,policy)) for turn, policy in self._policy.items())
+        self.memory=MemoryUsage(working_bytes,stored_bytes,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024)
+
+    def advise(self,turn,roll):
+        """
+        Same as Widget.advise, for the turns in self.turns,
+        (counting from 1 here, as in Widget.advise).
+        """
+        turn=parse_int(turn,"turn",1,self.n_rolls)-1
+        if turn not in self.turns:
+            print >> sys.stderr, "Error in BoundedWidget.advise: the strategy for turn", turn+1, "was not kept."
+            exit()
+        r=tuple(sort(roll))
+        if len(r)!=self.n_dice or self.table.index(r)==None:
+            print >> sys.stderr, "Error in BoundedWidget.advise:", roll, "not a valid roll."
+            exit()
+        if turn==self.n_rolls-1:
+            print "Score:", self.values[turn][r]
+        else:
+            print "Dice to keep:", self.strategy[turn][r][0]
+            print ""
+            print "Expected number of points:", self.values[turn][r]
+
+class PolicyDict(Mapping):
+    """
+    Read-only dictionary-like view of a compact strategy,
+    (see BoundedWidget), like StrategyDict: the value for each
+    roll is a list of one sorted tuple of dice to keep.
+    """
+    def __init__(self,table,policy):
+        self.table=table
+        self.policy=policy
+
+    def __getitem__(self,roll):
+        i=self.table.index(roll)
+        if i==None:
+            raise KeyError(roll)
+        return [self.table.keep_tuples[self.policy[i]]]
+
+    def __iter__(self):
+        return iter(self.table.roll_tuples)
+
+    def __len__(self):
+        return self.table.num_rolls
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    #Same values, expected points and strategy as Widget, for
+    #the turns that are kept.
+    for combo, n_rolls in [('yahtzee',3),('full house weighted',6),('small straight',1)]:
+        w=Widget(combo,n_rolls=n_rolls)
+        turns=range(n_rolls)
+        for tie_break, pick in [('fewest',0),('most',-1)]:
+            b=BoundedWidget(combo,n_rolls=n_rolls,turns=turns,tie_break=tie_break)
+            assert(b.expected==w.expected)
+            for turn in turns:
+                assert((b._values[turn]==w._values[turn]).all())
+            for turn in turns[:-1]:
+                indptr, indices=w._strategy[turn]
+                assert((b._policy[turn]==indices[indptr[1:]-1 if pick==-1 else indptr[:-1]]).all())
+            assert(b.strategy.keys()==turns[:-1])
+    w=Widget('full house weighted',n_rolls=6)
+    b=BoundedWidget('full house weighted',n_rolls=6,turns=[2])
+    assert(b.values.keys()==[2] and b.strategy[2][(1,1,4,5,6)]==w.strategy[2][(1,1,4,5,6)][:1])
+    assert(b._policy[2].dtype==uint16)
+    b=BoundedWidget('yahtzee',probs=[1,1,1,1,1,2])
+    assert(b.expected==Widget('yahtzee',probs=[1,1,1,1,1,2]).expected)
+
+    #The memory kept doesn't grow with the number of rolls.
+    usage=[BoundedWidget('yahtzee',n_dice=6,n_faces=8,n_rolls=n_rolls).memory for n_rolls in [5,50]]
+    assert(usage[0].working_bytes==usage[1].working_bytes)
+    w=Widget('yahtzee',n_dice=6,n_faces=8,n_rolls=50)
+    full_bytes=w._values.nbytes+w._keep_values.nbytes+sum([indptr.nbytes+indices.nbytes for indptr, indices in w._strategy])
+    print "50 rolls: %d bytes of working arrays, versus %d for Widget" % (usage[1].working_bytes,full_bytes)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+Streaming export of the whole strategy table of a solved
+Widget, (self.values and self.strategy for every roll at every
+turn), as CSV or as columns of binary arrays, a chunk of
+rolls at a time.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+from numpy import *
+from numpy.lib.format import open_memmap
+import sys
+import os
+import csv
+import tempfile
+from collections import namedtuple
+from widget_class import Widget, CountWidget, CountTable, counts_to_multisets, parse_int, eql_floats
+
+#-----------------------
+#Globals
+#-----------------------
+
+#One chunk of the strategy table of one turn, straight from
+#the solver's arrays: rolls are the indices of the rolls,
+#(numbered as in RollTable), counts[j] is the number of
+#times each face appears in roll rolls[j], expected[j] is
+#its expected number of points, and the indices of its
+#optimal sets of kept dice are keeps[indptr[j]:indptr[j+1]],
+#(none at the last turn).
+StrategyChunk=namedtuple('StrategyChunk',['turn','rolls','counts','expected','indptr','keeps'])
+
+#Columns written by write_columns, each a .npy file.
+columns=['turn','roll','roll_counts','expected','keep_indptr','keep','keep_counts']
+
+#-----------------------
+#Functions
+#-----------------------
+
+def strategy_chunks(widget,chunk=1<<16,turns=None):
+    """
+    Generator of StrategyChunks covering the rolls of the
+    solved widget at each turn in turns, (all of them by
+    default, including the last, whose expected points are
+    the point values), 'chunk' rolls at a time, in roll index
+    order.
+
+    Only one chunk is built at a time, so the memory used
+    doesn't grow with the size of the table beyond the
+    solver's own arrays.  The optimal sets of kept dice are
+    sliced out of widget._strategy if it is filled in, and
+    otherwise, (for a CountWidget, or a Widget solved with
+    compute_symmetric), found for the chunk from
+    widget._keep_values, without filling in the whole
+    strategy.
+    """
+    chunk=parse_int(chunk,"chunk",1)
+    if widget.lazy:
+        widget.compute_strategy()
+    table=widget.table
+    if turns==None:
+        turns=range(widget.n_rolls)
+    for turn in turns:
+        if turn<0 or turn>=widget.n_rolls:
+            print >> sys.stderr, "Error in strategy_chunks: turn", turn, "out of range."
+            exit()
+        for start in range(0,table.num_rolls,chunk):
+            stop=min(start+chunk,table.num_rolls)
+            rolls=arange(start,stop)
+            if turn==widget.n_rolls-1:
+                indptr=zeros(stop-start+1,dtype=int)
+                keeps=zeros(0,dtype=int)
+            else:
+                indptr, keeps=optimal_keeps(widget,turn,start,stop)
+            yield StrategyChunk(turn,rolls,table.counts[start:stop],asarray(widget._values[turn,start:stop]),indptr,keeps)
+
+def optimal_keeps(widget,turn,start,stop,max_subrolls=1<<18):
+    """
+    Returns (indptr,keeps), listing the indices of the optimal
+    sets of kept dice at turn 'turn' for the rolls with
+    indices from start to stop-1, in the format of
+    StrategyChunk.  When they have to be found from
+    widget._keep_values, the rolls are split into pieces with
+    at most about max_subrolls sets of dice that can be kept
+    from them in total, (with many dice and faces, a roll can
+    have thousands).
+    """
+    if isinstance(widget,CountWidget) or widget._strategy_pending:
+        table=widget.table
+        #Same as CountStrategyDict, for many rolls at once.
+        n_subrolls=prod(table.counts[start:stop].astype(int)+1,axis=1)
+        pieces=flatnonzero(diff(cumsum(n_subrolls)//max_subrolls))+1
+        bounds=[start]+list(start+pieces)+[stop]
+        indptr=zeros(stop-start+1,dtype=int)
+        keeps=[]
+        for lo, hi in zip(bounds[:-1],bounds[1:]):
+            if lo==hi:
+                continue
+            piece_indptr, piece_keeps=table.subroll_keeps(arange(lo,hi))
+            rows=repeat(arange(hi-lo),diff(piece_indptr))
+            optimal=eql_floats(widget._keep_values[turn,piece_keeps],asarray(widget._values[turn,lo:hi])[rows])
+            indptr[lo-start+1:hi-start+1]=bincount(rows[optimal],minlength=hi-lo)
+            keeps.append(piece_keeps[optimal])
+        return cumsum(indptr),hstack(keeps) if len(keeps)>0 else zeros(0,dtype=int)
+    indptr, indices=widget._strategy[turn]
+    lo=indptr[start]
+    hi=indptr[stop]
+    return asarray(indptr[start:stop+1])-lo,asarray(indices[lo:hi])
+
+def strategy_records(widget,chunk=1<<16,turns=None):
+    """
+    Generator of lists of records (turn,roll,expected,keeps),
+    one list per chunk of strategy_chunks, where roll is a
+    sorted tuple, expected is its expected number of points,
+    and keeps is the list of optimal sets of kept dice as
+    sorted tuples, (the same as widget.values[turn][roll] and
+    widget.strategy[turn][roll]).
+    """
+    table=widget.table
+    for c in strategy_chunks(widget,chunk,turns):
+        rolls=counts_to_multisets(c.counts.astype(int)).tolist()
+        keeps=keep_tuples(table,c.keeps)
+        yield [(c.turn,tuple(rolls[j]),float(c.expected[j]),keeps[c.indptr[j]:c.indptr[j+1]]) for j in range(len(rolls))]
+
+def keep_tuples(table,keeps):
+    """
+    Returns the list of the sets of kept dice with indices in
+    the array keeps, as sorted tuples, converting all of the
+    sets with the same number of dice at once.
+    """
+    result=[None]*len(keeps)
+    sizes=searchsorted(table.keep_offsets,keeps,side='right')-1
+    for m in unique(sizes):
+        positions=flatnonzero(sizes==m)
+        if isinstance(table,CountTable):
+            dice=counts_to_multisets(table.keep_counts[keeps[positions]].astype(int))
+        else:
+            dice=table.multisets[m][keeps[positions]-table.keep_offsets[m]]
+        for p, d in zip(positions,dice.tolist()):
+            result[p]=tuple(d)
+    return result
+
+def format_dice(dice):
+    """
+    Formats a sorted tuple of dice for write_csv: the faces
+    separated by spaces, or '-' for no dice.
+    """
+    if len(dice)==0:
+        return '-'
+    return ' '.join(map(str,dice))
+
+def write_csv(widget,path,chunk=1<<16,turns=None):
+    """
+    Writes the strategy table of the solved widget to the CSV
+    file 'path', (or to path itself if it is a file object),
+    one row per roll per turn, (see strategy_records), with
+    the columns turn, roll, expected and keeps.  Dice are
+    formatted by format_dice, and the optimal sets of kept
+    dice are separated by '|'.  Returns the number of rows
+    written, (not counting the header).
+    """
+    if isinstance(path,basestring):
+        with open(path,'wb') as f:
+            return write_csv(widget,f,chunk,turns)
+    writer=csv.writer(path)
+    writer.writerow(['turn','roll','expected','keeps'])
+    n_rows=0
+    for records in strategy_records(widget,chunk,turns):
+        writer.writerows([(turn,format_dice(roll),repr(expected),'|'.join(map(format_dice,keeps))) for turn, roll, expected, keeps in records])
+        n_rows+=len(records)
+    return n_rows
+
+def write_columns(widget,directory,chunk=1<<16,turns=None):
+    """
+    Writes the strategy table of the solved widget as one .npy
+    file per column in 'directory', (created if needed), which
+    can be memory-mapped with numpy.load(path,mmap_mode='r').
+    Row r of the table is one roll at one turn:
+    - turn[r], roll[r] = the turn and roll index
+    - roll_counts[r] = the number of times each face appears
+      in the roll
+    - expected[r] = its expected number of points
+    - keep[keep_indptr[r]:keep_indptr[r+1]] = the indices of its
+      optimal sets of kept dice, and keep_counts[k] is the
+      number of times each face appears in the set of kept
+      dice with index k.
+    The columns are written a chunk at a time through
+    memory maps, so the memory used stays flat.  The number of
+    optimal sets of kept dice isn't known until they have all
+    been found, so keep is written to a temporary file first,
+    and copied into place at the end.  Returns the number of
+    rows.
+    """
+    if turns==None:
+        turns=range(widget.n_rolls)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    table=widget.table
+    n_faces=widget.n_faces
+    n_rows=len(turns)*table.num_rolls
+    count_type=uint8 if widget.n_dice<256 else uint16
+    def column(name,dtype,shape):
+        return open_memmap(os.path.join(directory,name+'.npy'),mode='w+',dtype=dtype,shape=shape)
+
+    turn_col=column('turn',int16,(n_rows,))
+    roll_col=column('roll',int64,(n_rows,))
+    counts_col=column('roll_counts',count_type,(n_rows,n_faces))
+    expected_col=column('expected',float64,(n_rows,))
+    indptr_col=column('keep_indptr',int64,(n_rows+1,))
+    indptr_col[0]=0
+    n_keeps=0
+    row=0
+    with tempfile.TemporaryFile() as keep_file:
+        for c in strategy_chunks(widget,chunk,turns):
+            n=len(c.rolls)
+            turn_col[row:row+n]=c.turn
+            roll_col[row:row+n]=c.rolls
+            counts_col[row:row+n]=c.counts
+            expected_col[row:row+n]=c.expected
+            indptr_col[row+1:row+n+1]=n_keeps+c.indptr[1:]
+            c.keeps.astype(int64).tofile(keep_file)
+            n_keeps+=len(c.keeps)
+            row+=n
+        keep_col=column('keep',int64,(n_keeps,))
+        keep_file.seek(0)
+        step=max(chunk,1<<16)
+        for start in range(0,n_keeps,step):
+            keep_col[start:start+step]=fromfile(keep_file,dtype=int64,count=min(step,n_keeps-start))
+        del keep_col
+
+    keep_counts_col=column('keep_counts',count_type,(table.num_keeps,n_faces))
+    for m in range(widget.n_dice+1):
+        block=slice(table.keep_offsets[m],table.keep_offsets[m+1])
+        if isinstance(widget,CountWidget):
+            keep_counts_col[block]=table.keep_counts[block]
+        else:
+            keep_counts_col[block]=[bincount(k,minlength=n_faces+1)[1:] for k in table.multisets[m]]
+    for col in [turn_col,roll_col,counts_col,expected_col,indptr_col,keep_counts_col]:
+        col.flush()
+    return n_rows
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    import shutil
+    from StringIO import StringIO
+
+    #The records are the same as looking up every roll, for
+    #every way of solving, and don't depend on the chunk size.
+    for w in [Widget('full house',n_rolls=4),Widget('yahtzee',symmetry=True),CountWidget('small straight')]:
+        n=0
+        for records in strategy_records(w,chunk=100):
+            for turn, roll, expected, keeps in records:
+                assert(expected==w.values[turn][roll])
+                if turn<w.n_rolls-1:
+                    assert(keeps==list(w.strategy[turn][roll]))
+                else:
+                    assert(keeps==[])
+                n+=1
+        assert(n==w.n_rolls*w.table.num_rolls)
+        assert(sum([len(r) for r in strategy_records(w,chunk=7,turns=[0])])==w.table.num_rolls)
+
+    w=Widget('yahtzee')
+    f=StringIO()
+    assert(write_csv(w,f,chunk=50)==3*w.table.num_rolls)
+    lines=f.getvalue().splitlines()
+    assert(lines[0]=='turn,roll,expected,keeps')
+    assert(lines[1]=='0,1 1 1 1 1,1.0,1 1 1 1 1')
+    assert(len(lines)==3*w.table.num_rolls+1)
+
+    directory=tempfile.mkdtemp()
+    try:
+        for w in [Widget('four of a kind'),CountWidget('four of a kind')]:
+            write_columns(w,directory,chunk=64)
+            cols=dict((name,load(os.path.join(directory,name+'.npy'),mmap_mode='r')) for name in columns)
+            i=w.table.index((2,3,4,4,4))
+            assert(cols['expected'][i]==w.values[0][(2,3,4,4,4)])
+            assert((cols['roll_counts'][i]==[0,1,1,3,0,0]).all())
+            keeps=cols['keep'][cols['keep_indptr'][i]:cols['keep_indptr'][i+1]]
+            assert([w.table.unrank_keep(k) for k in keeps]==w.strategy[0][(2,3,4,4,4)])
+            assert((cols['keep_counts'][keeps[0]]==[0,0,0,3,0,0]).all())
+            assert(cols['keep_indptr'][-1]==len(cols['keep']))
+            del cols
+    finally:
+        shutil.rmtree(directory)
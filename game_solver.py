@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+Solver for a whole game of solitaire Yahtzee, built out of
+single-turn widgets.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+from numpy import *
+import sys
+import multiprocessing
+from widget_class import Widget, roll_table, solve_expected, combo_points, combos, parse_int, parse_probs, eql_float
+
+#-----------------------
+#Globals
+#-----------------------
+upper_section=['ones','twos','threes','fours','fives','sixes']
+
+#-----------------------
+#Classes
+#-----------------------
+class GameSolver:
+    """
+    Finds the expected final score of a game of solitaire
+    Yahtzee with optimal play, and the expected final score
+    from every state of the scorecard along the way.
+
+    A game is a series of turns.  In each turn you roll the
+    dice as in a Widget, and then score the final roll in
+    one of the categories you haven't used yet, getting the
+    points for the weighted version of that combination,
+    (e.g. 'full house weighted').  If the total of the upper
+    section categories ('ones' to 'sixes') reaches
+    bonus_threshold, you get bonus extra points at the end.
+    (Yahtzee bonuses and joker rules aren't included.)
+
+    The state of the scorecard at the start of a turn is
+    the set of categories already used, as a bitmask over
+    self.categories, and the upper section subtotal, capped
+    at bonus_threshold since that's all that matters.
+    self.state_values[mask,subtotal] is the expected number
+    of points still to be scored from that state, (including
+    the bonus).  Working backward from the full scorecard,
+    the expected points from a state are the expected points
+    of a Widget whose point table gives, for each final roll,
+    the best over unused categories of the points for that
+    category plus the expected points from the state you
+    reach by using it.
+
+    All the states with the same number of categories used
+    only depend on states with more used, so they are solved
+    together, as columns of one matrix (see solve_expected),
+    split over a pool of 'processes' processes.  Point tables
+    that come up more than once, (which is common, e.g. for
+    subtotals that can't change any more), are only solved
+    once, and their solutions are cached in
+    self.turn_cache.
+    """
+    def __init__(self,categories=None,n_dice=5,n_faces=6,n_rolls=3,bonus_threshold=63,bonus=35.,processes=1,probs=None):
+        """
+        categories = list of the names of the combinations
+        on the scorecard, (combos by default), which must
+        have weighted versions, (see register_combo).
+
+        n_dice, n_faces, n_rolls, probs are as for Widget.
+
+        bonus_threshold, bonus = the upper section subtotal
+        needed to get the upper section bonus, and the
+        number of points it is worth.
+
+        processes = number of processes to spread the
+        solving over.
+        """
+        if categories==None:
+            categories=combos
+        self.categories=[c.lower() for c in categories]
+        self.n_dice=parse_int(n_dice,"n_dice",1)
+        self.n_faces=parse_int(n_faces,"n_faces",1)
+        self.n_rolls=parse_int(n_rolls,"n_rolls",1)
+        self.bonus_threshold=parse_int(bonus_threshold,"bonus_threshold",0)
+        self.bonus=bonus
+        self.processes=parse_int(processes,"processes",1)
+        self.probs=parse_probs(probs,self.n_faces)
+
+        for c in self.categories:
+            if c+' weighted' not in combo_points:
+                print >> sys.stderr, "Error in GameSolver.__init__:", c, "not a valid combination."
+                exit()
+
+        self.table=roll_table(self.n_dice,self.n_faces,self.probs)
+        #self.scores[c] is the number of points for each roll
+        #in category c.
+        self.scores=array([combo_points[c+' weighted'](self.table) for c in self.categories])
+        #Upper section categories, and the number of points
+        #they can score.
+        self.upper=[i for i, c in enumerate(self.categories) if c in upper_section]
+        self.n_categories=len(self.categories)
+        self.full_mask=(1<<self.n_categories)-1
+
+        self.state_values=None
+        self.turn_cache={}
+
+    def reachable_subtotals(self,mask):
+        """
+        Returns the array of (capped) upper section subtotals
+        that are possible once the categories in mask have
+        been used.
+        """
+        cap=self.bonus_threshold
+        reachable=zeros(cap+1,dtype=bool)
+        reachable[0]=True
+        for c in self.upper:
+            if mask&(1<<c):
+                points=unique(self.scores[c]).astype(int)
+                new=zeros(cap+1,dtype=bool)
+                for p in points:
+                    new[minimum(flatnonzero(reachable)+p,cap)]=True
+                reachable=new
+        return flatnonzero(reachable)
+
+    def turn_points(self,masks,subtotals):
+        """
+        Returns the point tables for the turns starting from
+        the states (masks[j],subtotals[j]), as the columns of
+        an array of shape (num_rolls,len(masks)): for each
+        final roll, the best over the unused categories of
+        the points for it plus the expected points from the
+        state you reach.  Needs self.state_values for all the
+        states with more categories used.
+        """
+        cap=self.bonus_threshold
+        points=zeros((self.table.num_rolls,len(masks)))-inf
+        for c in range(self.n_categories):
+            unused=flatnonzero(masks&(1<<c)==0)
+            if len(unused)==0:
+                continue
+            next_masks=masks[unused]|(1<<c)
+            score=self.scores[c].reshape(-1,1)
+            if c in self.upper:
+                next_subtotals=minimum(subtotals[unused].reshape(1,-1)+score.astype(int),cap)
+            else:
+                next_subtotals=subtotals[unused].reshape(1,-1)
+            points[:,unused]=maximum(points[:,unused],score+self.state_values[next_masks.reshape(1,-1),next_subtotals])
+        return points
+
+    def solve(self):
+        """
+        Computes self.state_values for every reachable state,
+        and returns the expected final score of the game,
+        self.expected.
+        """
+        cap=self.bonus_threshold
+        self.state_values=zeros((self.full_mask+1,cap+1))+nan
+        self.state_values[self.full_mask]=where(arange(cap+1)>=cap,self.bonus,0.)
+
+        #Solve the states with the most categories used first.
+        n_used=array([bin(m).count('1') for m in range(self.full_mask+1)])
+        pool=None
+        if self.processes>1:
+            #Build the shared tables before forking.
+            self.table.subrolls
+            pool=multiprocessing.Pool(self.processes)
+        try:
+            for used in range(self.n_categories-1,-1,-1):
+                masks=[]
+                subtotals=[]
+                for mask in flatnonzero(n_used==used):
+                    s=self.reachable_subtotals(mask)
+                    masks.append(zeros(len(s),dtype=int)+mask)
+                    subtotals.append(s)
+                masks=hstack(masks)
+                subtotals=hstack(subtotals)
+                self.state_values[masks,subtotals]=self.solve_turns(self.turn_points(masks,subtotals),pool)
+            if pool!=None:
+                pool.close()
+        finally:
+            if pool!=None:
+                pool.terminate()
+                pool.join()
+
+        self.expected=self.state_values[0,0]
+        return self.expected
+
+    def solve_turns(self,points,pool=None,chunk=2048):
+        """
+        Returns the expected number of points for each of the
+        point tables in the columns of points, looking them up
+        in self.turn_cache if they have been solved before, and
+        solving the rest in chunks of 'chunk' tables, in pool
+        if given.
+        """
+        columns=ascontiguousarray(points.T)
+        keys=[column.tostring() for column in columns]
+        new={}
+        for j, key in enumerate(keys):
+            if key not in self.turn_cache and key not in new:
+                new[key]=j
+        if len(new)>0:
+            new_keys=new.keys()
+            new_points=columns[[new[key] for key in new_keys]].T
+            chunks=[(new_points[:,i:i+chunk],self.n_dice,self.n_faces,self.n_rolls,self.probs) for i in range(0,len(new_keys),chunk)]
+            if pool!=None:
+                expected=hstack(pool.map(_solve_chunk,chunks))
+            else:
+                expected=hstack(map(_solve_chunk,chunks))
+            self.turn_cache.update(zip(new_keys,expected))
+        return array([self.turn_cache[key] for key in keys])
+
+    def best_category(self,mask,subtotal,roll):
+        """
+        Returns the category to score roll in, at the end of
+        a turn starting from the state (mask,subtotal), and the
+        expected final points still to come, (including the
+        points for roll).  Needs solve to have been called.
+        """
+        i=self.table.index(tuple(sorted(roll)))
+        best=None
+        for c in range(self.n_categories):
+            if mask&(1<<c):
+                continue
+            score=self.scores[c,i]
+            next_subtotal=min(subtotal+int(score),self.bonus_threshold) if c in self.upper else subtotal
+            value=score+self.state_values[mask|(1<<c),next_subtotal]
+            if best==None or value>best[1]:
+                best=(self.categories[c],value)
+        return best
+
+    def turn_widget(self,mask,subtotal):
+        """
+        Returns a Widget for the turn starting from the state
+        (mask,subtotal), whose strategy tells you which dice to
+        keep to maximize the expected final score.  Needs solve
+        to have been called.
+        """
+        points=self.turn_points(array([mask]),array([subtotal]))[:,0]
+        return Widget(dict(zip(self.table.roll_tuples,points)),self.n_dice,self.n_faces,self.n_rolls,probs=self.probs)
+
+#-----------------------
+#Functions
+#-----------------------
+
+def _solve_chunk(args):
+    """
+    Solves one chunk of point tables for GameSolver.solve_turns.
+    """
+    points, n_dice, n_faces, n_rolls, probs=args
+    return solve_expected(points,n_dice,n_faces,n_rolls,probs)
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    #With one category, the game is one turn.
+    g=GameSolver(['yahtzee'])
+    assert(eql_float(g.solve(),Widget('yahtzee weighted').expected))
+    #The upper section bonus is just extra points for the
+    #rolls that reach bonus_threshold.
+    g=GameSolver(['fives'],bonus_threshold=15,bonus=100.)
+    rolls=g.table.roll_tuples
+    points=dict((roll,5.*roll.count(5)+100.*(roll.count(5)>=3)) for roll in rolls)
+    assert(eql_float(g.solve(),Widget(points).expected))
+
+    #With two categories, the first turn is a Widget whose
+    #points are the best of scoring each category now plus
+    #the expected points of the other next turn.
+    g=GameSolver(['chance','yahtzee'])
+    g.solve()
+    yahtzee_only=Widget('yahtzee weighted').expected
+    chance_only=Widget('chance weighted').expected
+    points={}
+    for roll in rolls:
+        points[roll]=max(sum(roll)+yahtzee_only,50.*(len(set(roll))==1)+chance_only)
+    assert(eql_float(g.expected,Widget(points).expected))
+    assert(g.best_category(0,0,(6,6,6,6,6))[0]=='yahtzee')
+    assert(g.best_category(0,0,(1,2,3,5,6))[0]=='yahtzee')
+
+    #Loaded dice work the same way.
+    p=[1,1,1,2,2,3]
+    g=GameSolver(['yahtzee'],probs=p)
+    assert(eql_float(g.solve(),Widget('yahtzee weighted',probs=p).expected))
+
+    #Several processes give the same answer as one.
+    g1=GameSolver(['ones','twos','threes','chance'],bonus_threshold=10)
+    g2=GameSolver(['ones','twos','threes','chance'],bonus_threshold=10,processes=2)
+    assert(g1.solve()==g2.solve())
+
+    if len(sys.argv)>1 and sys.argv[1]=='full':
+        import time
+        start=time.time()
+        g=GameSolver(processes=multiprocessing.cpu_count())
+        print "Expected score of a full game =", g.solve(), "(%.0f seconds)" % (time.time()-start)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Monte Carlo simulation of turns played with the optimal
+strategy of a solved Widget, many turns at a time.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+from numpy import *
+import sys
+from collections import namedtuple
+from widget_class import Widget, tie_breaks, parse_int
+
+#-----------------------
+#Globals
+#-----------------------
+
+#Summary of a simulation.  scores is the array of points
+#scored in each simulated turn, (or None if it wasn't kept),
+#expected is Widget.expected, and z is the number of standard
+#errors that mean is away from expected.
+SimulationResult=namedtuple('SimulationResult',['n_turns','mean','std','stderr','min','max','expected','z','scores'])
+
+#-----------------------
+#Classes
+#-----------------------
+class Simulator:
+    """
+    Plays turns with the optimal strategy of a solved Widget,
+    with all of the turns in a batch played at once as numpy
+    arrays of roll and keep indices, (numbered as in
+    RollTable), rather than one at a time through
+    Widget.advise.
+
+    Each roll is sampled in one step from the set of dice
+    kept, (starting from keeping none).  Rolling the other
+    n_dice-m dice has n_faces**(n_dice-m) equally likely
+    outcomes, so if there aren't too many of them in total,
+    they are all listed in self.outcomes, the roll index of
+    each outcome from each set of kept dice, (the rolls of
+    the rows of the transition kernel, each repeated by its
+    multiplicity), and sampling is a single lookup at a
+    uniformly random position (see uniform_below) in a set
+    of kept dice's segment of self.outcomes.  Otherwise, or
+    if the dice are loaded, (so the outcomes aren't equally
+    likely), a roll is sampled by searching the cumulative
+    probabilities of the transition kernel.
+
+    tie_break decides which set of kept dice to use when the
+    strategy has more than one: 'fewest' keeps the fewest
+    dice (the first in keep index order), 'most' keeps the
+    most dice (the last), and 'random' picks one of them at
+    random for each turn.  With 'fewest' or 'most', the
+    segment of self.outcomes to sample from for each roll at
+    each turn is looked up directly, without finding the set
+    of kept dice.
+    """
+    def __init__(self,widget,tie_break='fewest',max_outcomes=1<<24):
+        """
+        widget = a solved Widget, (a lazy Widget is solved
+        completely first).  CountWidgets aren't supported,
+        since their strategy isn't listed for every roll.
+
+        tie_break = one of tie_breaks (see above).
+
+        max_outcomes = largest number of outcomes to list in
+        self.outcomes, (8 bytes each).
+        """
+        if tie_break not in tie_breaks:
+            print >> sys.stderr, "Error in Simulator.__init__: tie_break must be one of", ", ".join(tie_breaks)
+            exit()
+        if not hasattr(widget,'_strategy') or len(widget._strategy)!=widget.n_rolls-1:
+            print >> sys.stderr, "Error in Simulator.__init__: widget has no strategy to simulate."
+            exit()
+        if widget.lazy:
+            widget.compute_strategy()
+        widget.expand_strategy()
+        self.widget=widget
+        self.tie_break=tie_break
+        self.n_rolls=widget.n_rolls
+        self.points=asarray(widget._values[-1])
+        self.strategy=[(asarray(indptr,dtype=intp),asarray(indices,dtype=intp)) for indptr, indices in widget._strategy]
+
+        kernel=widget.kernel
+        counts=kernel.counts
+        #self.sizes[k] is the number of equally likely outcomes
+        #of re-rolling the dice not kept in keep k, and
+        #self.offsets[k] is where they start in self.outcomes.
+        self.sizes=kernel.denominators.astype(uint64)
+        if widget.table.probs is None and self.sizes.sum()<=max_outcomes:
+            self.outcomes=repeat(counts.indices,counts.data.astype(intp)).astype(intp)
+            self.offsets=zeros(len(self.sizes),dtype=intp)
+            self.offsets[1:]=cumsum(self.sizes)[:-1]
+            self.cdf=None
+        else:
+            #self.cdf[j] is k plus the probability of getting
+            #one of the rolls up to the jth entry of row k of
+            #the transition kernel, so that searching for k+u
+            #finds a roll from keep k with the right
+            #probabilities.
+            self.outcomes=None
+            rows=repeat(arange(counts.shape[0]),diff(counts.indptr))
+            cum=cumsum(counts.data)
+            before=hstack(([0.],cum))[counts.indptr[:-1]][rows]
+            self.cdf=rows+(cum-before)/kernel.denominators[rows]
+            self.cdf[counts.indptr[1:]-1]=rows[counts.indptr[1:]-1]+1.
+            self.roll_indices=counts.indices.astype(intp)
+
+        #With a fixed tie break, the strategy at each turn is
+        #one set of kept dice per roll.
+        self.policy=[]
+        for indptr, indices in self.strategy:
+            if tie_break=='fewest':
+                self.policy.append(indices.take(indptr[:-1]))
+            elif tie_break=='most':
+                self.policy.append(indices.take(indptr[1:]-1))
+            else:
+                self.policy.append(None)
+        if self.outcomes is not None:
+            self.policy_segments=[None if keeps is None else (self.offsets.take(keeps),self.sizes.take(keeps)) for keeps in self.policy]
+
+    def roll(self,keeps,rng):
+        """
+        Returns the indices of the rolls reached by re-rolling
+        the dice not in the sets of kept dice whose indices are
+        in the array keeps.
+        """
+        if self.outcomes is not None:
+            return self.outcomes.take(self.offsets.take(keeps)+uniform_below(self.sizes.take(keeps),rng))
+        positions=searchsorted(self.cdf,keeps+rng.random_sample(len(keeps)),side='right')
+        return self.roll_indices.take(minimum(positions,len(self.cdf)-1))
+
+    def keep(self,turn,rolls,rng):
+        """
+        Returns the indices of the sets of kept dice chosen by
+        the strategy at turn 'turn' for the rolls whose indices
+        are in the array rolls.
+        """
+        policy=self.policy[turn]
+        if policy is not None:
+            return policy.take(rolls)
+        indptr, indices=self.strategy[turn]
+        starts=indptr.take(rolls)
+        lengths=(indptr.take(rolls+1)-starts).astype(uint64)
+        return indices.take(starts+uniform_below(lengths,rng))
+
+    def play(self,n_turns,rng):
+        """
+        Plays n_turns turns, and returns the array of the
+        number of points scored in each.
+        """
+        if self.outcomes is not None:
+            #Every turn starts by rolling all of the dice, (keep
+            #0), whose outcomes start at 0.
+            rolls=self.outcomes.take(uniform_below(zeros(n_turns,dtype=uint64)+self.sizes[0],rng))
+        else:
+            rolls=self.roll(zeros(n_turns,dtype=intp),rng)
+        for turn in range(self.n_rolls-1):
+            if self.outcomes is not None and self.policy[turn] is not None:
+                offsets, sizes=self.policy_segments[turn]
+                rolls=self.outcomes.take(offsets.take(rolls)+uniform_below(sizes.take(rolls),rng))
+            else:
+                rolls=self.roll(self.keep(turn,rolls,rng),rng)
+        return self.points.take(rolls)
+
+    def run(self,n_turns,seed=None,chunk=1<<20,keep_scores=True):
+        """
+        Simulates n_turns turns, 'chunk' at a time so that the
+        memory used doesn't grow with n_turns, and returns a
+        SimulationResult.  seed seeds the random number
+        generator, so that runs with the same seed (and chunk)
+        give the same scores.  If keep_scores is False, only
+        the summary statistics are returned, (scores is None).
+        """
+        n_turns=parse_int(n_turns,"n_turns",1)
+        chunk=parse_int(chunk,"chunk",1)
+        rng=random.RandomState(seed)
+        scores=zeros(n_turns) if keep_scores else None
+        total=0.
+        total_sq=0.
+        lo=inf
+        hi=-inf
+        for start in range(0,n_turns,chunk):
+            s=self.play(min(chunk,n_turns-start),rng)
+            if keep_scores:
+                scores[start:start+len(s)]=s
+            total+=s.sum()
+            total_sq+=dot(s,s)
+            lo=min(lo,s.min())
+            hi=max(hi,s.max())
+        mean=total/n_turns
+        std=sqrt(max(total_sq/n_turns-mean*mean,0.)*n_turns/max(n_turns-1,1))
+        stderr=std/sqrt(n_turns)
+        expected=self.widget.expected
+        z=(mean-expected)/stderr if stderr>0. else (0. if mean==expected else inf)
+        return SimulationResult(n_turns,mean,std,stderr,lo,hi,expected,z,scores)
+
+#-----------------------
+#Functions
+#-----------------------
+
+def uniform_below(sizes,rng):
+    """
+    Returns an array of independent random integers, each
+    uniformly distributed from 0 to sizes[i]-1, where sizes is
+    an array of type uint64 with entries from 1 to 2**32.
+
+    Each integer is the top 32 bits of a random 32 bit
+    integer times sizes[i], which is exactly uniform once
+    the few products whose bottom 32 bits fall in a range of
+    size 2**32 % sizes[i] are drawn again, (Lemire's method).
+    This is much faster than scaling random floats.
+    """
+    products=rng.randint(0,1<<32,len(sizes),dtype=uint32)*sizes
+    result=(products>>uint64(32)).view(intp)
+    #Only products with low<sizes can need to be drawn again.
+    low=products&uint64(0xffffffff)
+    suspect=flatnonzero(low<sizes)
+    if len(suspect)>0:
+        s=sizes[suspect]
+        redraw=suspect[low[suspect]<(uint64(1<<32)-s)%s]
+        if len(redraw)>0:
+            result[redraw]=uniform_below(sizes[redraw],rng)
+    return result
+
+def simulate(widget,n_turns,seed=None,tie_break='fewest',chunk=1<<20,keep_scores=True):
+    """
+    Simulates n_turns turns played with the optimal strategy
+    of widget, and returns a SimulationResult (see
+    Simulator.run).
+    """
+    return Simulator(widget,tie_break).run(n_turns,seed,chunk,keep_scores)
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    import time
+
+    #The mean score agrees with Widget.expected, for every
+    #tie break, and whichever way rolls are sampled.
+    w=Widget('full house weighted')
+    for tie_break in tie_breaks:
+        r=simulate(w,10**6,seed=1,tie_break=tie_break)
+        assert(abs(r.z)<5.)
+        r=Simulator(w,tie_break,max_outcomes=0).run(10**5,seed=2)
+        assert(abs(r.z)<5.)
+
+    #The same seed gives the same scores.
+    r1=simulate(w,1000,seed=3,tie_break='random')
+    r2=simulate(w,1000,seed=3,tie_break='random')
+    assert((r1.scores==r2.scores).all())
+
+    #Turns with one roll are just rolls.
+    r=simulate(Widget('yahtzee',n_rolls=1),10**6,seed=4,keep_scores=False)
+    assert(r.scores==None and abs(r.z)<5.)
+
+    #Loaded dice are sampled with their probabilities.
+    r=simulate(Widget('yahtzee',probs=[1,1,1,1,1,3]),10**6,seed=6,keep_scores=False)
+    assert(abs(r.z)<5.)
+
+    sim=Simulator(Widget('yahtzee'))
+    start=time.time()
+    r=sim.run(10**7,seed=5,keep_scores=False)
+    print "%.1f million turns per second, mean %.5f, expected %.5f" % (10./(time.time()-start),r.mean,r.expected)
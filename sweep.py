@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Parameter sweeps of Yahtzee widgets over numbers of dice,
+faces and rolls, and point tables, spread over a pool of
+processes.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+import os
+import time
+import multiprocessing
+from collections import namedtuple
+from widget_class import Widget, solve_batch, roll_table, table_cache, n_multisets, parse_int, combos, combos_weighted, eql_float
+
+#-----------------------
+#Globals
+#-----------------------
+
+#One result of a sweep.  points is the element of points_list
+#that was solved, expected is Widget.expected for it, seconds
+#is the time taken to solve the batch of point tables it
+#was solved with, and path is the file it was saved to with
+#Widget.save, (or None if it wasn't saved).
+SweepResult=namedtuple('SweepResult',['n_dice','n_faces','n_rolls','points','expected','seconds','path'])
+
+#-----------------------
+#Functions
+#-----------------------
+
+def sweep(n_dice_list,n_faces_list,n_rolls_list,points_list,processes=None,save_dir=None):
+    """
+    This generator solves a Widget for every combination of
+    n_dice in n_dice_list, n_faces in n_faces_list, n_rolls
+    in n_rolls_list and points in points_list, and returns
+    an iterator over SweepResults, in the order that the
+    solves finish.
+
+    All of the point tables with the same n_dice, n_faces
+    and n_rolls are solved together with solve_batch, and
+    these batches are spread over a pool of 'processes'
+    processes, (the number of CPUs by default), largest
+    first, so that the pool isn't left waiting on one big
+    batch at the end.  If processes is 1, everything is
+    solved in this process, without a pool, which is useful
+    for testing.
+
+    The RollTables, TransitionKernels and SubrollIndexes
+    for every n_dice and n_faces are built before the pool
+    is started, so that the workers share one read-only
+    copy of them, (the workers are forked from this
+    process), rather than each building their own.
+
+    If save_dir is given, each solved Widget is saved there
+    with Widget.save, and the path is given in the result.
+    """
+    processes=parse_int(processes if processes!=None else multiprocessing.cpu_count(),"processes",1)
+
+    #One task per batch of point tables, largest first.
+    tasks=[]
+    for n_dice in n_dice_list:
+        for n_faces in n_faces_list:
+            for n_rolls in n_rolls_list:
+                tasks.append((n_dice,n_faces,n_rolls,points_list,save_dir))
+    tasks.sort(key=lambda task: sweep_cost(task[0],task[1],task[2]),reverse=True)
+
+    #Build the shared tables, making sure the cache is big
+    #enough to hold all of them until the sweep is done,
+    #(or abandoned), and then giving it back its old size.
+    dims=sorted(set((task[0],task[1]) for task in tasks))
+    maxsize=table_cache.maxsize
+    table_cache.resize(max(maxsize,len(dims)))
+    try:
+        for n_dice, n_faces in dims:
+            roll_table(n_dice,n_faces).subrolls
+
+        if processes==1:
+            for task in tasks:
+                for result in _solve_task(task):
+                    yield result
+            return
+
+        pool=multiprocessing.Pool(processes)
+        try:
+            for results in pool.imap_unordered(_solve_task,tasks):
+                for result in results:
+                    yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        table_cache.resize(maxsize)
+
+def sweep_cost(n_dice,n_faces,n_rolls):
+    """
+    Rough estimate of the work needed to solve a Widget:
+    the number of nonzero entries in the TransitionKernel
+    for n_dice dice with n_faces faces (the number of pairs
+    of a keep and a roll that can be reached from it),
+    times the number of turns of backward induction.
+    """
+    return n_multisets(n_dice,2*n_faces)*max(n_rolls-1,1)
+
+def _solve_task(task):
+    """
+    Solves one batch of point tables for sweep, and returns
+    the list of SweepResults.
+    """
+    n_dice, n_faces, n_rolls, points_list, save_dir=task
+    start=time.time()
+    widgets=solve_batch(points_list,n_dice,n_faces,n_rolls)
+    seconds=time.time()-start
+    results=[]
+    for i, (points,w) in enumerate(zip(points_list,widgets)):
+        path=None
+        if save_dir!=None:
+            path=os.path.join(save_dir,'widget_%d_%d_%d_%d.bin' % (n_dice,n_faces,n_rolls,i))
+            w.save(path)
+        results.append(SweepResult(n_dice,n_faces,n_rolls,points,w.expected,seconds,path))
+    return results
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    #A sweep in a pool gives the same results as a sweep in
+    #this process, and as building the Widgets one by one.
+    points_list=combos+combos_weighted
+    serial=list(sweep([1,3,5],[4,6],[1,2,3],points_list,processes=1))
+    parallel=list(sweep([1,3,5],[4,6],[1,2,3],points_list,processes=4))
+    assert(len(serial)==len(parallel)==3*2*3*len(points_list))
+    key=lambda r: (r.n_dice,r.n_faces,r.n_rolls,points_list.index(r.points))
+    for rs, rp in zip(sorted(serial,key=key),sorted(parallel,key=key)):
+        assert(key(rs)==key(rp))
+        assert(rs.expected==rp.expected)
+    for r in serial[:5]:
+        assert(eql_float(r.expected,Widget(r.points,r.n_dice,r.n_faces,r.n_rolls).expected))
+
+    #The largest batches are solved first.
+    assert(serial[0][:3]==(5,6,3))
+
+    #The cache gets back its size afterwards, even if the
+    #sweep is stopped early.
+    maxsize=table_cache.maxsize
+    list(sweep([1,2],range(1,maxsize/2+3),[2],['chance'],processes=1))
+    assert(table_cache.maxsize==maxsize)
+    results=sweep([1,2],range(1,maxsize/2+3),[2],['chance'],processes=1)
+    results.next()
+    assert(table_cache.maxsize>maxsize)
+    results.close()
+    assert(table_cache.maxsize==maxsize)
+    print "Sweep of", len(serial), "widgets OK"
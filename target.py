@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Strategies that maximize the probability of scoring at least
+a target number of points in a turn, rather than the
+expected number of points, for every target at once.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+from numpy import *
+from widget_class import Widget, solve_widgets, eql_float
+
+#-----------------------
+#Classes
+#-----------------------
+class TargetStrategies:
+    """
+    For a point table, the strategies that maximize the
+    probability of scoring at least T points, for every
+    threshold T at once, (e.g. P('three of a kind weighted'
+    >= 20)), rather than the expected number of points.
+
+    The points are only scored for the final roll, so the
+    probability of reaching T from any roll is the expected
+    value of the indicator point table 1 if points>=T, else 0,
+    and the optimal strategy for T is the strategy of a
+    Widget with those points.  The probability only changes
+    at the point values that occur, so self.thresholds is the
+    sorted array of the distinct point values, and the
+    indicator tables for all of them are solved together in
+    one pass of backward induction, as the columns of one
+    matrix sharing the transition kernel (see solve_widgets).
+
+    self.probabilities[l] is the highest probability of
+    scoring at least self.thresholds[l], and self.widgets[l] is
+    the solved Widget for that threshold, whose values are the
+    probabilities of reaching it from each roll at each turn,
+    and whose strategy maximizes it.
+    """
+    def __init__(self,points,n_dice=5,n_faces=6,n_rolls=3,probs=None):
+        """
+        points, n_dice, n_faces, n_rolls and probs are as for
+        Widget.
+        """
+        w=Widget(points,n_dice,n_faces,n_rolls,compute=False,probs=probs)
+        self.n_rolls=w.n_rolls
+        self.points=w._values[-1].copy()
+        self.thresholds=unique(self.points)
+        self.widgets=[]
+        for threshold in self.thresholds:
+            t=Widget({},w.n_dice,w.n_faces,w.n_rolls,compute=False,probs=w.probs)
+            t._values[-1]=self.points>=threshold
+            self.widgets.append(t)
+        solve_widgets(self.widgets)
+        self.probabilities=array([t.expected for t in self.widgets])
+
+    def threshold_index(self,threshold):
+        """
+        Returns the index in self.thresholds of the smallest
+        threshold at least 'threshold', (scoring at least
+        'threshold' is the same as scoring at least that), or
+        None if no roll scores that many points.
+        """
+        l=searchsorted(self.thresholds,threshold)
+        if l==len(self.thresholds):
+            return None
+        return int(l)
+
+    def probability(self,threshold,turn=None,roll=None):
+        """
+        The highest probability of scoring at least
+        'threshold' points, from the start of the turn, or
+        from roll at turn 'turn' if given.
+        """
+        l=self.threshold_index(threshold)
+        if l==None:
+            return 0.
+        if turn==None:
+            return float(self.probabilities[l])
+        return self.widgets[l].values[turn][tuple(sorted(roll))]
+
+    def widget(self,threshold):
+        """
+        Returns the solved Widget whose strategy maximizes the
+        probability of scoring at least 'threshold' points, (or
+        None if no roll scores that many).
+        """
+        l=self.threshold_index(threshold)
+        if l==None:
+            return None
+        return self.widgets[l]
+
+#-----------------------
+#Functions
+#-----------------------
+
+def solve_targets(points,n_dice=5,n_faces=6,n_rolls=3,probs=None):
+    """
+    Returns the TargetStrategies for points.
+    """
+    return TargetStrategies(points,n_dice,n_faces,n_rolls,probs)
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    s=solve_targets('three of a kind weighted')
+
+    #Each threshold is the same as solving its indicator
+    #table on its own.
+    table=s.widgets[0].table
+    for threshold in [20,s.thresholds[-1]]:
+        indicator=dict(zip(table.roll_tuples,(s.points>=threshold)*1.))
+        w=Widget(indicator)
+        assert(w.expected==s.probability(threshold))
+        assert(w.strategy[0][(1,3,3,5,6)]==s.widget(threshold).strategy[0][(1,3,3,5,6)])
+    #Every roll scores at least the lowest threshold, and none
+    #more than the highest.
+    assert(s.probabilities[0]==1. and s.probability(s.thresholds[-1]+1)==0.)
+    assert((diff(s.probabilities)<=0).all())
+
+    #Aiming for the threshold does at least as well as
+    #maximizing the expected points, and better for some.
+    d=Widget('three of a kind weighted').score_distribution()
+    tail=cumsum(d.probs[::-1])[::-1]
+    for level, p in zip(d.levels,tail):
+        assert(s.probability(level)>=p or eql_float(s.probability(level),p))
+    print "P(three of a kind weighted >= 20) = %.6f, versus %.6f maximizing expected points" % (s.probability(20),tail[searchsorted(d.levels,20)])
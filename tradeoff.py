@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+The trade-off between two point tables: how much of the
+expected number of points for one you give up to get more
+for the other, over all mixtures of the two.
+"""
+
+#-----------------------
+#Imports
+#-----------------------
+from numpy import *
+from widget_class import Widget, roll_table, eql_float, eql_floats
+
+#-----------------------
+#Classes
+#-----------------------
+class Tradeoff:
+    """
+    The Pareto frontier of the expected numbers of points
+    (E_A,E_B) for two point tables A and B, over all
+    strategies, and the mixing weights where the optimal
+    strategy changes.
+
+    The strategy that is optimal for the mixed point table
+    lam*A+(1-lam)*B, for lam from 0 to 1, maximizes
+    lam*E_A+(1-lam)*E_B, so the optimal expected numbers of
+    points are the vertices of the upper right convex hull
+    of all the possible (E_A,E_B), and the optimal strategy
+    only changes at the values of lam where two neighbouring
+    vertices are equally good.  These are found by
+    dichotomic search: starting from the strategies that
+    maximize E_A and E_B, (breaking ties by the other), for
+    each pair of neighbouring vertices found so far, solve
+    the table mixed with the weights for which both are
+    equally good.  If the solution is better, it is a new
+    vertex between them; otherwise they are neighbours on
+    the frontier.  So each vertex takes about two solves,
+    and all of the pairs waiting to be checked are solved
+    together in one batch (see solve_lexicographic), sharing
+    the transition kernel and subroll index.  Expectations
+    are compared within the tolerance of eql_float.
+
+    self.vertices is an array of shape (number of
+    vertices,2) of the (E_A,E_B) on the frontier, in order of
+    decreasing E_A, and self.keeps[v] is an array of shape
+    (n_rolls-1,num_rolls) of the index of the set of dice to
+    keep for each roll at each turn with the strategy for
+    vertex v.  self.breakpoints[v] is the value of lam where
+    vertices v and v+1 are equally good, so vertex v is
+    optimal for lam from self.breakpoints[v] to
+    self.breakpoints[v-1], (taking 1 for v=0 and 0 for the
+    last vertex).  self.solves is the number of point tables
+    solved.
+    """
+    def __init__(self,points_a,points_b,n_dice=5,n_faces=6,n_rolls=3):
+        """
+        points_a, points_b are the two point tables, each
+        anything that can be passed as the points argument of
+        Widget.  n_dice, n_faces, n_rolls are as for Widget.
+        """
+        self.n_dice=n_dice
+        self.n_faces=n_faces
+        self.n_rolls=n_rolls
+        self.points_a=Widget(points_a,n_dice,n_faces,n_rolls,compute=False)._values[-1].copy()
+        self.points_b=Widget(points_b,n_dice,n_faces,n_rolls,compute=False)._values[-1].copy()
+        self.table=roll_table(n_dice,n_faces)
+        a=self.points_a
+        b=self.points_b
+
+        #The ends of the frontier.
+        expected, keeps=solve_lexicographic(stack_tables([[a,b],[b,a]]),n_dice,n_faces,n_rolls)
+        self.solves=2
+        found=[(expected[0,0],expected[0,1],keeps[:,:,0]),(expected[1,1],expected[1,0],keeps[:,:,1])]
+        edges=[]
+        if same_point(found[0],found[1]):
+            found=found[:1]
+        else:
+            pending=[(found[0],found[1])]
+            while len(pending)>0:
+                #Solve every pair waiting to be checked at once,
+                #with weights for which both ends are equally
+                #good, breaking ties by E_A and then E_B.
+                lams=[weight_between(p,q) for p, q in pending]
+                tables=[[lam*a+(1.-lam)*b,a,b] for lam in lams]
+                expected, keeps=solve_lexicographic(stack_tables(tables),n_dice,n_faces,n_rolls)
+                self.solves+=len(pending)
+                next_pending=[]
+                for s, ((p,q),lam) in enumerate(zip(pending,lams)):
+                    r=(expected[s,1],expected[s,2],keeps[:,:,s])
+                    value_p=lam*p[0]+(1.-lam)*p[1]
+                    value_r=lam*r[0]+(1.-lam)*r[1]
+                    if value_r>value_p and not eql_float(value_r,value_p) and not same_point(r,p) and not same_point(r,q):
+                        found.append(r)
+                        next_pending+=[(p,r),(r,q)]
+                    else:
+                        edges.append(lam)
+                pending=next_pending
+
+        found.sort(key=lambda v: -v[0])
+        self.vertices=array([(v[0],v[1]) for v in found])
+        self.keeps=[v[2] for v in found]
+        self.breakpoints=array(sorted(edges,reverse=True))
+
+    def optimal_vertex(self,lam):
+        """
+        Returns the index of the vertex that is optimal for
+        the mixed point table lam*A+(1-lam)*B, (the first one
+        if lam is a breakpoint).
+        """
+        return int((self.breakpoints>lam).sum())
+
+    def expected(self,lam):
+        """
+        Returns (E_A,E_B) for the strategy that is optimal for
+        the mixed point table lam*A+(1-lam)*B.
+        """
+        return tuple(self.vertices[self.optimal_vertex(lam)])
+
+    def value(self,lam):
+        """
+        The expected number of points for the mixed point
+        table lam*A+(1-lam)*B with optimal strategy.
+        """
+        return float((lam*self.vertices[:,0]+(1.-lam)*self.vertices[:,1]).max())
+
+    def widget(self,lam):
+        """
+        Returns a Widget for the mixed point table
+        lam*A+(1-lam)*B.
+        """
+        points=lam*self.points_a+(1.-lam)*self.points_b
+        return Widget(dict(zip(self.table.roll_tuples,points)),self.n_dice,self.n_faces,self.n_rolls)
+
+#-----------------------
+#Functions
+#-----------------------
+
+def solve_lexicographic(points,n_dice=5,n_faces=6,n_rolls=3):
+    """
+    Solves many point tables at once, each with tie
+    breaking objectives.  points is an array of shape
+    (num_rolls,number of tables,number of objectives), and
+    for each table, the strategy maximizes the expected
+    value of the first objective, then among the optimal
+    sets of kept dice, (within the tolerance of eql_floats),
+    the second, and so on, and then keeps the fewest dice.
+    Returns (expected,keeps), where expected[s,j] is the
+    expected value of objective j for table s with this
+    strategy, and keeps[turn,i,s] is the index of the set of
+    dice to keep from the roll with index i at turn 'turn'
+    for table s.
+    """
+    table=roll_table(n_dice,n_faces)
+    kernel=table.kernel
+    subrolls=table.subrolls
+    num_rolls, n_tables, n_objectives=points.shape
+    starts=subrolls.indptr[:-1]
+    rows=subrolls.rows
+    n_subrolls=len(subrolls.indices)
+    values=points
+    keeps=zeros((n_rolls-1,num_rolls,n_tables),dtype=int)
+    for turn in range(n_rolls-2,-1,-1):
+        expected_pts=kernel.expectation(values.reshape(num_rolls,-1)).reshape(-1,n_tables,n_objectives)
+        candidates=expected_pts[subrolls.indices]
+        optimal=ones((n_subrolls,n_tables),dtype=bool)
+        for j in range(n_objectives):
+            best=maximum.reduceat(where(optimal,candidates[:,:,j],-inf),starts,axis=0)
+            optimal&=eql_floats(candidates[:,:,j],best[rows])
+        #The first optimal set of kept dice in each roll's
+        #segment.
+        chosen=minimum.reduceat(where(optimal,arange(n_subrolls).reshape(-1,1),n_subrolls),starts,axis=0)
+        values=candidates[chosen,arange(n_tables)]
+        keeps[turn]=subrolls.indices[chosen]
+    weights=table.roll_weights
+    return tensordot(weights,values,axes=(0,0))/weights.sum(),keeps
+
+def stack_tables(tables):
+    """
+    Stacks a list of tables, each a list of arrays of point
+    values for each objective, into the array for
+    solve_lexicographic.
+    """
+    return array(tables).transpose(2,0,1)
+
+def weight_between(p,q):
+    """
+    Returns lam such that lam*E_A+(1-lam)*E_B is the same for
+    the frontier points p and q, (p with the larger E_A).
+    """
+    return (q[1]-p[1])/((p[0]-q[0])+(q[1]-p[1]))
+
+def same_point(p,q):
+    """
+    Tests whether the frontier points p and q have the same
+    (E_A,E_B), within the tolerance of eql_float.
+    """
+    return eql_float(p[0],q[0]) and eql_float(p[1],q[1])
+
+def tradeoff(points_a,points_b,n_dice=5,n_faces=6,n_rolls=3):
+    """
+    Returns the Tradeoff between points_a and points_b.
+    """
+    return Tradeoff(points_a,points_b,n_dice,n_faces,n_rolls)
+
+
+#-----------------------
+#Test Cases
+#-----------------------
+
+if __name__ == "__main__":
+    t=tradeoff('yahtzee','chance weighted')
+
+    #The ends of the frontier are the best you can do for
+    #each table.
+    assert(eql_float(t.vertices[0,0],Widget('yahtzee').expected))
+    assert(eql_float(t.vertices[-1,1],Widget('chance weighted').expected))
+    #The frontier goes down in E_A and up in E_B, and is
+    #concave.
+    assert((diff(t.vertices[:,0])<0).all() and (diff(t.vertices[:,1])>0).all())
+    slopes=diff(t.vertices[:,1])/diff(t.vertices[:,0])
+    assert((diff(slopes)>0).all())
+    assert(len(t.breakpoints)==len(t.vertices)-1)
+
+    #Solving the mixed table for any lam gives the value of
+    #the frontier.
+    for lam in list(linspace(0.,1.,41))+list(t.breakpoints):
+        assert(eql_float(t.widget(lam).expected,t.value(lam)))
+
+    print len(t.vertices), "vertices on the frontier from", t.solves, "solves"
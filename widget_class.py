@@ -8,8 +8,16 @@ Class for Yahtzee widget, and related functions.
 #-----------------------
 from numpy import *
 import sys
-from collections import Counter
+import time
+import json
+import struct
+from collections import Mapping, MutableMapping, OrderedDict, namedtuple
+from itertools import combinations_with_replacement, groupby
+from itertools import product as product_iter
 from math import factorial
+from fractions import Fraction
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 
 #-----------------------                                                        
 #Globals
@@ -19,6 +27,40 @@ combos_weighted=[]
 for combo in combos:
     combos_weighted.append(combo+' weighted')
 
+#Statistics on one turn of Widget.compute_strategy (see
+#SolveStats):
+#turn = the turn, (starting from 0).
+#seconds = wall time for the turn.
+#expectation_seconds = time spent computing the expected
+#points for every set of kept dice.
+#selection_seconds = time spent choosing the best sets of
+#kept dice for every roll.
+#expected_given_kept_calls = number of sets of kept dice
+#whose expected points were computed, (the number of calls
+#to Widget.expected_given_kept it replaces).
+#rolls_enumerated = number of (kept dice, roll) pairs summed
+#over in computing them.
+#subroll_checks = number of (roll, kept dice) pairs compared
+#in choosing the best sets of kept dice.
+#optimal_keeps = number of optimal sets of kept dice found,
+#summed over rolls, (more than one per roll for ties).
+#early_break_rate = fraction of subroll_checks that a scan
+#of each roll's subrolls in order of decreasing expected
+#points could have skipped by stopping early, as the
+#original scan over sorted keeps did.
+TurnStats=namedtuple('TurnStats',['turn','seconds','expectation_seconds','selection_seconds','expected_given_kept_calls','rolls_enumerated','subroll_checks','optimal_keeps','early_break_rate'])
+
+#Ways of choosing between sets of kept dice that are equally
+#good, when it matters which one is used, (see
+#ScoreDistribution): 'fewest' keeps the fewest dice, (the
+#first in keep index order), 'most' keeps the most dice,
+#(the last), and 'random' picks one of them at random.
+tie_breaks=['fewest','most','random']
+
+#File format of Widget.save and Widget.load.
+SAVE_MAGIC='YWIDGET1'
+SAVE_ALIGNMENT=64
+
 #-----------------------                                                        
 #Classes                                                                        
 #-----------------------
@@ -33,7 +75,7 @@ class Widget:
     to be yahtzees (all numbers the same), and 0 points to
     everything else.
     """
-    def __init__(self,points,n_dice=5,n_faces=6,n_rolls=3):
+    def __init__(self,points,n_dice=5,n_faces=6,n_rolls=3,compute=True,lazy=False,profile=False,exact=False,symmetry=False,probs=None):
         """
         points is either a string giving a type of yahtzee
         combination (e.g. 'yahtzee', 'four of a kind'), or
@@ -49,43 +91,107 @@ class Widget:
         n_rolls = number of rolls allowed (first roll plus
         re-rolls); 3 is the default value as in the ordinary
         game of Yahtzee.
+
+        compute = whether to compute the optimal strategy
+        right away.  If False, self.compute_strategy must be
+        called before the strategy and expected values can
+        be used, (solve_batch does this to solve many Widgets
+        together).
+
+        lazy = whether to compute the optimal strategy only
+        as it is needed.  If True, nothing is computed until a
+        roll is looked up in self.values or self.strategy,
+        (e.g. by self.advise), and then only what is needed
+        for that roll is computed, and saved for later
+        lookups (see solve_lazily).  This is much faster when
+        only a few rolls are ever looked up on the second to
+        last turn; looking up a roll on an earlier turn needs
+        most of the rolls, so it solves the whole Widget.
+
+        profile = whether to record statistics on each turn
+        of compute_strategy, (see SolveStats), in self.stats.
+        If profile is a function, it is also called with the
+        TurnStats for each turn as soon as the turn is done.
+        If False, self.stats is None and nothing is recorded.
+        Only the ordinary solver, (and solve_batch), records
+        statistics, so profile can't be used with lazy mode,
+        exact mode or symmetry.
+
+        exact = whether to solve with exact integer arithmetic,
+        (see compute_exact), rather than floating point.  The
+        point values must all be integers.
+
+        symmetry = whether to solve only one roll from each set
+        of rolls that are the same up to relabeling the faces,
+        (see compute_symmetric).  If True, the relabelings that
+        leave the point values unchanged are found
+        automatically.  It can also be a list of permutations
+        of the faces that leave the point values unchanged,
+        each a tuple giving the new label of each face from 1
+        to n_faces, which generate the relabelings to use.
+
+        probs = the probability of each face from 1 to n_faces
+        coming up, for loaded or worn dice, (all positive, and
+        normalized to add up to 1).  None, the default, or
+        equal probabilities, means fair dice.
         """
         self.n_dice=parse_int(n_dice,"n_dice",1)
         self.n_faces=parse_int(n_faces,"n_faces",1)
         self.n_rolls=parse_int(n_rolls,"n_rolls",1)
+        #self.probs is None for fair dice, (see parse_probs).
+        self.probs=parse_probs(probs,self.n_faces)
+
+        #self.table enumerates all of the possible rolls and
+        #sets of kept dice, and maps each of them to an integer
+        #index (see RollTable).  It is shared by all Widgets
+        #with the same n_dice, n_faces and probs.
+        #self.kernel, which gives the probability of getting
+        #each roll from each set of kept dice (see
+        #TransitionKernel), and self.subrolls, which lists the
+        #sets of dice that can be kept from each roll (see
+        #SubrollIndex), are properties that read them off
+        #self.table, so they are only built if they are needed.
+        self.table=self.make_table()
+
+        #self._values is an array of shape (n_rolls,num_rolls).
+        #The rows correspond to successive rolls, and
+        #self._values[turn,i] is the expected number of points
+        #for the roll with index i at that turn.
+        #self._values[-1] is therefore the point value of
+        #each possible roll after the last turn, input by the
+        #user via the "points" argument to __init__.
+        #
+        #self.values gives dictionary-like access to the
+        #same numbers: it is a list of n_rolls RollDicts,
+        #one per turn, whose keys are rolls represented by
+        #sorted tuples of integers, e.g.
+        #self.values[turn][roll]==self._values[turn,i]
+        #where i is the index of roll.
+        self._values=zeros((self.n_rolls,self.table.num_rolls))
+        self.values=[RollDict(self.table,self._values[i]) for i in range(self.n_rolls)]
 
-        #self.values is a list of n_rolls dictionaries.
-        #The elements of the list correspond to successive
-        #rolls, and they are dictionaries giving the
-        #expected number of points for each roll at that
-        #turn. self.values[-1] is therefore the dictionary
-        #input by the user via the "points" argument to
-        #__init__, specifying the point values of each
-        #possible roll after the last turn.  The keys of
-        #the dictionaries are rolls, which are represented
-        #by sorted tuples of integers.  For now,
-        #initialize self.values to a list of n_rolls
-        #empty dictionaries.
-        self.values=[]
-        for i in range(self.n_rolls):
-            self.values.append({})
-
-        #self.strategy is a list of n_rolls-1 dictionaries.
-        #The elements of the list correspond to successive rolls
-        #(except the last one), and they are dictionaries
-        #that tell which numbers to keep (and not re-roll)
-        #for each possible roll on that turn.  Thus the keys
-        #of the dictionaries are sorted tuples representing
-        #the rolls, and the values are lists of sorted tuples
-        #of a subset of the integers in the roll, which are the
-        #numbers to be kept and not re-rolled.  The values are
-        #lists of tuples because there may be more than one
-        #optimal choice of numbers to keep, and the list will
-        #contain them all.  For now, initialize self.strategy
-        #to a list of n_rolls-1 empty dictionaries.
+        #self._strategy is a list of n_rolls-1 pairs of arrays
+        #(indptr,indices).  The elements of the list correspond
+        #to successive rolls (except the last one), and tell
+        #which numbers to keep (and not re-roll) for each
+        #possible roll on that turn: the indices of the optimal
+        #sets of kept dice for the roll with index i are
+        #indices[indptr[i]:indptr[i+1]].  There may be more than
+        #one optimal choice of numbers to keep, and these
+        #arrays record them all.
+        #
+        #self.strategy gives dictionary-like access to the
+        #same information: it is a list of n_rolls-1
+        #StrategyDicts, whose keys are sorted tuples
+        #representing the rolls, and whose values are lists
+        #of sorted tuples of a subset of the integers in the
+        #roll, which are the numbers to be kept and not
+        #re-rolled.  For now, initialize every roll to have
+        #no optimal choices.
+        self._strategy=[]
         self.strategy=[]
         for i in range(self.n_rolls-1):
-            self.strategy.append({})
+            self.set_strategy(i,zeros(self.table.num_rolls+1,dtype=int),zeros(0,dtype=int))
         
         if type(points)==str:
             self.parse_points_str(points)
@@ -96,427 +202,2164 @@ class Widget:
             exit()
 
         #Compute the optimal strategy and expected scores.
-        self.compute_strategy()
+        self.stats=None
+        if profile:
+            self.stats=SolveStats(profile if callable(profile) else None)
+        self.lazy=lazy
+        self.exact=exact
+        self.symmetry=symmetry
+        self.face_symmetry=None
+        self._strategy_pending=False
+        if lazy and exact:
+            print >> sys.stderr, "Error in Widget.__init__: lazy mode and exact mode can't be used together."
+            exit()
+        if exact and self.probs!=None:
+            print >> sys.stderr, "Error in Widget.__init__: exact mode needs fair dice."
+            exit()
+        if symmetry and (lazy or exact):
+            print >> sys.stderr, "Error in Widget.__init__: symmetry can't be used with lazy mode or exact mode."
+            exit()
+        if profile and (lazy or exact or symmetry):
+            print >> sys.stderr, "Error in Widget.__init__: profile can't be used with lazy mode, exact mode or symmetry."
+            exit()
+        if lazy:
+            self.init_lazy()
+        elif compute:
+            self.compute_strategy()
+
+    def make_table(self):
+        """
+        Returns the table of rolls and sets of kept dice used
+        by this Widget.
+        """
+        return roll_table(self.n_dice,self.n_faces,self.probs)
+
+    @property
+    def kernel(self):
+        """
+        The TransitionKernel for this Widget's dice.
+        """
+        return self.table.kernel
+
+    @property
+    def subrolls(self):
+        """
+        The SubrollIndex for this Widget's dice.
+        """
+        return self.table.subrolls
 
     def parse_points_str(self,points):
         """
         Takes a string describing a combination, such
-        as 'yahtzee', or 'four of a kind', creates a dictionary
-        called points_dict which gives a point value of 1 to
-        rolls of that type and 0 to rolls not of that type,
-        and passes points_dict to self.parse_points_dict.
+        as 'yahtzee', or 'four of a kind', and initializes
+        self.values[-1] to give a point value of 1 to
+        rolls of that type and 0 to rolls not of that type.
         Can also add the word 'weighted' on the end, e.g.
         'four of a kind weighted', to weight rolls by the actual
         number of points you would score with that roll, rather
-        than just 1.
+        than just 1.  The combinations are computed for all
+        of the rolls at once by the functions in combo_points,
+        (see register_combo).
+        """
+        combo=points.lower()
+
+        if combo not in combo_points:
+            print >> sys.stderr, "Error in Widget.parse_points_str:", points, "not a valid combination.  Must be one of:"
+            for c in sorted(combo_points.keys()):
+                print >> sys.stderr, c
+            exit()
+
+        self._values[-1]=combo_points[combo](self.table)
+
+    def parse_points_dict(self,points):
+        """
+        Uses the dictionary points to initialize
+        self.values[-1].  Checks that the keys
+        of points correspond to unique rolls
+        before copying to self.values[-1].
+        """
+
+        #Clear self.values[-1].  Any rolls for which point
+        #values are not specified in points keep point
+        #values of 0.
+        self._values[-1]=0.
+        #assigned[i] records whether roll i has been given
+        #a point value yet.
+        assigned=zeros(self.table.num_rolls,dtype=bool)
+
+        #Run through the key, value pairs of points, check that
+        #the keys are valid rolls, then add the key, value pair
+        #to self.values[-1].
+        for key, value in points.iteritems():
+            roll=self.parse_roll(key,"parse_points_dict")
+
+            #If this roll already has a point value assigned to it
+            #in self.values[-1], different than that of "value",
+            #then this is an error.
+            if assigned[roll] and self._values[-1,roll]!=value:
+                print >> sys.stderr, "Error in Widget.parse_points_dict: multiple, inconsistent point values given for roll", tuple(sorted(key))
+                exit()
+            #Otherwise we can assign a point value of "value" to
+            #this roll in self.values[-1].
+            self._values[-1,roll]=value
+            assigned[roll]=True
+
+    def parse_roll(self,key,caller):
+        """
+        Checks that key, a key of a points dictionary, is a
+        tuple representing a valid roll, and returns the index
+        of the roll.  caller is the name of the method to give
+        in error messages.
+        """
+        if type(key)!=tuple:
+            print >> sys.stderr, "Error in Widget.%s: keys in points dictionary must be tuples." % caller
+            exit()
+
+        if len(key)!=self.n_dice:
+            print >> sys.stderr, "Error in Widget.%s: keys in points must be tuples of length" % caller, self.n_dice
+            exit()
+
+        #Check that each element of the tuple representing the roll
+        #is an integer between 1 and self.n_faces.
+        for i in key:
+            if i<1 or i>self.n_faces:
+                print >> sys.stderr, "Error in Widget.%s: numbers in rolls must be between 1 and" % caller, self.n_faces
+                exit()
+            if type(i)!=int:
+                print >> sys.stderr, "Error in Widget.%s: numbers in rolls must be integers." % caller
+                exit()
+
+        #key is a valid tuple representing a roll if you get
+        #to this point, however, we only want to deal with sorted
+        #tuples as rolls.
+        return self.table.index(tuple(sorted(key)))
+
+    def init_lazy(self):
+        """
+        Sets up the Widget to compute the optimal strategy
+        only as it is needed (see __init__).  Entries of
+        self._values, and of self._keep_values, the expected
+        number of points for each set of kept dice at each
+        turn, are NaN until they have been computed, and the
+        optimal sets of kept dice for each roll are saved in
+        the dictionaries self._lazy_strategy[turn], keyed by
+        roll index, as they are computed.  self.values and
+        self.strategy compute any rolls that are looked up
+        through them.
+        """
+        self._values[:-1]=nan
+        self._keep_values=zeros((self.n_rolls-1,self.table.num_keeps))+nan
+        self._lazy_strategy=[{} for turn in range(self.n_rolls-1)]
+        for turn in range(self.n_rolls-1):
+            self.values[turn]=RollDict(self.table,self._values[turn],lambda i,turn=turn: self.solve_lazily(turn,[i]))
+            self.strategy[turn]=LazyStrategyDict(self,turn)
+
+    def solve_lazily(self,turn,rolls):
+        """
+        Computes the expected number of points and optimal
+        sets of kept dice at turn 'turn' for the rolls whose
+        indices are listed in rolls, computing only what they
+        depend on, and skipping anything already computed.
+
+        Working forward from 'turn', finds the sets of dice
+        that can be kept from the rolls, then the rolls on the
+        next turn that can be reached from those, and so on.
+        Then works backward, computing only those.
+
+        If more than half of the rolls on any turn are needed,
+        (e.g. for any roll before the second to last turn,
+        since keeping no dice can lead to any roll), the whole
+        Widget is solved by compute_strategy instead, which is
+        faster, and it is no longer in lazy mode.  Otherwise,
+        the sets of dice that can be kept from the rolls, and
+        the rows of the transition kernel for the sets of kept
+        dice, are generated for just those (see
+        RollTable.subroll_keeps and RollTable.kernel_rows),
+        without building the whole SubrollIndex, and without
+        building the TransitionKernel until more than half of
+        the sets of kept dice are needed, when it is faster to
+        build it.
+        """
+        table=self.table
+        rolls=index_set(asarray(rolls,dtype=int),table.num_rolls)
+        needed=[]
+        for t in range(turn,self.n_rolls-1):
+            rolls=rolls[isnan(self._values[t,rolls])]
+            if 2*len(rolls)>table.num_rolls:
+                self.compute_strategy()
+                return
+            segment_ptr,subroll_keeps=table.subroll_keeps(rolls)
+            keeps=index_set(subroll_keeps,table.num_keeps)
+            keeps=keeps[isnan(self._keep_values[t,keeps])]
+            if 2*len(keeps)>table.num_keeps:
+                kernel=self.kernel
+            if len(keeps)==table.num_keeps:
+                counts,denominators=kernel.counts,kernel.denominators
+            else:
+                counts,denominators=table.kernel_rows(keeps)
+            needed.append((t,rolls,segment_ptr,subroll_keeps,keeps,counts,denominators))
+            rolls=index_set(counts.indices,table.num_rolls)
+
+        for t, rolls, segment_ptr, subroll_keeps, keeps, counts, denominators in reversed(needed):
+            if len(keeps)>0:
+                self._keep_values[t,keeps]=counts.dot(self._values[t+1])/denominators
+            if len(rolls)>0:
+                values,indptr,indices=best_in_segments(self._keep_values[t],segment_ptr,subroll_keeps)
+                self._values[t,rolls]=values
+                for j, i in enumerate(rolls):
+                    self._lazy_strategy[t][i]=indices[indptr[j]:indptr[j+1]]
+
+    def __getattr__(self,name):
+        """
+        In lazy mode, self.expected is only computed when it
+        is first used, since it depends on every roll at the
+        first turn.
+        """
+        if name=='expected' and self.__dict__.get('lazy'):
+            self.solve_lazily(0,arange(self.table.num_rolls))
+            self.compute_expected()
+            return self.expected
+        raise AttributeError(name)
+
+    def set_strategy(self,turn,indptr,indices):
+        """
+        Records the optimal sets of kept dice at turn 'turn',
+        given as arrays (indptr,indices) of keep indices in
+        the format described in __init__, and updates
+        the dictionary-like view self.strategy[turn].
+        """
+        #Any compiled AdviceTables are out of date.
+        self._advice_tables={}
+        if turn<len(self._strategy):
+            self._strategy[turn]=(indptr,indices)
+            self.strategy[turn]=StrategyDict(self.table,indptr,indices)
+        else:
+            self._strategy.append((indptr,indices))
+            self.strategy.append(StrategyDict(self.table,indptr,indices))
+
+    def compute_strategy(self):
+        """
+        Compute which dice to keep for a given roll at a given
+        turn (self.strategy), and the expected number of points
+        after a given roll (self.values).
+        """
+        if self.exact:
+            self.compute_exact()
+            return
+        if self.symmetry and self.compute_symmetric():
+            return
+        #Build the shared tables, if they haven't been built
+        #yet, before starting.
+        kernel=self.kernel
+        subrolls=self.subrolls
+        #Only time the turns if we are recording statistics.
+        stats=self.stats
+        if stats!=None:
+            stats.clear()
+        #self._keep_values[turn,k] is the expected number of
+        #points for the set of kept dice with index k at turn
+        #'turn', which update_points needs to re-solve only
+        #what changes.
+        self._keep_values=zeros((self.n_rolls-1,self.table.num_keeps))
+        for turn in range(self.n_rolls-2,-1,-1):
+            if stats!=None:
+                start=time.time()
+            #For each possible set of kept dice at this turn,
+            #calculate the expected value of the points you'll
+            #get after you roll (i.e. at the beginning of the
+            #next turn).  Number of kept dice can be from 0
+            #to self.n_dice.  (For self.n_dice kept dice, can
+            #read off the "expected" values from self.values[turn+1].)
+            #Store this in the array "expected_pts", indexed by
+            #the index of the set of kept dice.  This is a single
+            #sparse matrix-vector product with the transition
+            #kernel, equivalent to calling self.expected_given_kept
+            #for every set of kept dice.
+            expected_pts=kernel.expectation(self._values[turn+1])
+            self._keep_values[turn]=expected_pts
+            if stats!=None:
+                selection_start=time.time()
+
+            #Now go through all possible rolls for this turn,
+            #see which set(s) of dice are the optimal ones to keep,
+            #(in that they lead to the highest expected number of
+            #points), and record the sets in self.strategy[turn],
+            #and the expected number of points in self.values[turn].
+            #The sets of dice that can be kept from each roll are
+            #listed in self.subrolls, so this is a maximum over
+            #each roll's segment of that list (see
+            #SubrollIndex.best_keeps).
+            self._values[turn],indptr,indices=subrolls.best_keeps(expected_pts)
+            self.set_strategy(turn,indptr,indices)
+            if stats!=None:
+                stats.record(self,turn,start,selection_start,time.time())
+
+        #We have now computed the optimal strategy and expectation
+        #values for each turn, so there is nothing left to
+        #compute lazily or expand.  The last thing we want to
+        #compute is the a priori expected number of points.
+        self._strategy_pending=False
+        self.lazy=False
+        self.compute_expected()
+
+    def compute_symmetric(self):
+        """
+        Same as compute_strategy, but only solving one roll
+        and one set of kept dice from each orbit of the group
+        of face relabelings given by self.symmetry, (see
+        FaceSymmetry).  If the point values don't change when
+        the faces are relabeled, neither do the expected
+        numbers of points, so they only need to be computed
+        once per orbit; there are as few as 1/n_faces! as many
+        orbits as rolls.  Returns False, having done nothing,
+        if self.symmetry is True and no relabelings leave the
+        point values unchanged.
+
+        The expected number of points for every roll and set of
+        kept dice, self._values and self._keep_values, are read
+        off their orbits, and self.strategy[turn][roll] is
+        found when it is looked up, by comparing them.
+        self._strategy is only filled in, for all rolls at
+        once, when it is needed (see expand_strategy).
+        """
+        points=self._values[-1]
+        if self.symmetry is True:
+            generators=face_symmetries(self.table,points)
+            if len(generators)==0:
+                self.face_symmetry=None
+                return False
+        else:
+            generators=[tuple(g) for g in self.symmetry]
+            for g in generators:
+                if sorted(g)!=range(1,self.n_faces+1):
+                    print >> sys.stderr, "Error in Widget.compute_symmetric:", g, "is not a permutation of the faces."
+                    exit()
+                if not (points[permute_rolls(self.table,g)]==points).all():
+                    print >> sys.stderr, "Error in Widget.compute_symmetric: the point values change under the permutation", g
+                    exit()
+                if not preserves_probs(self.probs,g):
+                    print >> sys.stderr, "Error in Widget.compute_symmetric: the face probabilities change under the permutation", g
+                    exit()
+        sym=face_symmetry(self.n_dice,self.n_faces,generators,self.probs)
+        self.face_symmetry=sym
+
+        values=points[sym.roll_reps]
+        self._keep_values=zeros((self.n_rolls-1,self.table.num_keeps))
+        for turn in range(self.n_rolls-2,-1,-1):
+            expected_pts=sym.expectation(values)
+            values=sym.best_values(expected_pts)
+            self._keep_values[turn]=expected_pts[sym.keep_orbits]
+            self._values[turn]=values[sym.roll_orbits]
+            self.strategy[turn]=CountStrategyDict(self,turn)
+        self._strategy_pending=True
+        self.lazy=False
+        self.compute_expected()
+        return True
+
+    def expand_strategy(self):
+        """
+        Fills in self._strategy for every roll, if
+        compute_symmetric left it to be filled in when needed.
+        """
+        if self._strategy_pending:
+            for turn in range(self.n_rolls-2,-1,-1):
+                values,indptr,indices=self.subrolls.best_keeps(self._keep_values[turn])
+                self.set_strategy(turn,indptr,indices)
+            self._strategy_pending=False
+
+    def compute_exact(self):
+        """
+        Same as compute_strategy, but with exact integer
+        arithmetic, so that ties between sets of kept dice are
+        exact, rather than found with eql_floats, and the
+        expected number of points is known exactly.
+
+        Every probability in the transition kernel is a
+        multiple of 1/n_faces**n_dice, so the expected number
+        of points at turn 'turn' times
+        self.exact_scales[turn]=n_faces**(n_dice*(n_rolls-1-turn))
+        is an integer, given integer points after the last
+        turn.  These integers are kept in self._exact_values,
+        (and ties between sets of kept dice are found by
+        comparing them), and self._values, self.expected, etc.
+        are the nearest floats to them divided by the scale.
+        self.expected_exact is the expected number of points as
+        a Fraction, (see exact_value for the other values).
+
+        The integers are int64 if the largest of them is small
+        enough to fit, and Python integers, (numpy arrays of
+        type object, which is much slower), if not.
+        """
+        table=self.table
+        kernel=self.kernel
+        subrolls=self.subrolls
+        points=self._values[-1]
+        if not (points==rint(points)).all():
+            print >> sys.stderr, "Error in Widget.compute_exact: point values must be integers in exact mode."
+            exit()
+
+        #No number is larger than the largest point value times
+        #the scale for the first turn.
+        outcomes=self.n_faces**self.n_dice
+        largest=max(int(abs(points).max()),1)*outcomes**(self.n_rolls-1)
+        dtype=int64 if largest<2**63 else object
+        def to_ints(a):
+            if dtype==object:
+                return array([int(x) for x in rint(a)],dtype=object)
+            return rint(a).astype(int64)
+        counts=to_ints(kernel.counts.data)
+        kernel_indptr=kernel.counts.indptr
+        kernel_indices=kernel.counts.indices
+        #Multiplying by keep_factors[k]=n_faces**m for a set of
+        #m kept dice puts every set on the same denominator.
+        keep_factors=outcomes//to_ints(kernel.denominators)
+
+        values=to_ints(points)
+        self._exact_values=[None]*self.n_rolls
+        self._exact_values[-1]=values
+        self.exact_scales=[1]*self.n_rolls
+        self._keep_values=zeros((self.n_rolls-1,table.num_keeps))
+        for turn in range(self.n_rolls-2,-1,-1):
+            scale=self.exact_scales[turn+1]*outcomes
+            keep_pts=add.reduceat(counts*values[kernel_indices],kernel_indptr[:-1])*keep_factors
+            candidates=keep_pts[subrolls.indices]
+            values=maximum.reduceat(candidates,subrolls.indptr[:-1])
+            optimal=candidates==values[subrolls.rows]
+            indptr=zeros(table.num_rolls+1,dtype=int)
+            indptr[1:]=cumsum(optimal)[subrolls.indptr[1:]-1]
+            self.set_strategy(turn,indptr,subrolls.indices[optimal])
+
+            self._exact_values[turn]=values
+            self.exact_scales[turn]=scale
+            self._keep_values[turn]=exact_to_float(keep_pts,scale)
+            self._values[turn]=exact_to_float(values,scale)
+
+        #The sum can be too large for int64, so add up Python
+        #integers.
+        total=sum(int(w)*int(v) for w, v in zip(rint(table.roll_weights),self._exact_values[0]))
+        self.expected_exact=Fraction(total,self.exact_scales[0]*outcomes)
+        self.expected=float(self.expected_exact)
+        self.lazy=False
+
+    def exact_value(self,turn,roll):
+        """
+        Returns the expected number of points for roll at turn
+        'turn', as a Fraction, (the exact value of
+        self.values[turn][roll]).  Only in exact mode.
+        """
+        if not self.exact:
+            print >> sys.stderr, "Error in Widget.exact_value: only available in exact mode."
+            exit()
+        i=self.table.index(tuple(sorted(roll)))
+        return Fraction(int(self._exact_values[turn][i]),self.exact_scales[turn])
+
+    def update_points(self,points):
+        """
+        Changes the point values of some of the rolls after
+        the last turn, and re-solves the Widget.  points is a
+        dictionary like the one passed to __init__, but only
+        giving the rolls whose point values change.  The
+        results are exactly the same as building a new Widget
+        with the new point values, but only the rolls and sets
+        of kept dice whose expected number of points depend on
+        the changed rolls are recomputed (see
+        update_strategy).
+        """
+        rolls=[]
+        for key, value in points.iteritems():
+            roll=self.parse_roll(key,"update_points")
+            if self._values[-1,roll]!=value:
+                rolls.append(roll)
+        if len(rolls)==0:
+            return
+
+        #A loaded Widget's arrays may be read-only.
+        if not self._values.flags.writeable:
+            self._values=array(self._values)
+            self.values=[RollDict(self.table,self._values[i]) for i in range(self.n_rolls)]
+        for key, value in points.iteritems():
+            self._values[-1,self.table.index(tuple(sorted(key)))]=value
+
+        if self.lazy:
+            #Nothing has to be recomputed until it is looked up.
+            self.__dict__.pop('expected',None)
+            self.init_lazy()
+        elif self.exact or self.symmetry or getattr(self,'_keep_values',None) is None:
+            #Loaded Widgets don't have the expected number of
+            #points for each set of kept dice, and exact mode
+            #and symmetric solving don't update them, so solve
+            #from scratch.
+            self.compute_strategy()
+        else:
+            self.update_strategy(index_set(asarray(rolls,dtype=int),self.table.num_rolls))
+
+    def update_strategy(self,rolls):
+        """
+        Re-solves the Widget after the point values of the
+        rolls whose indices are in the array rolls have been
+        changed in self._values[-1].
+
+        Working backward from the last turn, the only sets of
+        kept dice whose expected number of points can change
+        are the subrolls of the rolls whose expected number of
+        points changed on the next turn, and the only rolls
+        whose optimal sets of kept dice can change are the
+        rolls those sets can be kept from, (the rolls reached
+        from them in the transition kernel).  These are
+        recomputed in the same way as compute_strategy does,
+        so the results are identical, and only the ones that
+        actually changed are followed back to the turn before.
+        """
+        kernel=self.kernel
+        subrolls=self.subrolls
+        num_keeps=self.table.num_keeps
+        num_rolls=self.table.num_rolls
+        for turn in range(self.n_rolls-2,-1,-1):
+            #Once the changes have spread to more than half of
+            #the sets of kept dice or rolls, it is faster to
+            #recompute all of them, the same way as
+            #compute_strategy, than to pick them out.
+            positions,indptr=subrolls.segments(rolls)
+            keeps=index_set(subrolls.indices[positions],num_keeps)
+            if 2*len(keeps)>num_keeps:
+                expected_pts=kernel.expectation(self._values[turn+1])
+                keeps=flatnonzero(expected_pts!=self._keep_values[turn])
+                self._keep_values[turn]=expected_pts
+            else:
+                expected_pts=kernel.expectation(self._values[turn+1],keeps)
+                changed=expected_pts!=self._keep_values[turn,keeps]
+                keeps=keeps[changed]
+                self._keep_values[turn,keeps]=expected_pts[changed]
+            if len(keeps)==0:
+                break
+
+            if 2*len(keeps)>num_keeps:
+                changed=zeros(num_keeps,dtype=bool)
+                changed[keeps]=True
+                rolls=flatnonzero(logical_or.reduceat(changed[subrolls.indices],subrolls.indptr[:-1]))
+            else:
+                rolls=index_set(kernel.rows(keeps).indices,num_rolls)
+            if 2*len(rolls)>num_rolls:
+                values,indptr,indices=subrolls.best_keeps(self._keep_values[turn])
+                self.set_strategy(turn,indptr,indices)
+                rolls=flatnonzero(values!=self._values[turn])
+                self._values[turn]=values
+            else:
+                values,indptr,indices=subrolls.best_keeps(self._keep_values[turn],rolls)
+                self.set_strategy(turn,*splice_segments(self._strategy[turn],rolls,indptr,indices))
+                changed=values!=self._values[turn,rolls]
+                self._values[turn,rolls]=values
+                rolls=rolls[changed]
+        self.compute_expected()
+
+    def compute_expected(self):
+        """
+        Compute the a priori expected number of points
+        (self.expected), i.e. the average over all possible
+        rolls of self.values[0][roll].
+        """
+        weights=self.table.roll_weights
+        self.expected=float(dot(weights,self._values[0]))/float(weights.sum())
+
+    def expected_given_kept(self,kept,turn):
+        """
+        Calculate the expected number of points if you keep
+        dice 'kept' at turn 'turn', (given that you use optimal
+        strategy after that).
+        """
+        k=self.table.keep_index(tuple(kept))
+        #In lazy mode, the rolls that can be reached from
+        #'kept' at the next turn may not have been computed
+        #yet, (the last turn's values are the points).
+        counts,denominators=self.table.kernel_rows([k])
+        if self.lazy and turn+1<self.n_rolls-1:
+            self.solve_lazily(turn+1,counts.indices)
+        #Note that it's the probability of getting the values
+        #in the rolled dice that we care about, since we have
+        #already obtained the values in 'kept' at this turn.
+        #This is what the row of the transition kernel for
+        #'kept' gives.
+        return float(counts.dot(self._values[turn+1])[0]/denominators[0])
+
+    def score_distribution(self,tie_break='fewest'):
+        """
+        Returns the probability distribution of the number of
+        points you get with the optimal strategy, from each
+        roll at each turn, as a ScoreDistribution.  Different
+        optimal sets of kept dice give the same expected
+        number of points, but not the same distribution, so
+        tie_break (one of tie_breaks) says which one to use.
+        """
+        return ScoreDistribution(self,tie_break)
+
+    def advice_table(self,tie_break='fewest'):
+        """
+        Returns the AdviceTable compiled from this Widget's
+        strategy, building it the first time it is asked for.
+        tie_break is 'fewest' or 'most' (see tie_breaks).
+        """
+        if self.lazy:
+            self.compute_strategy()
+        self.expand_strategy()
+        if tie_break not in self._advice_tables:
+            self._advice_tables[tie_break]=AdviceTable(self,tie_break)
+        return self._advice_tables[tie_break]
+
+    def advise_batch(self,turns,rolls,tie_break='fewest'):
+        """
+        Same as advise, but for many rolls at once, returning
+        the advice rather than printing it.  rolls is a 2d
+        array with one roll of n_dice dice per row, (in any
+        order), and turns is an array of the turn of each roll,
+        starting at 1 as in advise, (or a single turn for all
+        of them).  Returns (keep,expected), where keep is a
+        boolean array of the same shape as rolls saying which
+        of the dice to keep, (one of the optimal choices, see
+        AdviceTable), and expected is the array of expected
+        numbers of points, self.values[turn-1][roll].  On the
+        last turn, all of the dice are kept, and expected is
+        the score.
+        """
+        rolls=asarray(rolls,dtype=int)
+        if rolls.ndim==1:
+            rolls=rolls.reshape(1,-1)
+        if rolls.ndim!=2 or rolls.shape[1]!=self.n_dice:
+            print >> sys.stderr, "Error in Widget.advise_batch: rolls must be an array of rolls of", self.n_dice, "dice."
+            exit()
+        if (rolls<1).any() or (rolls>self.n_faces).any():
+            print >> sys.stderr, "Error in Widget.advise_batch: numbers in rolls must be between 1 and", self.n_faces
+            exit()
+        turns=asarray(turns,dtype=int)
+        if (turns<1).any() or (turns>self.n_rolls).any():
+            print >> sys.stderr, "Error in Widget.advise_batch: turns must be between 1 and", self.n_rolls
+            exit()
+
+        advice=self.advice_table(tie_break)
+        if advice.code_keep is not None:
+            codes=dot(rolls-1,advice.place_codes)
+            return advice.code_keep[turns-1,codes],self._values[turns-1,advice.code_rolls[codes]]
+
+        #Look up the sorted rolls, then put the kept dice back
+        #in the order they were given.
+        order=argsort(rolls,axis=1,kind='mergesort')
+        sorted_rolls=take_along_axis(rolls,order,axis=1)
+        masks,expected=advice.lookup(turns-1,self.table.rank(sorted_rolls))
+        bits=(masks.astype(uint64).reshape(-1,1)>>arange(self.n_dice,dtype=uint64))&uint64(1)
+        keep=zeros(rolls.shape,dtype=bool)
+        put_along_axis(keep,order,bits.astype(bool),axis=1)
+        return keep,expected
+
+    def advise(self,turn,roll):
+        """
+        Gives you the optimal strategy and expected number
+        of points given a roll on a given turn.  This is
+        just a nicer way to display self.strategy[turn][roll]
+        and self.values[turn][roll].
+        NOTE:  For the input here, we assume turn numbers
+        start at 1, and then subtract 1 before using it,
+        because this is a more 'user facing' function.
+        """
+        #Let's assume the user gives turn numbers starting
+        #at 1 rather than 0.
+        turn=parse_int(turn,"turn",1,self.n_rolls)-1
+
+        #Parse roll
+        r=tuple(sort(roll))
+        if len(r)!=self.n_dice:
+            print >> sys.stderr, "Error in Widget.advise: roll must consist of", self.n_dice, "dice."
+            exit()
+        if self.table.index(r)==None:
+            print >> sys.stderr, "Error in Widget.advise:", roll, "not a valid roll."
+            exit()
+
+        #Print the optimal strategy
+        if turn==self.n_rolls-1:
+            print "Score:", self.values[turn][r]
+        else:
+            print "Possible dice to keep:"
+            for keep in self.strategy[turn][r]:
+                print keep
+            print ""
+            print "Expected number of points:", self.values[turn][r]
+
+    def save(self,path):
+        """
+        Saves the solved Widget to the file 'path', so that it
+        can be loaded again with Widget.load without solving
+        it again.  The file is a short header followed by the
+        raw arrays self._values and self._strategy, (see
+        __init__), which are indexed by roll and keep index,
+        so that Widget.load can memory-map them.
+
+        Layout of the file:
+        - the 8 bytes SAVE_MAGIC
+        - the length of the header, as an 8 byte little-endian
+          unsigned integer
+        - the header, a JSON dictionary giving n_dice, n_faces,
+          n_rolls, probs, expected, and the dtype, shape and offset
+          (from the start of the file) of each array
+        - the arrays, each starting at a multiple of
+          SAVE_ALIGNMENT bytes
+        """
+        if self.lazy:
+            self.compute_strategy()
+        self.expand_strategy()
+        arrays=[('values',self._values)]
+        for turn, (indptr,indices) in enumerate(self._strategy):
+            arrays.append(('indptr_%d' % turn,indptr.astype('<i8')))
+            arrays.append(('indices_%d' % turn,indices.astype('<i4')))
+
+        #The offsets depend on the length of the header, which
+        #depends on the offsets, so leave enough room in the
+        #header for the offsets to grow when they are filled in.
+        header={'n_dice':self.n_dice,'n_faces':self.n_faces,'n_rolls':self.n_rolls,'probs':self.probs,'expected':self.expected,'arrays':[]}
+        for name, a in arrays:
+            header['arrays'].append({'name':name,'dtype':a.dtype.newbyteorder('<').str,'shape':list(a.shape),'offset':0})
+        start=len(SAVE_MAGIC)+8+len(json.dumps(header))+20*len(arrays)
+        offset=start
+        for entry, (name,a) in zip(header['arrays'],arrays):
+            offset=-(-offset//SAVE_ALIGNMENT)*SAVE_ALIGNMENT
+            entry['offset']=offset
+            offset+=a.nbytes
+        header_str=json.dumps(header)
+        header_str+=' '*(start-len(SAVE_MAGIC)-8-len(header_str))
+
+        with open(path,'wb') as f:
+            f.write(SAVE_MAGIC)
+            f.write(struct.pack('<Q',len(header_str)))
+            f.write(header_str)
+            for entry, (name,a) in zip(header['arrays'],arrays):
+                f.write('\0'*(entry['offset']-f.tell()))
+                f.write(ascontiguousarray(a,dtype=entry['dtype']).tostring())
+
+    @classmethod
+    def load(cls,path,mmap=True):
+        """
+        Loads a Widget saved with Widget.save from the file
+        'path'.  If mmap is True, the arrays are memory-mapped
+        read-only rather than read into memory, so loading is
+        nearly instant, and processes that load the same file
+        share one copy of it through the page cache.  Rolls
+        are only looked up when they are used.
+        """
+        with open(path,'rb') as f:
+            if f.read(len(SAVE_MAGIC))!=SAVE_MAGIC:
+                print >> sys.stderr, "Error in Widget.load:", path, "is not a saved Widget."
+                exit()
+            header_len=struct.unpack('<Q',f.read(8))[0]
+            header=json.loads(f.read(header_len))
+        if mmap:
+            buf=memmap(path,dtype=uint8,mode='r')
+        else:
+            buf=fromfile(path,dtype=uint8)
+        arrays={}
+        for entry in header['arrays']:
+            arrays[entry['name']]=ndarray(tuple(entry['shape']),dtype=entry['dtype'],buffer=buf,offset=entry['offset'])
+
+        #Build an unsolved Widget with no points, then replace
+        #its arrays with the loaded ones.
+        w=cls({},header['n_dice'],header['n_faces'],header['n_rolls'],compute=False,probs=header.get('probs'))
+        w._values=arrays['values']
+        w.values=[RollDict(w.table,w._values[i]) for i in range(w.n_rolls)]
+        for turn in range(w.n_rolls-1):
+            w.set_strategy(turn,arrays['indptr_%d' % turn],arrays['indices_%d' % turn])
+        w.expected=header['expected']
+        return w
+
+class CountWidget(Widget):
+    """
+    Same as Widget, but with a solver that scales to large
+    numbers of dice, (e.g. 15 to 30).  Rolls and sets of kept
+    dice are represented by vectors of the number of times
+    each face appears (see CountTable), rather than by
+    sorted tuples, and the strategy is never enumerated for
+    all rolls.
+
+    The expected number of points after rolling, given a set
+    of kept dice, is computed one die at a time: rolling the
+    dice that aren't kept is the same as rolling one of them,
+    adding it to the kept dice, and rolling the rest.  So
+    the expected number of points given a set of kept dice
+    is the average over the faces of the first die rolled of
+    the expected number of points given the set of kept dice
+    with that face added.  This replaces the sum over all
+    the rolls of the re-rolled dice, weighted by their
+    multiplicities, which is far too large for many dice.
+    Similarly, the maximum expected number of points over
+    the sets of dice that can be kept from a roll is found
+    by passing maxima from each set of kept dice to the sets
+    with one more die.
+
+    self.values, self.expected and self.advise work as for
+    Widget.  self.strategy[turn][roll] is computed when it is
+    looked up, from self._keep_values[turn], the expected
+    number of points for each set of kept dice.
+    """
+    def __init__(self,points,n_dice=5,n_faces=6,n_rolls=3,compute=True):
+        """
+        Same arguments as Widget, except that lazy mode isn't
+        supported.
+        """
+        Widget.__init__(self,points,n_dice,n_faces,n_rolls,compute)
+
+    def make_table(self):
+        """
+        Returns the CountTable for this Widget's dice.
+        """
+        return count_table(self.n_dice,self.n_faces)
+
+    def compute_strategy(self):
+        """
+        Compute the expected number of points after a given
+        roll (self.values), and for each set of kept dice
+        (self._keep_values), at each turn.  The strategy is
+        read off these when it is looked up.
+        """
+        table=self.table
+        self._keep_values=zeros((self.n_rolls-1,table.num_keeps))
+        for turn in range(self.n_rolls-2,-1,-1):
+            #Expected number of points for each set of kept
+            #dice, one die at a time.
+            expected_pts=self.roll_expectation(self._values[turn+1])
+            self._keep_values[turn]=expected_pts
+
+            #best[k] is the maximum expected number of points
+            #over the sets of dice that can be kept from set k,
+            #built up from the sets with fewer dice.
+            best=expected_pts.copy()
+            for m in range(self.n_dice):
+                block=slice(table.keep_offsets[m],table.keep_offsets[m+1])
+                for j in range(self.n_faces):
+                    #up[:,j] is one-to-one, so there are no
+                    #repeated indices here.
+                    up=table.up[block,j]
+                    best[up]=maximum(best[up],best[block])
+            self._values[turn]=best[table.keep_offsets[-2]:]
+            self.strategy[turn]=CountStrategyDict(self,turn)
+
+        self.lazy=False
+        self.compute_expected()
+
+    def update_strategy(self,rolls):
+        """
+        Re-solves the Widget after update_points.  There is
+        no SubrollIndex to find what depends on the changed
+        rolls, so everything is recomputed.
+        """
+        self.compute_strategy()
+
+    def roll_expectation(self,values):
+        """
+        Given values, the number of points for each roll,
+        returns the expected number of points after rolling
+        for each set of kept dice, (the equivalent of
+        TransitionKernel.expectation).
+        """
+        table=self.table
+        expected_pts=zeros(table.num_keeps)
+        expected_pts[table.keep_offsets[-2]:]=values
+        for m in range(self.n_dice-1,-1,-1):
+            block=slice(table.keep_offsets[m],table.keep_offsets[m+1])
+            expected_pts[block]=expected_pts[table.up[block]].mean(axis=1)
+        return expected_pts
+
+    def compute_expected(self):
+        """
+        Compute the a priori expected number of points
+        (self.expected), i.e. the expected number of points
+        after rolling all of the dice, given by
+        self.values[0].
+        """
+        self.expected=float(self.roll_expectation(self._values[0])[0])
+
+    def expected_given_kept(self,kept,turn):
+        """
+        Calculate the expected number of points if you keep
+        dice 'kept' at turn 'turn', (given that you use optimal
+        strategy after that).
+        """
+        return float(self._keep_values[turn,self.table.keep_index(tuple(kept))])
+
+    def init_lazy(self):
+        print >> sys.stderr, "Error in CountWidget: lazy mode is not supported."
+        exit()
+
+    def save(self,path):
+        print >> sys.stderr, "Error in CountWidget.save: saving is not supported."
+        exit()
+
+class RollTable:
+    """
+    Enumerates all possible rolls of n_dice dice with
+    n_faces faces, together with all of the sets of dice
+    that can be kept from them, and maps each of them to
+    a contiguous integer index so that quantities
+    associated with rolls can be stored in arrays rather
+    than dictionaries keyed by tuples.
+
+    Rolls are numbered in the order that rolls() produces
+    them, i.e. the roll with index i is the i'th roll
+    returned by rolls(n_dice,n_faces).  Sets of kept dice
+    ("keeps") are numbered first by the number of dice
+    kept, (from 0 to n_dice), and then in the order that
+    rolls() produces them.  Thus the last num_rolls keeps
+    are the rolls themselves, (keeping all of the dice).
+    """
+    def __init__(self,n_dice,n_faces):
+        self.n_dice=n_dice
+        self.n_faces=n_faces
+        #Fair dice, (see LoadedRollTable).
+        self.probs=None
+
+        self.init_ranks()
+
+        #self.multisets[m] is an array of shape
+        #(n_multisets(m,n_faces),m) whose rows are all the
+        #sorted tuples of length m, in the order that rolls()
+        #produces them, and self.weights[m] is the
+        #multiplicity of each of them.
+        self.multisets=[]
+        self.weights=[]
+        for m in range(n_dice+1):
+            ms=list(combinations_with_replacement(range(1,n_faces+1),m))
+            ms=array(ms,dtype=int).reshape(len(ms),m)
+            self.multisets.append(ms)
+            self.weights.append(multiplicities(ms,n_faces))
+
+        self.rolls=self.multisets[n_dice]
+        self.roll_weights=self.weights[n_dice]
+        self.num_rolls=len(self.rolls)
+
+        #self.counts[i,j] is the number of times face j+1
+        #appears in roll i.  Types of yahtzee combinations are
+        #computed for all rolls at once from this (see
+        #register_combo).
+        self.counts=face_counts(self.rolls,n_faces)
+
+        #keep_offsets[m] is the index of the first keep with
+        #m dice kept.
+        self.keep_offsets=zeros(n_dice+2,dtype=int)
+        for m in range(n_dice+1):
+            self.keep_offsets[m+1]=self.keep_offsets[m]+len(self.multisets[m])
+        self.num_keeps=self.keep_offsets[-1]
+
+        #Tuple versions, for dictionary-like access.
+        self.roll_tuples=[tuple(r) for r in self.rolls.tolist()]
+        self.keep_tuples=[tuple(k) for m in range(n_dice+1) for k in self.multisets[m].tolist()]
+
+        #The TransitionKernel and SubrollIndex are only built
+        #when they are first used, and are then kept with the
+        #table, (see the kernel and subrolls properties).
+        self._kernel=None
+        self._subrolls=None
+        #Relabelings of the rolls by permutations of the faces,
+        #kept as they are computed (see permute_rolls).
+        self._permuted_rolls={}
+
+    @property
+    def kernel(self):
+        """
+        The TransitionKernel for these dice.
+        """
+        if self._kernel is None:
+            self._kernel=TransitionKernel(self)
+        return self._kernel
+
+    @property
+    def subrolls(self):
+        """
+        The SubrollIndex for these dice.
+        """
+        if self._subrolls is None:
+            self._subrolls=SubrollIndex(self.kernel)
+        return self._subrolls
+
+    def init_ranks(self):
+        """
+        Sets up the table used by rank and rank_counts.
+        """
+        #rank_offsets[m,v] is the number of sorted tuples of
+        #length m+1, with entries between 1 and n_faces, whose
+        #first entry is less than v.  The rank of a sorted tuple
+        #t of length m (its position in the order that rolls()
+        #produces them) is then the sum over i of
+        #rank_offsets[m-1-i,t[i]]-rank_offsets[m-1-i,t[i-1]],
+        #(with t[-1] replaced by 1), since this counts the
+        #tuples that agree with t before entry i and are
+        #smaller at entry i.
+        n_faces=self.n_faces
+        self.rank_offsets=zeros((max(self.n_dice,1),n_faces+1),dtype=int)
+        for m in range(self.n_dice):
+            for v in range(2,n_faces+1):
+                self.rank_offsets[m,v]=self.rank_offsets[m,v-1]+n_multisets(m,n_faces-v+2)
+        self._rank_offsets=self.rank_offsets.tolist()
+
+    def rank_counts(self,counts):
+        """
+        Same as rank, but with each sorted tuple given by
+        a row of the 2d array counts, whose entry j is the
+        number of times j+1 appears in the tuple.  (The rows
+        can have different totals.)
+
+        Only the first entry of each run of equal numbers in
+        a sorted tuple contributes to its rank, (see
+        init_ranks), so only need the position of the first
+        appearance of each number, and the number before it.
+        """
+        counts=asarray(counts,dtype=int)
+        n_rows,n_faces=counts.shape
+        faces=arange(1,n_faces+1)
+        present=counts>0
+        first=cumsum(counts,axis=1)-counts
+        rem=clip(counts.sum(axis=1).reshape(-1,1)-1-first,0,None)
+        #prev[:,j] is the largest number less than j+1 in the
+        #tuple, or 1 if there isn't one.
+        prev=maximum.accumulate(where(present,faces,1),axis=1)
+        prev=hstack((ones((n_rows,1),dtype=int),prev[:,:-1]))
+        return where(present,self.rank_offsets[rem,faces]-self.rank_offsets[rem,prev],0).sum(axis=1)
+
+    def rank(self,multisets):
+        """
+        Returns the array of ranks of the rows of the 2d
+        array multisets, each of which is a sorted tuple of
+        the same length.  The rank of a sorted tuple is its
+        position in the order that rolls() produces them.
+        """
+        m=multisets.shape[1]
+        if m==0:
+            return zeros(len(multisets),dtype=int)
+        rem=arange(m-1,-1,-1)
+        prev=hstack((ones((len(multisets),1),dtype=int),multisets[:,:-1]))
+        return (self.rank_offsets[rem,multisets]-self.rank_offsets[rem,prev]).sum(axis=1)
+
+    def _rank_tuple(self,t):
+        """
+        Rank of a single sorted tuple t, (see rank), or None
+        if t is not a sorted tuple of integers between 1
+        and n_faces.
+        """
+        m=len(t)
+        r=0
+        prev=1
+        for i in range(m):
+            v=t[i]
+            if v!=int(v) or v<prev or v>self.n_faces:
+                return None
+            r+=self._rank_offsets[m-1-i][v]-self._rank_offsets[m-1-i][prev]
+            prev=v
+        return r
+
+    def index(self,roll):
+        """
+        Returns the index of roll, (a sorted tuple of length
+        n_dice), or None if roll is not a valid roll.
+        """
+        try:
+            if len(roll)!=self.n_dice:
+                return None
+            return self._rank_tuple(roll)
+        except TypeError:
+            return None
+
+    def keep_index(self,kept):
+        """
+        Returns the index of the set of kept dice kept,
+        (a sorted tuple of length at most n_dice), or None
+        if kept is not a valid set of kept dice.
+        """
+        try:
+            if len(kept)>self.n_dice:
+                return None
+            r=self._rank_tuple(kept)
+        except TypeError:
+            return None
+        if r==None:
+            return None
+        return self.keep_offsets[len(kept)]+r
+
+    def unrank(self,i):
+        """
+        Returns the roll with index i, as a sorted tuple.
+        """
+        return self.roll_tuples[i]
+
+    def unrank_keep(self,k):
+        """
+        Returns the set of kept dice with index k, as a
+        sorted tuple.
+        """
+        return self.keep_tuples[k]
+
+    def subroll_keeps(self,rolls):
+        """
+        Returns (indptr,keeps), listing the indices of all of
+        the sets of dice that can be kept from each of the rolls
+        whose indices are in the array rolls, in increasing
+        order, in the format of SubrollIndex: the sets for
+        rolls[j] are keeps[indptr[j]:indptr[j+1]].
+
+        They are read off the SubrollIndex if it has been
+        built, and otherwise generated for these rolls only:
+        the sets of dice that can be kept from a roll are all
+        the face count vectors that are at most the roll's in
+        each entry, which are built up one face at a time, and
+        ranked with rank_counts.
+        """
+        rolls=asarray(rolls,dtype=int)
+        if self._subrolls is not None:
+            positions,indptr=self._subrolls.segments(rolls)
+            return indptr,self._subrolls.indices[positions]
+        counts=self.counts[rolls]
+        owners=arange(len(rolls))
+        kept=zeros((len(rolls),self.n_faces),dtype=int)
+        for j in range(self.n_faces):
+            reps=counts[owners,j]+1
+            starts=cumsum(reps)-reps
+            owners=repeat(owners,reps)
+            kept=repeat(kept,reps,axis=0)
+            kept[:,j]=arange(len(owners))-repeat(starts,reps)
+        keeps=self.keep_offsets[kept.sum(axis=1)]+self.rank_counts(kept)
+        keeps=keeps[lexsort((keeps,owners))]
+        indptr=zeros(len(rolls)+1,dtype=int)
+        indptr[1:]=cumsum(bincount(owners,minlength=len(rolls)))
+        return indptr,keeps
+
+    def kernel_rows(self,keeps):
+        """
+        Returns (counts,denominators), the rows of the
+        TransitionKernel's counts for the sets of kept dice
+        whose indices are in the array keeps, as a sparse CSR
+        matrix, and their denominators, (see TransitionKernel).
+
+        They are read off the TransitionKernel if it has been
+        built, and otherwise generated for these sets of kept
+        dice only, in the same way, with the entries of each
+        row in the same order, so that products with them give
+        exactly the same results.
+        """
+        keeps=asarray(keeps,dtype=int)
+        if self._kernel is not None:
+            return self._kernel.rows(keeps),self._kernel.denominators[keeps]
+        denominators=zeros(len(keeps))
+        if len(keeps)==0:
+            return csr_matrix((0,self.num_rolls)),denominators
+        rows=[]
+        cols=[]
+        data=[]
+        sizes=searchsorted(self.keep_offsets,keeps,side='right')-1
+        for m in unique(sizes):
+            #Pair each of these keeps of m dice with every roll
+            #of the remaining n_dice-m dice.
+            positions=flatnonzero(sizes==m)
+            kept=face_counts(self.multisets[m][keeps[positions]-self.keep_offsets[m]],self.n_faces)
+            rolled=face_counts(self.multisets[self.n_dice-m],self.n_faces)
+            mult=self.weights[self.n_dice-m]
+            rows.append(repeat(positions,len(rolled)))
+            cols.append(self.rank_counts(repeat(kept,len(rolled),axis=0)+tile(rolled,(len(kept),1))))
+            data.append(tile(mult,len(kept)))
+            denominators[positions]=mult.sum()
+        counts=csr_matrix((hstack(data),(hstack(rows),hstack(cols))),shape=(len(keeps),self.num_rolls))
+        counts.sort_indices()
+        return counts,denominators
+
+class LoadedRollTable(RollTable):
+    """
+    Same as RollTable, for dice whose faces don't all come
+    up with the same probability: self.probs[j] is the
+    probability of face j+1.  The rolls and sets of kept dice
+    are the same as for fair dice, so they are copied from the
+    fair RollTable, and so is its SubrollIndex, (the same dice
+    can be kept from each roll).  Only self.weights differ:
+    self.weights[m] is the probability of each sorted tuple of
+    m dice, its multiplicity times the product of the
+    probabilities of its faces.  The TransitionKernel built
+    from them has these probabilities as its counts, with
+    denominators of 1, (up to rounding), so expectations,
+    and everything built on them, need no other changes.
+    """
+    def __init__(self,n_dice,n_faces,probs):
+        self.fair=roll_table(n_dice,n_faces)
+        self.__dict__.update(self.fair.__dict__)
+        self.probs=probs
+        p=array(probs)
+        self.weights=[w*prod(p**face_counts(ms,n_faces),axis=1) for ms, w in zip(self.multisets,self.fair.weights)]
+        self.roll_weights=self.weights[n_dice]
+        self._kernel=None
+
+    @property
+    def subrolls(self):
+        """
+        The SubrollIndex for these dice, (the same as for fair
+        dice).
+        """
+        return self.fair.subrolls
+
+    def subroll_keeps(self,rolls):
+        """
+        Same as RollTable.subroll_keeps, (the same as for fair
+        dice).
+        """
+        return self.fair.subroll_keeps(rolls)
+
+class TransitionKernel:
+    """
+    The probabilities of getting each possible roll of
+    n_dice dice with n_faces faces, starting from each
+    possible set of kept dice and re-rolling the rest.
+    Rolls and sets of kept dice are numbered as in
+    RollTable.
+
+    The probabilities are stored as a sparse matrix
+    self.counts of shape (num_keeps,num_rolls), where
+    self.counts[k,i] is the multiplicity of the dice that
+    have to be rolled to get from keep k to roll i, (0 if
+    roll i doesn't contain the dice in keep k), together
+    with self.denominators[k], the total multiplicity of
+    all rolls of the re-rolled dice.  The probability is
+    self.counts[k,i]/self.denominators[k].  Keeping the
+    multiplicities and denominators separate means that
+    expectation values are computed as float(tot)/float(denom),
+    as they were before the kernel existed.  For loaded dice,
+    (see LoadedRollTable), the multiplicities are
+    probabilities instead, and the denominators are 1.
+    """
+    def __init__(self,table):
+        self.table=table
+        n_dice=table.n_dice
+
+        rows=[]
+        cols=[]
+        data=[]
+        self.denominators=zeros(table.num_keeps)
+        for m in range(n_dice+1):
+            #Pair every keep of m dice with every roll of the
+            #remaining n_dice-m dice.
+            kept=table.multisets[m]
+            rolled=table.multisets[n_dice-m]
+            mult=table.weights[n_dice-m]
+            n_kept=len(kept)
+            n_rolled=len(rolled)
+            final=hstack((repeat(kept,n_rolled,axis=0),tile(rolled,(n_kept,1))))
+            rows.append(repeat(arange(table.keep_offsets[m],table.keep_offsets[m+1]),n_rolled))
+            cols.append(table.rank(sort(final,axis=1)))
+            data.append(tile(mult,n_kept))
+            self.denominators[table.keep_offsets[m]:table.keep_offsets[m+1]]=mult.sum()
+        self.counts=csr_matrix((hstack(data),(hstack(rows),hstack(cols))),shape=(table.num_keeps,table.num_rolls))
+        self.counts.sort_indices()
+        self._matrix=None
+
+    @property
+    def matrix(self):
+        """
+        The transition probabilities, as a sparse CSR matrix
+        of shape (num_keeps,num_rolls).
+        """
+        if self._matrix is None:
+            self._matrix=csr_matrix(self.counts.multiply(1./self.denominators.reshape(-1,1)))
+        return self._matrix
+
+    def rows(self,keeps):
+        """
+        Returns the rows of self.counts for the sets of kept
+        dice whose indices are in the array keeps, as a sparse
+        CSR matrix.  The entries of each row are kept in the
+        same order as in self.counts, so that products with
+        it give exactly the same results.
+        """
+        keeps=asarray(keeps,dtype=int)
+        positions,indptr=gather_segments(self.counts.indptr,keeps)
+        return csr_matrix((self.counts.data[positions],self.counts.indices[positions],indptr),shape=(len(keeps),self.table.num_rolls))
+
+    def expectation(self,values,keeps=None):
+        """
+        Given values, an array of the points for each roll,
+        (or a 2d array with one column for each of several
+        point tables), returns the expected number of points
+        after rolling, for each set of kept dice, or for the
+        sets of kept dice whose indices are listed in keeps.
+        """
+        counts=self.counts
+        denominators=self.denominators
+        if keeps is not None:
+            counts=self.rows(keeps)
+            denominators=denominators[keeps]
+        if values.ndim>1:
+            denominators=denominators.reshape(-1,1)
+        return counts.dot(values)/denominators
+
+class SubrollIndex:
+    """
+    Lists, for each possible roll of n_dice dice with
+    n_faces faces, the indices of all of the sets of dice
+    that can be kept from it, i.e. its subrolls (see
+    subroll).  Rolls and sets of kept dice are numbered as
+    in RollTable.  The subrolls of the roll with index i are
+    self.indices[self.indptr[i]:self.indptr[i+1]], in
+    increasing order.
+
+    A set of kept dice can be kept from a roll exactly
+    when the roll can be reached from it by re-rolling the
+    other dice, so this is the pattern of nonzero entries
+    of the transition kernel, read by column.
+    """
+    def __init__(self,kernel):
+        self.table=kernel.table
+        incidence=kernel.counts.T.tocsr()
+        incidence.sort_indices()
+        self.indptr=incidence.indptr
+        self.indices=incidence.indices
+        #self.rows[j] is the index of the roll that entry j
+        #of self.indices belongs to.
+        self.rows=repeat(arange(self.table.num_rolls),diff(self.indptr))
+        self._up=None
+
+    @property
+    def up(self):
+        """
+        self.up[k,j] is the index of the set of kept dice you
+        get by adding a die showing j+1 to set k, (for sets
+        with fewer than n_dice dice), as for CountTable.  Only
+        built if it is needed.
+        """
+        if self._up is None:
+            table=self.table
+            self._up=zeros((table.keep_offsets[-2],table.n_faces),dtype=int)
+            for m in range(table.n_dice):
+                counts=face_counts(table.multisets[m],table.n_faces)
+                for j in range(table.n_faces):
+                    added=counts.copy()
+                    added[:,j]+=1
+                    self._up[table.keep_offsets[m]:table.keep_offsets[m+1],j]=table.keep_offsets[m+1]+table.rank_counts(added)
+        return self._up
+
+    def segments(self,rolls):
+        """
+        Returns (positions,indptr), where positions lists the
+        positions in self.indices of the subrolls of each of
+        the rolls whose indices are in the array rolls, one
+        roll after another, and the subrolls of rolls[j] are
+        at positions[indptr[j]:indptr[j+1]].
+        """
+        return gather_segments(self.indptr,rolls)
+
+    def best_values(self,expected_pts):
+        """
+        Same as the values returned by best_keeps, (without
+        finding which sets of kept dice are optimal).
+        """
+        return maximum.reduceat(expected_pts[self.indices],self.indptr[:-1],axis=0)
+
+    def best_keeps(self,expected_pts,rolls=None):
+        """
+        Given expected_pts, the expected number of points for
+        each set of kept dice, returns (values,indptr,indices),
+        where values is the maximum expected number of points
+        for each roll over the sets of dice that can be kept
+        from it, and (indptr,indices) list the indices of the
+        sets of kept dice achieving the maximum, (within the
+        tolerance of eql_float), in the format of
+        Widget._strategy.
+
+        expected_pts can also be a 2d array with one column
+        for each of several point tables, in which case
+        values and indptr have one column for each table,
+        and indices is a list with one array for each table.
+
+        If rolls, an array of roll indices, is given, only
+        those rolls are considered, and the results are for
+        rolls[0], rolls[1], etc. in that order.  Only the
+        entries of expected_pts for subrolls of those rolls
+        are used.
+        """
+        if expected_pts.ndim>1:
+            if rolls is None:
+                return self.best_keeps_together(expected_pts)
+            results=[self.best_keeps(row,rolls) for row in ascontiguousarray(expected_pts.T)]
+            return array([r[0] for r in results]).T,array([r[1] for r in results]).T,[r[2] for r in results]
+        if rolls is None:
+            return best_in_segments(expected_pts,self.indptr,self.indices,self.rows)
+        positions,indptr=self.segments(rolls)
+        return best_in_segments(expected_pts,indptr,self.indices[positions])
+
+    def best_keeps_together(self,expected_pts):
+        """
+        Same as best_keeps for all of the rolls, for a 2d array
+        expected_pts with one column for each of several point
+        tables, selecting for all of them at once.
+
+        Rather than going through every roll's subrolls, the
+        maximum over the subrolls of every set of kept dice is
+        built up for all of the tables from the sets with
+        fewer dice, one die at a time, (as in
+        CountWidget.compute_strategy), which takes about
+        n_faces steps per set of kept dice instead of one per
+        subroll of every roll.  A set of kept dice can only be
+        optimal for a roll if it is also optimal among its own
+        subrolls, (its maximum is at most the roll's), so only
+        those sets are compared with the rolls' maximums.  For
+        a table whose expected number of points is the same
+        for every set of kept dice, (e.g. straights with many
+        dice), every subroll is optimal, and self.indptr and
+        self.indices are returned for it as they are.  The
+        results are the same as for each column on its own.
+        """
+        table=self.table
+        n_tables=expected_pts.shape[1]
+        best=expected_pts.copy()
+        for m in range(table.n_dice):
+            block=slice(table.keep_offsets[m],table.keep_offsets[m+1])
+            for j in range(table.n_faces):
+                #up[:,j] is one-to-one, so there are no
+                #repeated indices here.
+                up=self.up[block,j]
+                best[up]=maximum(best[up],best[block])
+        values=best[table.keep_offsets[-2]:]
+
+        indptr=zeros((table.num_rolls+1,n_tables),dtype=int)
+        indices=[self.indices]*n_tables
+        constant=eql_floats(expected_pts.min(axis=0),expected_pts.max(axis=0))
+        indptr[:,constant]=self.indptr[:,newaxis]
+        #One row for each table from here on.
+        expected_pts=ascontiguousarray(expected_pts.T)
+        locally_optimal=expected_pts>=near_maximum(ascontiguousarray(best.T))
+        row_values=ascontiguousarray(values.T)
+        for t in flatnonzero(~constant):
+            positions=flatnonzero(locally_optimal[t].take(self.indices))
+            keeps=self.indices[positions]
+            rolls=self.rows[positions]
+            x=expected_pts[t].take(keeps)
+            y=row_values[t].take(rolls)
+            #Most of them are exactly equal to the maximum, and
+            #most of the rest are far from it.
+            optimal=x==y
+            near=flatnonzero(~optimal&(x>=near_maximum(y)))
+            optimal[near]=eql_floats(x[near],y[near])
+            indptr[1:,t]=cumsum(bincount(rolls[optimal],minlength=table.num_rolls))
+            indices[t]=keeps[optimal]
+        return values,indptr,indices
+
+class CountTable(RollTable):
+    """
+    Alternative to RollTable for large numbers of dice,
+    used by CountWidget.  Rolls and sets of kept dice are
+    numbered in the same way as in RollTable, but they are
+    represented by the number of times each face appears
+    in them, (self.keep_counts and self.counts), rather
+    than by sorted tuples, which are only built if they are
+    asked for.  There is no TransitionKernel or
+    SubrollIndex; instead self.up[k,j] is the index of the
+    set of kept dice you get by adding a die showing j+1 to
+    set k, (for sets with fewer than n_dice dice).
+    """
+    def __init__(self,n_dice,n_faces):
+        self.n_dice=n_dice
+        self.n_faces=n_faces
+        self.probs=None
+        self.init_ranks()
+
+        #Face counts of the sets of kept dice of each size.
+        blocks=[count_vectors(m,n_faces) for m in range(n_dice+1)]
+        self.keep_offsets=zeros(n_dice+2,dtype=int)
+        for m in range(n_dice+1):
+            self.keep_offsets[m+1]=self.keep_offsets[m]+len(blocks[m])
+        self.num_keeps=self.keep_offsets[-1]
+        self.keep_counts=vstack(blocks).astype(int16)
+        self.counts=blocks[-1]
+        self.num_rolls=len(self.counts)
+
+        self.up=zeros((self.keep_offsets[-2],n_faces),dtype=int32)
+        for m in range(n_dice):
+            for j in range(n_faces):
+                added=blocks[m].copy()
+                added[:,j]+=1
+                self.up[self.keep_offsets[m]:self.keep_offsets[m+1],j]=self.keep_offsets[m+1]+self.rank_counts(added)
+
+        self._rolls=None
+        self._roll_tuples=None
+
+    @property
+    def rolls(self):
+        """
+        Array of shape (num_rolls,n_dice) of the rolls as
+        sorted tuples, (only built if it is needed).
+        """
+        if self._rolls is None:
+            self._rolls=counts_to_multisets(self.counts)
+        return self._rolls
+
+    @property
+    def roll_tuples(self):
+        """
+        List of the rolls as sorted tuples, (only built if it
+        is needed).
+        """
+        if self._roll_tuples is None:
+            self._roll_tuples=[tuple(r) for r in self.rolls.tolist()]
+        return self._roll_tuples
+
+    @property
+    def roll_weights(self):
+        """
+        The multiplicity of each roll, (as floats, since they
+        are too large to be exact integers for many dice).
+        """
+        log_fact=log_factorials(self.n_dice)
+        return exp(log_fact[-1]-log_fact[self.counts].sum(axis=1))
+
+    def unrank_keep(self,k):
+        """
+        Returns the set of kept dice with index k, as a
+        sorted tuple.
+        """
+        return tuple(counts_to_multisets(self.keep_counts[k:k+1].astype(int))[0])
+
+    def subroll_keeps(self,rolls):
+        """
+        Same as RollTable.subroll_keeps, without a SubrollIndex.
+        The sets of dice that can be kept from a roll are all
+        the face count vectors that are at most the roll's in
+        each entry, so they are built up one face at a time from
+        keeping nothing, each set being repeated once for each
+        number of dice showing the next face that can be added
+        to it, (through self.up).
+        """
+        counts=self.counts[asarray(rolls,dtype=int)]
+        owners=arange(len(counts))
+        keeps=zeros(len(counts),dtype=int)
+        for j in range(self.n_faces):
+            reps=counts[owners,j].astype(int)+1
+            starts=cumsum(reps)-reps
+            added=arange(reps.sum())-repeat(starts,reps)
+            keeps=repeat(keeps,reps)
+            owners=repeat(owners,reps)
+            for c in range(1,reps.max()):
+                more=flatnonzero(added>=c)
+                keeps[more]=self.up[keeps[more],j]
+        keeps=keeps[lexsort((keeps,owners))]
+        indptr=zeros(len(counts)+1,dtype=int)
+        indptr[1:]=cumsum(bincount(owners,minlength=len(counts)))
+        return indptr,keeps
+
+    @property
+    def kernel(self):
+        print >> sys.stderr, "Error in CountTable: there is no TransitionKernel for a CountTable."
+        exit()
+
+    @property
+    def subrolls(self):
+        print >> sys.stderr, "Error in CountTable: there is no SubrollIndex for a CountTable."
+        exit()
+
+class FaceSymmetry:
+    """
+    The orbits of the rolls and sets of kept dice of n_dice
+    dice with n_faces faces under a group of relabelings of
+    the faces, given by a list of generators, and the
+    transition kernel and subroll index between orbits, (see
+    Widget.compute_symmetric).
+
+    Each generator is a tuple giving the new label of each
+    face from 1 to n_faces.  self.roll_orbits[i] is the orbit
+    of the roll with index i, and self.roll_reps[o] is the
+    index of the first roll in orbit o, and similarly for
+    self.keep_orbits and self.keep_reps.  The orbits are
+    found as the connected components of the graph joining
+    each roll to its relabelings by each generator.
+
+    self.counts[o,p] is the sum of the multiplicities in the
+    transition kernel from the representative of keep orbit
+    o to all of the rolls in roll orbit p, so the expected
+    number of points after rolling from any set of kept dice
+    in orbit o is the same sum as for the full kernel, over
+    orbits rather than rolls.  Similarly, the sets of kept
+    dice that can be kept from the rolls in roll orbit p are
+    the ones in the keep orbits that the representative of
+    some keep orbit reaches, (self.indptr and self.indices,
+    in the format of SubrollIndex).
+    """
+    def __init__(self,table,generators):
+        self.table=table
+        self.generators=generators
+        kernel=table.kernel
+
+        roll_images=[permute_rolls(table,g) for g in generators]
+        keep_images=[permute_keeps(table,g) for g in generators]
+        self.roll_orbits,self.roll_reps=orbits(table.num_rolls,roll_images)
+        self.keep_orbits,self.keep_reps=orbits(table.num_keeps,keep_images)
+        self.num_roll_orbits=len(self.roll_reps)
+        self.num_keep_orbits=len(self.keep_reps)
+
+        #Sum the columns of the kernel's rows for the keep
+        #representatives over each roll orbit.
+        to_orbits=csr_matrix((ones(table.num_rolls),(arange(table.num_rolls),self.roll_orbits)),shape=(table.num_rolls,self.num_roll_orbits))
+        self.counts=csr_matrix(kernel.rows(self.keep_reps).dot(to_orbits))
+        self.counts.sort_indices()
+        self.denominators=kernel.denominators[self.keep_reps]
+        incidence=self.counts.T.tocsr()
+        incidence.sort_indices()
+        self.indptr=incidence.indptr
+        self.indices=incidence.indices
+
+    def expectation(self,values):
+        """
+        Same as TransitionKernel.expectation, for the values of
+        the roll orbits, giving the values of the keep orbits.
+        """
+        return self.counts.dot(values)/self.denominators
+
+    def best_values(self,expected_pts):
+        """
+        Same as SubrollIndex.best_values, for the values of
+        the keep orbits, giving the values of the roll orbits.
+        """
+        return maximum.reduceat(expected_pts[self.indices],self.indptr[:-1],axis=0)
+
+class CountStrategyDict(Mapping):
+    """
+    Read-only dictionary-like view of the optimal sets of
+    kept dice for each roll on one turn of a CountWidget, (or
+    a Widget solved with compute_symmetric), like
+    StrategyDict.  The optimal sets for a roll are
+    found when it is looked up, by comparing the expected
+    number of points for each set of dice that can be kept
+    from it with the expected number of points for the roll.
+    """
+    def __init__(self,widget,turn):
+        self.widget=widget
+        self.turn=turn
+
+    def __getitem__(self,roll):
+        w=self.widget
+        table=w.table
+        i=table.index(roll)
+        if i==None:
+            raise KeyError(roll)
+        keeps=table.subroll_keeps([i])[1]
+        keeps=keeps[eql_floats(w._keep_values[self.turn,keeps],w._values[self.turn,i])]
+        return [table.unrank_keep(k) for k in keeps]
+
+    def __iter__(self):
+        return iter(self.widget.table.roll_tuples)
+
+    def __len__(self):
+        return self.widget.table.num_rolls
+
+class SolveStats:
+    """
+    Statistics on each turn of Widget.compute_strategy,
+    recorded when a Widget is created with profile=True,
+    which show whether solving is dominated by computing
+    the expected points for each set of kept dice (the
+    enumeration of rolls), or by choosing the best sets of
+    kept dice for each roll.
+
+    self.turns is a list of TurnStats, in the order the
+    turns are computed, (last turn first).  If callback is
+    given, it is called with each TurnStats as it is
+    recorded.
+    """
+    def __init__(self,callback=None):
+        self.callback=callback
+        self.turns=[]
+
+    def clear(self):
+        """
+        Forgets the statistics recorded so far.
+        """
+        self.turns=[]
+
+    def record(self,widget,turn,start,selection_start,end):
+        """
+        Records the statistics for turn 'turn' of
+        widget.compute_strategy, which started at time
+        'start', started choosing the best sets of kept dice
+        at time 'selection_start', and ended at time 'end'.
+        """
+        kernel=widget.kernel
+        subrolls=widget.subrolls
+        indptr, indices=widget._strategy[turn]
+        #A scan of each roll's subrolls in order of decreasing
+        #expected points could stop after the optimal ones and
+        #one more, (or at the end of the list).
+        n_optimal=diff(indptr)
+        n_subrolls=diff(subrolls.indptr)
+        n_scanned=minimum(n_optimal+1,n_subrolls).sum()
+        turn_stats=TurnStats(turn=turn,
+                             seconds=end-start,
+                             expectation_seconds=selection_start-start,
+                             selection_seconds=end-selection_start,
+                             expected_given_kept_calls=int(kernel.table.num_keeps),
+                             rolls_enumerated=int(kernel.counts.nnz),
+                             subroll_checks=int(subrolls.indices.size),
+                             optimal_keeps=int(indices.size),
+                             early_break_rate=1.-float(n_scanned)/float(n_subrolls.sum()))
+        self.turns.append(turn_stats)
+        if self.callback!=None:
+            self.callback(turn_stats)
+
+    def total(self,field):
+        """
+        Sum of 'field' (e.g. 'seconds') over all the turns.
+        """
+        return sum([getattr(t,field) for t in self.turns])
+
+class ScoreDistribution:
+    """
+    The probability distribution of the number of points a
+    Widget's optimal strategy gets, from each roll at each
+    turn, and before the first roll.
+
+    The number of points is always one of the distinct point
+    values of the rolls after the last turn, self.levels, in
+    increasing order.  self.turns[turn,i,l] is the
+    probability of getting self.levels[l] points from the
+    roll with index i at turn 'turn', and self.probs[l] is
+    the a priori probability.  These are computed by the
+    same backward induction as Widget.compute_strategy,
+    with one column for each level instead of one column
+    of expected values: after the last turn, each roll gets
+    self.levels[l] points with probability 1 for its own
+    level l, the distribution for a set of kept dice is the
+    average of the distributions of the rolls it can reach,
+    (a product with the transition kernel), and the
+    distribution for a roll is the distribution for the set
+    of kept dice the strategy chooses, (see tie_breaks).
+    """
+    def __init__(self,widget,tie_break='fewest'):
+        if tie_break not in tie_breaks:
+            print >> sys.stderr, "Error in ScoreDistribution.__init__: tie_break must be one of", ", ".join(tie_breaks)
+            exit()
+        if widget.lazy:
+            widget.compute_strategy()
+        widget.expand_strategy()
+        self.widget=widget
+        self.tie_break=tie_break
+        table=widget.table
+        kernel=widget.kernel
+
+        self.levels,final=unique(widget._values[-1],return_inverse=True)
+        self.turns=zeros((widget.n_rolls,table.num_rolls,len(self.levels)))
+        self.turns[-1,arange(table.num_rolls),final]=1.
+        for turn in range(widget.n_rolls-2,-1,-1):
+            keep_probs=kernel.expectation(self.turns[turn+1])
+            indptr, indices=widget._strategy[turn]
+            indptr=asarray(indptr)
+            indices=asarray(indices)
+            if tie_break=='fewest':
+                self.turns[turn]=keep_probs[indices[indptr[:-1]]]
+            elif tie_break=='most':
+                self.turns[turn]=keep_probs[indices[indptr[1:]-1]]
+            else:
+                self.turns[turn]=add.reduceat(keep_probs[indices],indptr[:-1],axis=0)/diff(indptr).reshape(-1,1)
+        weights=table.roll_weights
+        self.probs=dot(weights,self.turns[0])/weights.sum()
+
+    def probabilities(self,turn=None,roll=None):
+        """
+        Returns the array of the probabilities of getting each
+        of self.levels points from roll at turn 'turn', (or a
+        priori if turn is None).
+        """
+        if turn==None:
+            return self.probs
+        return self.turns[turn,self.widget.table.index(tuple(sorted(roll)))]
+
+    def distribution(self,turn=None,roll=None):
+        """
+        Returns the distribution of the number of points from
+        roll at turn 'turn', (or a priori if turn is None), as
+        an OrderedDict from the number of points to its
+        probability, leaving out numbers of points that can't
+        happen.
         """
-        numbers=['ones','twos','threes','fours','fives','sixes']
-        numbers_weighted=[]
-        for combo in numbers:
-            numbers_weighted.append(combo+' weighted')
+        probs=self.probabilities(turn,roll)
+        return OrderedDict((level,p) for level, p in zip(self.levels,probs) if p>0.)
 
-        combo=points.lower()
+    def mean(self,turn=None,roll=None):
+        """
+        The expected number of points, (the same as
+        Widget.values[turn][roll], or Widget.expected).
+        """
+        return float(dot(self.probabilities(turn,roll),self.levels))
 
-        if combo not in combos and combo not in combos_weighted:
-            print >> sys.stderr, "Error in Widget.parse_points_str:", points, "not a valid combination.  Must be one of:"
-            for c in combos:
-                print >> sys.stderr, c, "[weighted]"
-            exit()
+    def variance(self,turn=None,roll=None):
+        """
+        The variance of the number of points.
+        """
+        probs=self.probabilities(turn,roll)
+        mean=dot(probs,self.levels)
+        return float(max(dot(probs,(self.levels-mean)**2),0.))
 
-        #Checked that combo is a valid combination, now big if
-        #statement to create points_dict for each combination.
-        points_dict={}
-
-        #Begin big if statement
-        #-----------------------------------------------------
-        if combo=='three of a kind' or combo=='three of a kind weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                #c.most_common(1)[0] gives an order pair:
-                #(most common number,its frequency)
-                #Thus c.most_common(1)[0][1] is the frequency
-                #of the most common number.
-                if c.most_common(1)[0][1]>=3:
-                    if combo=='three of a kind':
-                        points_dict[roll]=1.
-                    else:
-                        points_dict[roll]=float(sum(roll))
-                else:
-                    points_dict[roll]=0.
-            
-        elif combo=='four of a kind' or combo=='four of a kind weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                #c.most_common(1)[0] gives an order pair:
-                #(most common number,its frequency)
-                #Thus c.most_common(1)[0][1] is the frequency
-                #of the most common number.
-                if c.most_common(1)[0][1]>=4:
-                    if combo=='four of a kind':
-                        points_dict[roll]=1.
-                    else:
-                        points_dict[roll]=float(sum(roll))
-                else:
-                    points_dict[roll]=0.
-            
-        elif combo=='full house' or combo=='full house weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                #For an arbitary number of dice, I define a full
-                #house to be only two different numbers appearing
-                #in the roll, and n_dice/2 of each for n_dice even,
-                #but (n_dice+1)/2 of one and (n_dice-1)/2 of the
-                #other for n_dice odd.
-                #
-                #To treat both cases at the same time, let
-                #
-                #freq1=c.most_common(2)[0][1]
-                #freq2=c.most_common(2)[1][1]
-                #
-                #i.e. freq1 and freq2 are the frequencies of the
-                #two most common numbers.  For a full house, must
-                #have freq1+freq2=n_dice, and freq1, freq2 >= n_dice/2
-                #(integer division).
-                #
-                #The case of n_dice=1 must be treated separately;
-                #for that case, everything is a full house.
-                if self.n_dice==1:
-                    points_dict[roll]=1.
-                else:
-                    mc=c.most_common(2)
-                    freq1=mc[0][1]
-                    if len(mc)<2:
-                        freq2=0
-                    else:
-                        freq2=mc[1][1]
-                    if freq1+freq2==self.n_dice and freq1>=self.n_dice/2 and freq2>=self.n_dice/2:
-                        points_dict[roll]=1.
-                    else:
-                        points_dict[roll]=0.
-
-                if combo=='full house weighted':
-                    points_dict[roll]*=25.  #25 is the point value of any full house
-
-        elif combo=='small straight' or combo=='small straight weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                #A small straight means that n_dice-1 of the
-                #numbers on the dice are in consecutive order,
-                #and the remaining die can show any number.
-                #We can split this into two cases:
-                #(i) the remaining die shows a number different
-                #than any of the other dice.
-                #(ii) the remaining die shows a number the
-                #same as one of the other dice.
-                #Thus we have (i) all dice show different values
-                #and (ii) two dice show the same values but all
-                #the rest are different.  Therefore, we can look at
-                #
-                #freq1=c.most_common(2)[0][1]
-                #freq2=c.most_common(2)[1][1]
-                #
-                #which are the frequencies of the most and second
-                #most common number.  If freq1>2 then we definitely
-                #can't have a small straight.  If freq1=2 and freq2=2,
-                #then this is not a small straight either.  If freq1=2,
-                #and freq2=1, then we can use the fact that roll is
-                #sorted and test for case (ii) by checking if
-                #roll[-1]-roll[0]=n_dice-2.  
-                #If freq1=1 then all dice show different values, and
-                #we can check for case(i) by checking if
-                #roll[-2]-roll[0]=n_dice-2 or roll[-1]-roll[1]=n_dice-2.
-                #
-                #n_dice<=2 must be treated separately; in this case
-                #everything is a small straight.
-                if self.n_dice<=2:
-                    points_dict[roll]=1.
-                else:
-                    mc=c.most_common(2)
-                    freq1=mc[0][1]
-                    if len(mc)<2:
-                        freq2=0
-                    else:
-                        freq2=mc[1][1]
-                    if freq1>2:
-                        points_dict[roll]=0.
-                    elif freq1==2:
-                        if freq2==1 and roll[-1]-roll[0]==self.n_dice-2:
-                            points_dict[roll]=1.
-                        else:
-                            points_dict[roll]=0.
-                    else:
-                        if roll[-2]-roll[0]==self.n_dice-2 or roll[-1]-roll[1]==self.n_dice-2:
-                            points_dict[roll]=1.
-                        else:
-                            points_dict[roll]=0.
-                
-                if combo=='small straight weighted':
-                    points_dict[roll]*=30.  #30 is the point value of any small straight
-
-        elif combo=='large straight' or combo=='large straight weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                #A large straight is when all dice show numbers
-                #in consecutive order.  Since roll is sorted, can
-                #test for this by checking that all numbers in
-                #the roll are different (c.most_common(1)[0][1]=1),
-                #and that roll[-1]-roll[0]=n_dice-1.
-                if c.most_common(1)[0][1]==1 and roll[-1]-roll[0]==self.n_dice-1:
-                    points_dict[roll]=1.
-                else:
-                    points_dict[roll]=0.
-
-                if combo=='large straight weighted':
-                    points_dict[roll]*=40.  #40 is the point value of any large straight
-
-        elif combo=='yahtzee' or combo=='yahtzee weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                if c.most_common(1)[0][1]==self.n_dice:
-                    points_dict[roll]=1.
-                else:
-                    points_dict[roll]=0.
-
-                if combo=='yahtzee weighted':
-                    points_dict[roll]*=50.  #50 is the point value of any yahtzee
-
-        elif combo=='chance' or combo=='chance weighted':
-            for roll in rolls(self.n_dice,self.n_faces):
-                if combo=='chance':
-                    points_dict[roll]=1.
-                else:
-                    points_dict[roll]=float(sum(roll))
-
-        elif combo in numbers or combo in numbers_weighted:
-            if combo in numbers:
-                num=numbers.index(combo)+1
-            else:
-                num=numbers_weighted.index(combo)+1
-            for roll in rolls(self.n_dice,self.n_faces):
-                c=Counter(roll)
-                if combo in numbers:
-                    if c[num]>0:
-                        points_dict[roll]=1.
-                    else:
-                        points_dict[roll]=0.
-                else:
-                    points_dict[roll]=float(c[num]*num)
-
-        #-----------------------------------------------------
-        #End of big if statement to create points_dict for
-        #each combination.  Now pass points_dict to
-        #self.parse_points_dict.
-        self.parse_points_dict(points_dict)
+    def std(self,turn=None,roll=None):
+        """
+        The standard deviation of the number of points.
+        """
+        return sqrt(self.variance(turn,roll))
 
-    def parse_points_dict(self,points):
+    def quantile(self,q,turn=None,roll=None):
         """
-        Uses the dictionary points to initialize
-        self.values[-1].  Checks that the keys
-        of points correspond to unique rolls
-        before copying to self.values[-1].
+        The smallest number of points x such that the
+        probability of getting at most x points is at least q,
+        (q can also be an array of probabilities).
         """
+        cdf=cumsum(self.probabilities(turn,roll))
+        #Allow for rounding in the last cumulative probability.
+        cdf/=cdf[-1]
+        return self.levels[minimum(searchsorted(cdf,q-1.E-12),len(self.levels)-1)]
 
-        #Clear self.values[-1]
-        self.values[-1]={}
+class AdviceTable:
+    """
+    A Widget's strategy compiled into arrays, so that the
+    optimal sets of kept dice for any number of rolls can be
+    looked up at once, in constant time per roll (see
+    Widget.advise_batch).
 
-        #Run through the key, value pairs of points, check that
-        #the keys are valid rolls, then add the key, value pair
-        #to self.values[-1].
-        for key, value in points.iteritems():
-            
-            if type(key)!=tuple:
-                print >> sys.stderr, "Error in Widget.parse_points_dict: keys in points dictionary must be tuples."
-                exit()
+    A set of kept dice is encoded as a bitmask over the
+    positions of the sorted roll it is kept from: bit p is
+    set if the p'th die of the sorted roll is kept, where the
+    dice kept from each run of equal numbers are the first
+    ones in the run.  self.masks[turn] lists the masks of
+    all of the optimal sets of kept dice for each roll at
+    turn 'turn', in the same order as Widget._strategy[turn],
+    (so the masks for the roll with index i are
+    self.masks[turn][indptr[i]:indptr[i+1]]), and
+    self.best[turn,i] is the one chosen by tie_break, 'fewest'
+    or 'most' (see tie_breaks).  self.best[-1] keeps all of
+    the dice, since there are no rolls left.  The masks have
+    the smallest unsigned integer type that holds n_dice
+    bits.
 
-            if len(key)!=self.n_dice:
-                print >> sys.stderr, "Error in Widget.parse_points_dict: keys in points must be tuples of length", self.n_dice
-                exit()
+    If there are at most max_codes ordered rolls, (n_faces**
+    n_dice), they are also looked up without sorting them:
+    an ordered roll is numbered by its code, the number with
+    digits roll[p]-1 in base n_faces, self.code_rolls[code]
+    is the index of the sorted roll, and
+    self.code_keep[turn,code] is the boolean array of which
+    of its dice to keep, in the order they were rolled.
+    Otherwise these are None.
+    """
+    def __init__(self,widget,tie_break='fewest',max_codes=1<<20):
+        if tie_break not in ['fewest','most']:
+            print >> sys.stderr, "Error in AdviceTable.__init__: tie_break must be 'fewest' or 'most'."
+            exit()
+        if isinstance(widget,CountWidget):
+            print >> sys.stderr, "Error in AdviceTable.__init__: CountWidgets are not supported."
+            exit()
+        table=widget.table
+        n_dice=widget.n_dice
+        self.tie_break=tie_break
+        self.dtype=min_scalar_type(2**n_dice-1)
+        self.values=widget._values
 
-            #Check that each element of the tuple representing the roll
-            #is an integer between 1 and self.n_faces.
-            for i in key:
-                if i<1 or i>self.n_faces:
-                    print >> sys.stderr, "Error in Widget.parse_points_dict: numbers in rolls must be between 1 and", self.n_faces
-                    exit()
-                if type(i)!=int:
-                    print >> sys.stderr, "Error in Widget.parse_points_dict: numbers in rolls must be integers."
-                    exit()
+        rolls=table.rolls
+        #occurrence[i,p] is the number of dice before position
+        #p in roll i with the same number.
+        first=cumsum(table.counts,axis=1)-table.counts
+        occurrence=arange(n_dice)-take_along_axis(first,rolls-1,axis=1)
+        keep_counts=vstack([face_counts(table.multisets[m],table.n_faces) for m in range(n_dice+1)])
+        place_values=uint64(1)<<arange(n_dice,dtype=uint64)
 
-            #key is a valid tuple representing a roll if you get
-            #to this point, however, we only want to deal with sorted
-            #tuples as rolls.
-            roll=tuple(sort(key))
+        self.masks=[]
+        self.best=zeros((widget.n_rolls,table.num_rolls),dtype=self.dtype)+(2**n_dice-1)
+        for turn, (indptr,indices) in enumerate(widget._strategy):
+            indptr=asarray(indptr)
+            indices=asarray(indices)
+            roll_of=repeat(arange(table.num_rolls),diff(indptr))
+            kept=occurrence[roll_of]<take_along_axis(keep_counts[indices],rolls[roll_of]-1,axis=1)
+            masks=dot(kept,place_values).astype(self.dtype)
+            self.masks.append(masks)
+            if tie_break=='fewest':
+                self.best[turn]=masks[indptr[:-1]]
+            else:
+                self.best[turn]=masks[indptr[1:]-1]
+        self.indptr=[asarray(indptr) for indptr, indices in widget._strategy]
 
-            #If this roll already has a point value assigned to it
-            #in self.values[-1], different than that of "value",
-            #then this is an error.
-            if roll in self.values[-1].keys() and self.values[-1][roll]!=value:
-                print >> sys.stderr, "Error in Widget.parse_points_dict: multiple, inconsistent point values given for roll", roll
-                exit()
-            #Otherwise we can assign a point value of "value" to
-            #this roll in self.values[-1].
-            self.values[-1][roll]=value
+        self.code_rolls=None
+        self.code_keep=None
+        n_codes=table.n_faces**n_dice
+        if n_codes<=max_codes:
+            self.place_codes=table.n_faces**arange(n_dice)
+            ordered=(arange(n_codes).reshape(-1,1)//self.place_codes)%table.n_faces+1
+            order=argsort(ordered,axis=1,kind='mergesort')
+            self.code_rolls=table.rank(take_along_axis(ordered,order,axis=1))
+            self.code_keep=zeros((widget.n_rolls,n_codes,n_dice),dtype=bool)
+            for turn in range(widget.n_rolls):
+                bits=(self.best[turn,self.code_rolls].astype(uint64).reshape(-1,1)>>arange(n_dice,dtype=uint64))&uint64(1)
+                put_along_axis(self.code_keep[turn],order,bits.astype(bool),axis=1)
 
-        #For any rolls for which point values have not yet
-        #been specified in self.values[-1], give them point
-        #values of 0.
-        for roll in rolls(self.n_dice,self.n_faces):
-            if roll not in self.values[-1].keys():
-                self.values[-1][roll]=0.
+    def lookup(self,turns,rolls):
+        """
+        Returns (masks,expected), the masks of the sets of dice
+        to keep, and the expected numbers of points, for the
+        rolls with indices in the array rolls at the turns in
+        the array turns, (starting at 0).
+        """
+        return self.best[turns,rolls],self.values[turns,rolls]
 
-    def compute_strategy(self):
+    def options(self,turn,roll):
         """
-        Compute which dice to keep for a given roll at a given
-        turn (self.strategy), and the expected number of points
-        after a given roll (self.values).
+        Returns the array of masks of all of the optimal sets
+        of kept dice for the roll with index roll at turn
+        'turn', (before the last turn).
         """
-        for turn in range(self.n_rolls-2,-1,-1):
-            #For each possible set of kept dice at this turn,
-            #calculate the expected value of the points you'll
-            #get after you roll (i.e. at the beginning of the
-            #next turn).  Number of kept dice can be from 0
-            #to self.n_dice.  (For self.n_dice kept dice, can
-            #read off the "expected" values from self.values[turn+1].)
-            #Store this in the dictionary "expected_pts", where
-            #the keys are the values of the dice kept and the values
-            #are the expected number of points after rolling.
-            expected_pts={}
-            for n_kept in range(0,self.n_dice+1):
-                for kept in rolls(n_kept,self.n_faces):
-                    expected_pts[kept]=self.expected_given_kept(kept,turn)
-            #Want to sort expected_pts by values so that it
-            #is easier to find maxima.  (Sort in reverse order
-            #so that max value is first.)
-            expected_pts_sorted=[(key,expected_pts[key]) for key in sorted(expected_pts.keys(),key=lambda k:expected_pts[k],reverse=True)]
-            #expected_pts_sorted is a list of (key,value) pairs
-            #from expected_pts that are sorted by value from max
-            #value to min value.
-            
-            
-            #Now go through all possible rolls for this turn,
-            #see which set(s) of dice are the optimal ones to keep,
-            #(in that they lead to the highest expected number of
-            #points), and record the sets in self.strategy[turn],
-            #and the expected number of points in self.values[turn].
-            for roll in rolls(self.n_dice,self.n_faces):
-                #First set self.values[turn][roll] to None, and
-                #self.strategy[turn][roll] to [], so that we know
-                #that we haven't yet found the max value yet.
-                self.values[turn][roll]=None
-                self.strategy[turn][roll]=[]
-                #Now we go through the (kept,value) pairs in
-                #expected_pts_sorted in order.
-                for kept, value in expected_pts_sorted:
-                    #We can ignore 'kept' if it is not a possible
-                    #set of dice to keep from this roll, (e.g.
-                    #if kept=(1,2,3) and roll=(1,2,4,5,6), then
-                    #it's not possible to keep 'kept' from this
-                    #roll).  Test whether we continue to examine
-                    #'kept' in the following if statement:
-                    if subroll(kept,roll):
-                        #Is this the first 'kept' we have encountered
-                        #that it is possible to keep from 'roll'?
-                        if self.values[turn][roll]==None:
-                            #Yes, thus value is the max possible
-                            #value we can get since expected_pts_sorted
-                            #is sorted.  Therefore record it in
-                            #self.values[turn][roll], (and also this will
-                            #stop us from reaching this branch of the
-                            #if statement in the future), and record
-                            #'kept' as one possible optimal strategy
-                            #in self.strategy[turn][roll].
-                            self.values[turn][roll]=value
-                            self.strategy[turn][roll].append(kept)
-                        elif eql_float(value,self.values[turn][roll]):
-                            #No, but this 'kept' has the same expectation
-                            #value of points as the optimal one we already
-                            #found.  Thus add this 'kept' to
-                            #self.strategy[turn][roll] as another possible
-                            #optimal strategy.
-                            self.strategy[turn][roll].append(kept)
-                        else:
-                            #No, and in fact this value of 'kept' has a
-                            #smaller number of expected points than the
-                            #optimal one, thus we can end the for loop
-                            #since there will be no more optimal strategies.
-                            break
-                    #If we have a value recorded for self.values[turn][roll],
-                    #we can check if the current 'value' is less than it, in
-                    #which case we can break out of the for loop right away,
-                    #even if 'kept' is not a possible keep for this roll.
-                    if self.values[turn][roll]!=None and not eql_float(value,self.values[turn][roll]):
-                        break
+        return self.masks[turn][self.indptr[turn][roll]:self.indptr[turn][roll+1]]
 
-        #We have now computed the optimal strategy and expectation
-        #values for each turn.  The last thing we want to compute
-        #is the a priori expected number of points, i.e. the average
-        #over all possible rolls of self.values[0][roll].
-        self.expected=0
-        denom=0
-        for roll in rolls(self.n_dice,self.n_faces):
-            mult=multiplicity(roll)
-            self.expected+=mult*self.values[0][roll]
-            denom+=mult
-        self.expected=float(self.expected)/float(denom)
+class LRUCache:
+    """
+    A dictionary of at most maxsize entries, which evicts
+    the least recently used entry when it is full.  Used as
+    a process-wide cache for the RollTables (and their
+    TransitionKernels and SubrollIndexes), so that every
+    Widget with the same n_dice and n_faces shares them.
+    Keeps count of hits, misses and evictions.
+    """
+    def __init__(self,maxsize):
+        self.maxsize=parse_int(maxsize,"maxsize",1)
+        self.entries=OrderedDict()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
 
-    def expected_given_kept(self,kept,turn):
+    def get(self,key,build):
         """
-        Calculate the expected number of points if you keep
-        dice 'kept' at turn 'turn', (given that you use optimal
-        strategy after that).
+        Returns the entry for key, calling build() to create
+        it if it isn't in the cache yet.
         """
-        n_kept=len(kept)
-        tot=0
-        denom=0
-        for rolled in rolls(self.n_dice-n_kept,self.n_faces):
-            roll=tuple(sort(kept+rolled))
-            mult=multiplicity(rolled)
-            #Note that it's the probability of getting the values
-            #in 'rolled' that we care about, since we have already
-            #obtained the values in 'kept' at this turn.  Thus
-            #we used multiplicity(rolled) and not multiplicity(roll).
-            tot+=mult*self.values[turn+1][roll]
-            denom+=mult
-        return float(tot)/float(denom)
+        if key in self.entries:
+            self.hits+=1
+            #Move the entry to the end, which is the most
+            #recently used.
+            value=self.entries.pop(key)
+        else:
+            self.misses+=1
+            value=build()
+            while len(self.entries)>=self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions+=1
+        self.entries[key]=value
+        return value
 
-    def advise(self,turn,roll):
+    def resize(self,maxsize):
         """
-        Gives you the optimal strategy and expected number
-        of points given a roll on a given turn.  This is
-        just a nicer way to display self.strategy[turn][roll]
-        and self.values[turn][roll].
-        NOTE:  For the input here, we assume turn numbers
-        start at 1, and then subtract 1 before using it,
-        because this is a more 'user facing' function.
+        Changes the maximum number of entries, evicting the
+        least recently used entries if there are too many.
         """
-        #Let's assume the user gives turn numbers starting
-        #at 1 rather than 0.
-        turn=parse_int(turn,"turn",1,self.n_rolls)-1
+        self.maxsize=parse_int(maxsize,"maxsize",1)
+        while len(self.entries)>self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions+=1
 
-        #Parse roll
-        r=tuple(sort(roll))
-        if len(r)!=self.n_dice:
-            print >> sys.stderr, "Error in Widget.advise: roll must consist of", self.n_dice, "dice."
-            exit()
-        if r not in self.values[0].keys():
-            print >> sys.stderr, "Error in Widget.advise:", roll, "not a valid roll."
-            exit()
+    def clear(self):
+        """
+        Removes all the entries, and resets the counts.
+        """
+        self.entries.clear()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
 
-        #Print the optimal strategy
-        if turn==self.n_rolls-1:
-            print "Score:", self.values[turn][r]
-        else:
-            print "Possible dice to keep:"
-            for keep in self.strategy[turn][r]:
-                print keep
-            print ""
-            print "Expected number of points:", self.values[turn][r]
+    def stats(self):
+        """
+        Returns a dictionary with the number of hits, misses
+        and evictions so far, and the current and maximum
+        number of entries.
+        """
+        return {'hits':self.hits,'misses':self.misses,'evictions':self.evictions,'size':len(self.entries),'maxsize':self.maxsize}
+
+class RollDict(MutableMapping):
+    """
+    Dictionary-like view of a 1d array with one entry per
+    roll, where the keys are rolls represented by sorted
+    tuples.  Used so that Widget.values[turn] can be used
+    like the dictionary it used to be.  Changes made
+    through the view change the underlying array.
+
+    If fill is given, entries of data that are NaN haven't
+    been computed yet, and fill(i) is called to compute
+    entry i before it is returned, (see Widget.init_lazy).
+    """
+    def __init__(self,table,data,fill=None):
+        self.table=table
+        self.data=data
+        self.fill=fill
 
+    def __getitem__(self,roll):
+        i=self.table.index(roll)
+        if i==None:
+            raise KeyError(roll)
+        if self.fill!=None and isnan(self.data[i]):
+            self.fill(i)
+        return self.data[i]
+
+    def __setitem__(self,roll,value):
+        i=self.table.index(roll)
+        if i==None:
+            raise KeyError(roll)
+        self.data[i]=value
+
+    def __delitem__(self,roll):
+        raise TypeError("rolls cannot be removed from a RollDict")
+
+    def __iter__(self):
+        return iter(self.table.roll_tuples)
+
+    def __len__(self):
+        return self.table.num_rolls
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+class StrategyDict(Mapping):
+    """
+    Read-only dictionary-like view of the optimal sets of
+    kept dice for each roll on one turn, stored as the
+    arrays (indptr,indices) described in Widget.__init__.
+    The keys are rolls represented by sorted tuples, and
+    the values are lists of sorted tuples of dice to keep.
+    """
+    def __init__(self,table,indptr,indices):
+        self.table=table
+        self.indptr=indptr
+        self.indices=indices
+
+    def __getitem__(self,roll):
+        i=self.table.index(roll)
+        if i==None:
+            raise KeyError(roll)
+        return [self.table.keep_tuples[k] for k in self.indices[self.indptr[i]:self.indptr[i+1]]]
+
+    def __iter__(self):
+        return iter(self.table.roll_tuples)
+
+    def __len__(self):
+        return self.table.num_rolls
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+
+class LazyStrategyDict(Mapping):
+    """
+    Read-only dictionary-like view of the optimal sets of
+    kept dice for each roll on one turn of a lazy Widget,
+    (see Widget.init_lazy), which computes the rolls that
+    are looked up as they are needed.  Otherwise the same
+    as StrategyDict.
+    """
+    def __init__(self,widget,turn):
+        self.widget=widget
+        self.turn=turn
+
+    def __getitem__(self,roll):
+        table=self.widget.table
+        i=table.index(roll)
+        if i==None:
+            raise KeyError(roll)
+        lazy_strategy=self.widget._lazy_strategy[self.turn]
+        if i not in lazy_strategy:
+            self.widget.solve_lazily(self.turn,[i])
+            if not self.widget.lazy:
+                #The whole Widget was solved (see
+                #Widget.solve_lazily).
+                return self.widget.strategy[self.turn][roll]
+        return [table.keep_tuples[k] for k in lazy_strategy[i]]
+
+    def __iter__(self):
+        return iter(self.widget.table.roll_tuples)
+
+    def __len__(self):
+        return self.widget.table.num_rolls
 
 #-----------------------                                                        
 #Functions                                                                      
 #-----------------------
 
+def solve_batch(points_list,n_dice=5,n_faces=6,n_rolls=3,probs=None,profile=False):
+    """
+    Solves many point tables with the same n_dice, n_faces,
+    n_rolls and probs together.  points_list is a list whose
+    elements are anything that can be passed as the points
+    argument of Widget, (e.g. combos+combos_weighted).
+    Returns a list of solved Widgets, one for each element
+    of points_list, giving the expected number of points
+    (Widget.expected) and optimal strategy (Widget.strategy)
+    for each point table.
+
+    The point tables are stacked into the columns of a
+    matrix, and backward induction is done on all of the
+    columns at once, (see SubrollIndex.best_keeps_together).
+    The results are the same as building each Widget
+    separately.  How much faster it is depends on the dice:
+    about the same for 5 dice, and about twice as fast for
+    all of the built-in combinations with 8 dice, (see
+    benchmark.py).  profile is as for Widget, (see
+    solve_widgets).
+    """
+    return solve_widgets([Widget(points,n_dice,n_faces,n_rolls,compute=False,profile=profile,probs=probs) for points in points_list])
+
+def solve_widgets(widgets):
+    """
+    Solves the list of unsolved Widgets, (built with
+    compute=False), which must all have the same dice and
+    n_rolls, together as in solve_batch, from their point
+    values w._values[-1].  Returns widgets.
+
+    Widgets built with profile record the statistics of
+    each turn in w.stats, as in Widget.compute_strategy.
+    The work of each turn is shared, so the times recorded
+    by each are the times for all of the point tables.
+    """
+    if len(widgets)==0:
+        return widgets
+    n_rolls=widgets[0].n_rolls
+    kernel=widgets[0].kernel
+    subrolls=widgets[0].subrolls
+
+    #Same as Widget.compute_strategy, with all of the point
+    #tables at once: values and expected_pts have one column
+    #for each table.
+    for w in widgets:
+        w._keep_values=zeros((n_rolls-1,kernel.table.num_keeps))
+        if w.stats!=None:
+            w.stats.clear()
+    values=array([w._values[-1] for w in widgets]).T
+    for turn in range(n_rolls-2,-1,-1):
+        start=time.time()
+        expected_pts=kernel.expectation(values)
+        selection_start=time.time()
+        values,indptr,indices=subrolls.best_keeps(expected_pts)
+        end=time.time()
+        for j, w in enumerate(widgets):
+            w._keep_values[turn]=expected_pts[:,j]
+            w._values[turn]=values[:,j]
+            w.set_strategy(turn,indptr[:,j].copy(),indices[j])
+            if w.stats!=None:
+                w.stats.record(w,turn,start,selection_start,end)
+
+    for w in widgets:
+        w.compute_expected()
+    return widgets
+
+def solve_expected(point_matrix,n_dice=5,n_faces=6,n_rolls=3,probs=None):
+    """
+    Like solve_batch, but for point tables given as the
+    columns of point_matrix, an array of shape
+    (num_rolls,number of tables) with rows in roll index
+    order, (see RollTable), and only computing the a priori
+    expected number of points for each table, not the
+    strategy.  Returns an array with the expected number of
+    points for each column.  This is the cheapest way to
+    solve very many point tables, e.g. in game_solver.
+    """
+    table=roll_table(n_dice,n_faces,probs)
+    kernel=table.kernel
+    subrolls=table.subrolls
+    values=point_matrix
+    for turn in range(n_rolls-2,-1,-1):
+        values=subrolls.best_values(kernel.expectation(values))
+    weights=table.roll_weights
+    return dot(weights,values)/weights.sum()
+
 def parse_int(n,name,lower=None,upper=None):
     """
     Checks that n is a type int, and that it is in
@@ -537,9 +2380,137 @@ def parse_int(n,name,lower=None,upper=None):
 
     return n
 
+def parse_probs(probs,n_faces):
+    """
+    Checks that probs is a list of n_faces positive
+    probabilities of the faces coming up, and returns them
+    normalized to add up to 1, as a tuple, (so that it can be
+    a key of table_cache), or None for fair dice, (probs None
+    or all equal), so that fair dice keep using the
+    RollTable with integer multiplicities.
+    """
+    if probs is None:
+        return None
+    p=array(probs,dtype=float).ravel()
+    if len(p)!=n_faces:
+        print >> sys.stderr, "Error: probs must have one probability for each of the", n_faces, "faces."
+        exit()
+    if not (isfinite(p).all() and (p>0).all()):
+        print >> sys.stderr, "Error: probs must all be positive."
+        exit()
+    if (p==p[0]).all():
+        return None
+    return tuple(float(x) for x in p/p.sum())
+
+#Process-wide cache of RollTables, keyed by (n_dice,n_faces),
+#or (n_dice,n_faces,'probs',probs) for loaded dice.
+#Use table_cache.stats() to see how well it is doing, and
+#table_cache.resize() to change how many are kept.
+table_cache=LRUCache(16)
+
+def roll_table(n_dice,n_faces,probs=None):
+    """
+    Returns the RollTable for n_dice dice with n_faces
+    faces, (and face probabilities probs, see parse_probs),
+    from table_cache, building it only if it isn't already
+    there.
+    """
+    probs=parse_probs(probs,n_faces)
+    if probs is None:
+        return table_cache.get((n_dice,n_faces),lambda: RollTable(n_dice,n_faces))
+    return table_cache.get((n_dice,n_faces,'probs',probs),lambda: LoadedRollTable(n_dice,n_faces,probs))
+
+def transition_kernel(n_dice,n_faces,probs=None):
+    """
+    Returns the TransitionKernel for n_dice dice with
+    n_faces faces, (cached along with the RollTable).
+    """
+    return roll_table(n_dice,n_faces,probs).kernel
+
+def subroll_index(n_dice,n_faces):
+    """
+    Returns the SubrollIndex for n_dice dice with n_faces
+    faces, (cached along with the RollTable).
+    """
+    return roll_table(n_dice,n_faces).subrolls
+
+def face_symmetry(n_dice,n_faces,generators,probs=None):
+    """
+    Returns the shared FaceSymmetry for n_dice dice with
+    n_faces faces, (and face probabilities probs), and the
+    group generated by generators, building it the first
+    time it is needed.
+    """
+    generators=sorted(set(tuple(g) for g in generators))
+    probs=parse_probs(probs,n_faces)
+    return table_cache.get((n_dice,n_faces,'symmetry',tuple(generators),probs),lambda: FaceSymmetry(roll_table(n_dice,n_faces,probs),generators))
+
+def count_table(n_dice,n_faces):
+    """
+    Returns the CountTable for n_dice dice with n_faces
+    faces from table_cache, building it only if it isn't
+    already there.
+    """
+    return table_cache.get((n_dice,n_faces,'counts'),lambda: CountTable(n_dice,n_faces))
+
+def count_vectors(m,n_faces):
+    """
+    Returns an array of shape (n_multisets(m,n_faces),n_faces)
+    whose rows are the face counts of all the possible rolls
+    of m dice with n_faces faces, (see face_counts), in the
+    order that rolls() produces the rolls.  Built one face at
+    a time: earlier rolls have more of the smaller faces.
+    """
+    vectors=zeros((1,0),dtype=int)
+    remaining=array([m])
+    for j in range(n_faces-1):
+        n_children=remaining+1
+        parent=repeat(arange(len(vectors)),n_children)
+        #Each row gets remaining, remaining-1, ..., 0 dice
+        #showing face j+1.
+        c=remaining[parent]-(arange(n_children.sum())-repeat(cumsum(n_children)-n_children,n_children))
+        vectors=hstack((vectors[parent],c.reshape(-1,1)))
+        remaining=remaining[parent]-c
+    return hstack((vectors,remaining.reshape(-1,1)))
+
+def counts_to_multisets(counts):
+    """
+    Inverse of face_counts: returns an array whose rows are
+    the sorted tuples with the face counts given by the rows
+    of the 2d array counts, which must all have the same
+    total.
+    """
+    n_rows,n_faces=counts.shape
+    m=counts[0].sum() if n_rows>0 else 0
+    multisets=ones((n_rows,m),dtype=int)
+    total=zeros(n_rows,dtype=int)
+    #Entry p of a sorted tuple is 1 plus the number of faces
+    #j for which the total count of faces 1 to j+1 is at
+    #most p.
+    for j in range(n_faces-1):
+        total+=counts[:,j]
+        multisets+=total.reshape(-1,1)<=arange(m)
+    return multisets
+
+def log_factorials(n):
+    """
+    Returns an array of log(factorial(k)) for k from 0 to n.
+    """
+    return hstack(([0.],cumsum(log(arange(1,n+1)))))
+
+def n_multisets(m,n_faces):
+    """
+    Returns the number of possible rolls of m dice with
+    n_faces faces, i.e. the number of sorted tuples of
+    length m whose entries are integers from 1 to n_faces.
+    """
+    if n_faces<=0:
+        return int(m==0)
+    return factorial(m+n_faces-1)/(factorial(m)*factorial(n_faces-1))
+
 def rolls(n_dice,upper,lower=1):
     """
-    This generator returns an iterator over all
+    Returns an iterator over all
     possible rolls of n_dice dice, where each die
     has the integer values from lower to upper
     (inclusive) exactly once on different faces.
@@ -556,20 +2527,142 @@ def rolls(n_dice,upper,lower=1):
     (5,6,6)
     (6,6,6)
     """
-    if n_dice==0:
-        yield ()
-    else:
-        for first_die in range(lower,upper+1):
-            for rest_die in rolls(n_dice-1,upper,first_die):
-                yield (first_die,)+rest_die
+    #combinations_with_replacement produces them in the
+    #same order, without building a RollTable, which would
+    #take up a place in table_cache.
+    return combinations_with_replacement(range(lower,upper+1),n_dice)
+
+#_factorials[n] is factorial(n), extended as needed by
+#multiplicity.
+_factorials=[1]
 
 def multiplicity(roll):
     """
     Returns the number of ways you can get a given roll,
     (i.e. treating the dice as distinguishable).
     """
-    c=Counter(roll)
-    return factorial(len(roll))/product([factorial(n) for n in c.values()])
+    n=len(roll)
+    while len(_factorials)<=n:
+        _factorials.append(_factorials[-1]*len(_factorials))
+    mult=_factorials[n]
+    for face, group in groupby(sorted(roll)):
+        mult//=_factorials[len(list(group))]
+    return mult
+
+def gather_segments(indptr,rows):
+    """
+    Given the indptr array of a sparse CSR matrix, (or any
+    list of segments where segment i is from indptr[i] to
+    indptr[i+1]), returns (positions,new_indptr), where
+    positions lists the positions of the entries of each of
+    the rows in the array rows, one row after another, and
+    the entries of rows[j] are at
+    positions[new_indptr[j]:new_indptr[j+1]].
+    """
+    starts=indptr[rows]
+    lengths=indptr[rows+1]-starts
+    new_indptr=zeros(len(rows)+1,dtype=int)
+    new_indptr[1:]=cumsum(lengths)
+    positions=arange(new_indptr[-1])+repeat(starts-new_indptr[:-1],lengths)
+    return positions,new_indptr
+
+def best_in_segments(expected_pts,segment_ptr,keeps,segment_rows=None):
+    """
+    Same as SubrollIndex.best_keeps, for the rolls whose
+    sets of dice that can be kept are given by
+    (segment_ptr,keeps), in the format returned by
+    RollTable.subroll_keeps.  segment_rows, the index of the
+    segment each entry of keeps is in, is computed if it
+    isn't given.
+    """
+    if segment_rows is None:
+        segment_rows=repeat(arange(len(segment_ptr)-1),diff(segment_ptr))
+    candidates=expected_pts[keeps]
+    #Every roll has at least one subroll, (keeping no
+    #dice), so none of the segments are empty.
+    values=maximum.reduceat(candidates,segment_ptr[:-1])
+    #Only the few candidates near the maximum need the full
+    #test of eql_floats (see near_maximum).
+    near=flatnonzero(candidates>=near_maximum(values)[segment_rows])
+    near=near[eql_floats(candidates[near],values[segment_rows[near]])]
+    indptr=zeros(len(segment_ptr),dtype=int)
+    indptr[1:]=cumsum(bincount(segment_rows[near],minlength=len(values)))
+    return values,indptr,keeps[near]
+
+def near_maximum(values):
+    """
+    Returns the array of thresholds below which nothing can
+    be equal to the maximum values, within the tolerance of
+    eql_floats.  A number x<=v equal to v within the
+    tolerance is less than v by less than about 2.E-10*|v|,
+    so this leaves a margin for rounding.
+    """
+    return values-4.E-10*abs(values)
+
+def splice_segments(segments,rows,indptr,indices):
+    """
+    Given segments=(old_indptr,old_indices), a list of
+    segments in the format of Widget._strategy, returns a
+    copy in which the segments for the rows in the sorted
+    array rows are replaced by the segments (indptr,indices)
+    for those rows, (as returned by
+    SubrollIndex.best_keeps).
+    """
+    old_indptr,old_indices=segments
+    lengths=diff(old_indptr)
+    lengths[rows]=diff(indptr)
+    new_indptr=zeros(len(old_indptr),dtype=old_indptr.dtype)
+    new_indptr[1:]=cumsum(lengths)
+    new_indices=zeros(new_indptr[-1],dtype=old_indices.dtype)
+    unchanged=ones(len(lengths),dtype=bool)
+    unchanged[rows]=False
+    kept=flatnonzero(unchanged)
+    new_indices[gather_segments(new_indptr,kept)[0]]=old_indices[gather_segments(old_indptr,kept)[0]]
+    new_indices[gather_segments(new_indptr,rows)[0]]=indices
+    return new_indptr,new_indices
+
+def index_set(indices,size):
+    """
+    Returns the sorted array of the distinct elements of
+    the array indices, whose elements are between 0 and
+    size-1.  Faster than unique for large arrays, since it
+    doesn't need to sort.
+    """
+    present=zeros(size,dtype=bool)
+    present[indices]=True
+    return flatnonzero(present)
+
+def multiplicities(multisets,n_faces):
+    """
+    Vectorized version of multiplicity: returns an array
+    giving the number of ways you can get each of the rolls
+    in the rows of the 2d array multisets, which must all
+    have the same number of dice.
+    """
+    #Multinomial coefficient computed as a product of
+    #binomial coefficients, one face at a time, so that
+    #intermediate results never exceed the final result.
+    counts=face_counts(multisets,n_faces)
+    mult=ones(len(multisets))
+    so_far=zeros(len(multisets),dtype=int)
+    for j in range(n_faces):
+        so_far+=counts[:,j]
+        for i in range(1,multisets.shape[1]+1):
+            has=counts[:,j]>=i
+            mult[has]*=so_far[has]-i+1
+            mult[has]/=i
+    return mult
+
+def face_counts(multisets,n_faces):
+    """
+    Returns an array of shape (len(multisets),n_faces) giving
+    the number of times each face from 1 to n_faces appears
+    in each row of the 2d array multisets.
+    """
+    counts=zeros((len(multisets),n_faces),dtype=int)
+    for j in range(n_faces):
+        counts[:,j]=(multisets==j+1).sum(axis=1)
+    return counts
 
 def subroll(sr,roll):
     """
@@ -588,6 +2681,103 @@ def subroll(sr,roll):
             return False
     return True
 
+def exact_to_float(values,scale):
+    """
+    Returns the nearest floats to the integers in the array
+    values divided by the integer scale, (see
+    Widget.compute_exact).
+    """
+    if values.dtype!=object and abs(values).max()<2**53 and scale<2**53:
+        #Both are exact as floats, so one division rounds
+        #correctly.
+        return values/float(scale)
+    return array([float(Fraction(int(v),scale)) for v in values])
+
+def permute_rolls(table,g):
+    """
+    Returns the array of the indices of the rolls you get by
+    relabeling the faces of each roll in table with the
+    permutation g, (a tuple giving the new label of each
+    face from 1 to n_faces).  The result is kept with the
+    table, since the same permutations are tried for every
+    point table.
+    """
+    g=tuple(g)
+    if g not in table._permuted_rolls:
+        labels=array((0,)+g)
+        table._permuted_rolls[g]=table.rank(sort(labels[table.rolls],axis=1))
+    return table._permuted_rolls[g]
+
+def permute_keeps(table,g):
+    """
+    Same as permute_rolls, for the sets of kept dice.
+    """
+    labels=array((0,)+tuple(g))
+    return hstack([table.keep_offsets[m]+table.rank(sort(labels[table.multisets[m]],axis=1)) for m in range(table.n_dice+1)])
+
+def orbits(size,images):
+    """
+    Given images, a list of arrays giving the image of each
+    of the numbers from 0 to size-1 under each generator of a
+    group, returns (labels,reps), where labels[i] is the
+    orbit of i, and reps[o] is the smallest number in orbit
+    o.  Orbits are numbered in order of their smallest
+    numbers.
+    """
+    rows=hstack([arange(size)]+[arange(size) for image in images])
+    cols=hstack([arange(size)]+list(images))
+    graph=csr_matrix((ones(len(rows)),(rows,cols)),shape=(size,size))
+    n, labels=connected_components(graph,directed=False)
+    orbit_ids, reps=unique(labels,return_index=True)
+    #Renumber the orbits in order of their first members.
+    order=argsort(reps)
+    renumber=zeros(n,dtype=int)
+    renumber[order]=arange(n)
+    return renumber[labels],reps[order]
+
+def face_symmetries(table,points):
+    """
+    Returns a list of generators of the group of relabelings
+    of the faces generated by the transpositions of two faces
+    that leave the array points, (the point values of each
+    roll in table), and the face probabilities of table,
+    unchanged.  If swapping faces a and b
+    and swapping faces b and c leave the points unchanged,
+    so does swapping a and c, so the faces fall into classes
+    that can be permuted freely, and the generators are the
+    transpositions of neighbouring faces in each class.  An
+    empty list means no transposition leaves the points
+    unchanged.
+    """
+    n_faces=table.n_faces
+    classes=[]
+    for b in range(1,n_faces+1):
+        for c in classes:
+            g=range(1,n_faces+1)
+            g[c[0]-1], g[b-1]=b, c[0]
+            if (points[permute_rolls(table,g)]==points).all() and preserves_probs(table.probs,g):
+                c.append(b)
+                break
+        else:
+            classes.append([b])
+    generators=[]
+    for c in classes:
+        for a, b in zip(c[:-1],c[1:]):
+            g=range(1,n_faces+1)
+            g[a-1], g[b-1]=b, a
+            generators.append(tuple(g))
+    return generators
+
+def preserves_probs(probs,g):
+    """
+    Tests whether relabeling the faces with the permutation
+    g leaves the face probabilities probs unchanged, (always
+    for fair dice, probs None).
+    """
+    if probs is None:
+        return True
+    return all([probs[g[j]-1]==probs[j] for j in range(len(probs))])
+
 def eql_float(x,y):
     """
     Tests if x and y are equal within a relative
@@ -607,6 +2797,176 @@ def eql_float(x,y):
     #average.
     return 2.*float(abs(x-y))/float(abs(x+y))<eps
 
+def eql_floats(x,y):
+    """
+    Vectorized version of eql_float: tests elementwise
+    whether the arrays x and y are equal within a
+    relative error of eps.
+    """
+    eps=1.E-10
+    diff=abs(x-y)
+    tot=abs(x+y)
+    #Where x+y is 0, use relative error with respect to x,
+    #and where x and y are both 0 they are equal.
+    scale=where(tot==0,abs(x),0.5*tot)
+    return (diff==0)|(diff<eps*scale)
+#Functions giving the point value of every roll for each
+#type of yahtzee combination that can be given to Widget
+#as a string, keyed by name.  Filled in by register_combo.
+combo_points={}
+
+def register_combo(name,predicate,weight=None):
+    """
+    Registers a type of yahtzee combination, so that its
+    name can be passed to Widget as the points argument.
+    predicate(table) is given a RollTable, and returns a
+    boolean array saying which of the rolls in table.rolls
+    are of this type.  It should work on all of the rolls
+    at once, e.g. using table.counts, the number of times
+    each face appears in each roll.  Rolls of this type get
+    1 point, and others get 0.
+
+    If weight is given, name+' weighted' is also registered,
+    for which rolls of this type get weight points instead.
+    weight is either a number, or a function weight(table)
+    returning an array of points for each roll.
+    """
+    name=name.lower()
+    combo_points[name]=lambda table: where(predicate(table),1.,0.)
+    if weight!=None:
+        if callable(weight):
+            weight_fn=weight
+        else:
+            weight_fn=lambda table: float(weight)
+        combo_points[name+' weighted']=lambda table: where(predicate(table),weight_fn(table),0.)
+
+def dice_sum(table):
+    """
+    The sum of the dice in each roll of a RollTable.
+    """
+    return table.rolls.sum(axis=1).astype(float)
+
+def two_most_common(table):
+    """
+    Returns (freq1,freq2), the frequencies of the most and
+    second most common numbers in each roll of a RollTable,
+    (freq2 is 0 for rolls with all dice the same).
+    """
+    if table.n_faces==1:
+        return table.counts[:,0],zeros(table.num_rolls,dtype=int)
+    counts=sort(table.counts,axis=1)
+    return counts[:,-1],counts[:,-2]
+
+def is_n_of_a_kind(n):
+    """
+    Returns a predicate for register_combo, testing whether
+    at least n dice in a roll show the same number.
+    """
+    return lambda table: table.counts.max(axis=1)>=n
+
+def is_full_house(table):
+    """
+    For an arbitary number of dice, I define a full
+    house to be only two different numbers appearing
+    in the roll, and n_dice/2 of each for n_dice even,
+    but (n_dice+1)/2 of one and (n_dice-1)/2 of the
+    other for n_dice odd.
+
+    To treat both cases at the same time, let freq1 and
+    freq2 be the frequencies of the two most common
+    numbers.  For a full house, must have
+    freq1+freq2=n_dice, and freq1, freq2 >= n_dice/2
+    (integer division).
+
+    The case of n_dice=1 must be treated separately;
+    for that case, everything is a full house.
+    """
+    n_dice=table.n_dice
+    if n_dice==1:
+        return ones(table.num_rolls,dtype=bool)
+    freq1,freq2=two_most_common(table)
+    return (freq1+freq2==n_dice)&(freq1>=n_dice/2)&(freq2>=n_dice/2)
+
+def is_small_straight(table):
+    """
+    A small straight means that n_dice-1 of the
+    numbers on the dice are in consecutive order,
+    and the remaining die can show any number.
+    We can split this into two cases:
+    (i) the remaining die shows a number different
+    than any of the other dice.
+    (ii) the remaining die shows a number the
+    same as one of the other dice.
+    Thus we have (i) all dice show different values
+    and (ii) two dice show the same values but all
+    the rest are different.  Therefore, we can look at
+    freq1 and freq2, the frequencies of the most and
+    second most common number.  If freq1>2 then we
+    definitely can't have a small straight.  If freq1=2
+    and freq2=2, then this is not a small straight either.
+    If freq1=2, and freq2=1, then we can use the fact that
+    rolls are sorted and test for case (ii) by checking if
+    roll[-1]-roll[0]=n_dice-2.
+    If freq1=1 then all dice show different values, and
+    we can check for case(i) by checking if
+    roll[-2]-roll[0]=n_dice-2 or roll[-1]-roll[1]=n_dice-2.
+
+    n_dice<=2 must be treated separately; in this case
+    everything is a small straight.
+    """
+    n_dice=table.n_dice
+    if n_dice<=2:
+        return ones(table.num_rolls,dtype=bool)
+    r=table.rolls
+    freq1,freq2=two_most_common(table)
+    case_ii=(freq1==2)&(freq2==1)&(r[:,-1]-r[:,0]==n_dice-2)
+    case_i=(freq1==1)&((r[:,-2]-r[:,0]==n_dice-2)|(r[:,-1]-r[:,1]==n_dice-2))
+    return case_i|case_ii
+
+def is_large_straight(table):
+    """
+    A large straight is when all dice show numbers
+    in consecutive order.  Since rolls are sorted, can
+    test for this by checking that all numbers in
+    the roll are different, and that
+    roll[-1]-roll[0]=n_dice-1.
+    """
+    r=table.rolls
+    return (table.counts.max(axis=1)==1)&(r[:,-1]-r[:,0]==table.n_dice-1)
+
+def is_yahtzee(table):
+    """
+    A yahtzee is when all dice show the same number.
+    """
+    return table.counts.max(axis=1)==table.n_dice
+
+def has_number(num):
+    """
+    Returns a predicate for register_combo, testing whether
+    any of the dice in a roll show the number num.
+    """
+    return lambda table: number_count(table,num)>0
+
+def number_count(table,num):
+    """
+    The number of dice showing the number num in each roll
+    of a RollTable.
+    """
+    if num>table.n_faces:
+        return zeros(table.num_rolls,dtype=int)
+    return table.counts[:,num-1]
+
+#The built-in combinations, with their point values in the
+#ordinary game of Yahtzee as weights.
+register_combo('three of a kind',is_n_of_a_kind(3),dice_sum)
+register_combo('four of a kind',is_n_of_a_kind(4),dice_sum)
+register_combo('full house',is_full_house,25.)
+register_combo('small straight',is_small_straight,30.)
+register_combo('large straight',is_large_straight,40.)
+register_combo('yahtzee',is_yahtzee,50.)
+register_combo('chance',lambda table: ones(table.num_rolls,dtype=bool),dice_sum)
+for num, combo in enumerate(['ones','twos','threes','fours','fives','sixes']):
+    register_combo(combo,has_number(num+1),lambda table,num=num+1: float(num)*number_count(table,num))
 
 #-----------------------                                                        
 #Test Cases
@@ -668,3 +3028,184 @@ if __name__ == "__main__":
     assert(sorted(w.strategy[1][(1,2,3,5,6)])==sorted([(),(1,),(2,),(3,),(5,),(6,)]))
     assert(sorted(w.strategy[0][(1,2,3,4,5)])==sorted([(),(1,),(2,),(3,),(4,),(5,)]))
     assert(sorted(w.strategy[0][(1,2,3,5,6)])==sorted([(),(1,),(2,),(3,),(5,),(6,)]))
+
+    #Widgets with the same dice share their enumeration tables.
+    hits=table_cache.stats()['hits']
+    assert(Widget('chance').table is w.table)
+    assert(table_cache.stats()['hits']>hits)
+    #rolls() doesn't use the cache, so it can't push out the
+    #tables of Widgets.
+    cache_stats=table_cache.stats()
+    assert(list(rolls(3,6,2))[:2]==[(2,2,2),(2,2,3)])
+    assert(len(list(rolls(7,4)))==n_multisets(7,4))
+    assert(list(rolls(0,6))==[()] and list(rolls(2,0))==[])
+    assert(table_cache.stats()==cache_stats)
+
+    #A saved Widget loads with the same values and strategy.
+    import os, tempfile
+    fd,path=tempfile.mkstemp()
+    os.close(fd)
+    w.save(path)
+    for mmap in [True,False]:
+        wl=Widget.load(path,mmap=mmap)
+        assert(wl.expected==w.expected)
+        assert((wl._values==w._values).all())
+        for turn in range(2):
+            assert(wl.strategy[turn][(1,1,4,4,5)]==w.strategy[turn][(1,1,4,4,5)])
+    del wl
+    os.remove(path)
+
+    #A lazy Widget gives the same results, computing only
+    #what it needs.
+    wl=Widget('yahtzee',lazy=True)
+    assert(wl.strategy[1][(2,2,6,6,6)]==[(6,6,6)])
+    assert(isnan(wl._values[0]).all())
+    assert(sorted(wl.strategy[0][(1,1,4,4,5)])==sorted(w.strategy[0][(1,1,4,4,5)]))
+    assert(wl.values[0][(3,3,3,5,5)]==w.values[0][(3,3,3,5,5)])
+    assert(eql_float(wl.expected,w.expected))
+    wl=Widget('yahtzee',lazy=True)
+    assert(wl.expected_given_kept((6,6,6),0)==w.expected_given_kept((6,6,6),0))
+    assert(round(wl.expected_given_kept((6,6,6),0),4)==0.0934)
+    #A query on the last turn only generates what it needs,
+    #without building the whole TransitionKernel and
+    #SubrollIndex.
+    wl=Widget('yahtzee',n_dice=7,n_faces=5,lazy=True)
+    assert(wl.strategy[1][(1,1,1,2,3,4,5)]==[(1,1,1)])
+    assert(wl.table._kernel is None and wl.table._subrolls is None)
+    assert(wl.values[1][(1,1,1,2,3,4,5)]==Widget('yahtzee',n_dice=7,n_faces=5).values[1][(1,1,1,2,3,4,5)])
+    assert(wl.lazy)
+    #A query on an earlier turn needs most of the rolls, so
+    #the whole Widget is solved instead, (also through views
+    #taken before).
+    wl=Widget('yahtzee',n_dice=7,n_faces=5,lazy=True)
+    wf=Widget('yahtzee',n_dice=7,n_faces=5)
+    lazy_view=wl.strategy[0]
+    assert(sorted(lazy_view[(1,1,1,2,3,4,5)])==sorted(wf.strategy[0][(1,1,1,2,3,4,5)]))
+    assert(not wl.lazy)
+    assert((wl._values==wf._values).all())
+    assert(lazy_view[(2,2,3,3,3,5,5)]==wf.strategy[0][(2,2,3,3,3,5,5)])
+
+    #New types of combinations can be registered.
+    register_combo('all even',lambda table: (table.rolls%2==0).all(axis=1),dice_sum)
+    we=Widget('All even weighted',n_rolls=1)
+    assert(we.values[0][(2,2,4,6,6)]==20.)
+    assert(we.values[0][(1,2,4,6,6)]==0.)
+
+    #The face count solver agrees with the ordinary one.
+    wc=CountWidget('yahtzee')
+    assert(eql_float(wc.expected,w.expected))
+    assert(wc.values[1][(3,3,3,5,5)]==1./36.)
+    assert(sorted(wc.strategy[0][(1,1,4,4,5)])==sorted([(1,1),(4,4)]))
+    assert(wc.strategy[1][(2,2,6,6,6)]==[(6,6,6)])
+
+    #Profiling records each turn, and calls the callback.
+    recorded=[]
+    wp=Widget('yahtzee',profile=recorded.append)
+    assert([t.turn for t in wp.stats.turns]==[1,0])
+    assert(recorded==wp.stats.turns)
+    assert(wp.stats.turns[0].subroll_checks==wp.subrolls.indices.size)
+    assert(0.<=wp.stats.turns[0].early_break_rate<1.)
+    assert(w.stats==None)
+    wb=solve_batch(['yahtzee','chance'],profile=True)[0]
+    assert([t.turn for t in wb.stats.turns]==[1,0])
+    assert([t[4:] for t in wb.stats.turns]==[t[4:] for t in wp.stats.turns])
+
+    #Solving all of the built-in combinations together gives
+    #the same results as solving them one at a time.
+    batch=solve_batch(combos+combos_weighted)
+    for combo, wb in zip(combos+combos_weighted,batch):
+        ws=Widget(combo)
+        assert(eql_float(wb.expected,ws.expected))
+        assert(wb.strategy[0][(1,2,3,3,5)]==ws.strategy[0][(1,2,3,3,5)])
+        assert(wb.strategy[1][(2,2,4,5,6)]==ws.strategy[1][(2,2,4,5,6)])
+    #Exactly the same, for every roll, including with enough
+    #dice that every set of kept dice is optimal for some of
+    #the tables, (e.g. straights).  (benchmark.py times the
+    #two.)
+    batch=solve_batch(combos+combos_weighted,n_dice=8)
+    for combo, wb in zip(combos+combos_weighted,batch):
+        ws=Widget(combo,n_dice=8)
+        assert((wb._values==ws._values).all())
+        for turn in range(2):
+            assert((wb._strategy[turn][0]==ws._strategy[turn][0]).all())
+            assert((wb._strategy[turn][1]==ws._strategy[turn][1]).all())
+
+    #Updating a few point values gives exactly the same
+    #results as solving from scratch.
+    wu=Widget('yahtzee weighted')
+    wu.update_points({(1,1,1,1,1):0.,(2,3,4,5,6):40.})
+    points=dict(zip(wu.table.roll_tuples,wu._values[-1]))
+    wf=Widget(points)
+    assert(wu.expected==wf.expected)
+    assert((wu._values==wf._values).all())
+    assert(wu.strategy[0][(1,1,4,5,6)]==wf.strategy[0][(1,1,4,5,6)])
+
+    #The distribution of points has the expected value as its
+    #mean, and makes sense.
+    d=wu.score_distribution()
+    assert(eql_float(d.mean(),wu.expected))
+    assert(eql_float(d.mean(1,(1,1,4,5,6)),wu.values[1][(1,1,4,5,6)]))
+    assert(eql_float(d.probs.sum(),1.))
+    assert(list(d.levels)==[0.,40.,50.])
+    assert(d.distribution(1,(6,6,6,6,6))=={50.:1.})
+    assert(d.quantile(0.5)==0. and d.quantile(1.)==50.)
+    assert(d.variance()>0.)
+
+    #Exact mode agrees with floating point, and gives the
+    #exact expected number of points.
+    wx=Widget('yahtzee',exact=True)
+    assert(wx.expected_exact==Fraction(2783176,60466176))
+    assert(wx.expected==float(wx.expected_exact))
+    assert(eql_float(wx.expected,w.expected))
+    assert(wx.exact_value(1,(2,2,6,6,6))==Fraction(1,36))
+    assert(wx.strategy[0][(1,1,4,4,5)]==w.strategy[0][(1,1,4,4,5)])
+    assert(Widget('chance weighted',n_dice=8,n_rolls=4,exact=True)._exact_values[0].dtype==object)
+    assert(Widget('chance weighted',n_dice=8,exact=True)._exact_values[0].dtype==int64)
+
+    #Batch advice agrees with the strategy, for rolls in any
+    #order.
+    keep,expected=w.advise_batch([1,2,3],[[4,1,5,1,4],[6,2,6,2,6],[3,3,3,3,3]])
+    assert(keep.tolist()==[[False,True,False,True,False],[True,False,True,False,True],[True]*5])
+    assert(expected[0]==w.values[0][(1,1,4,4,5)] and expected[2]==1.)
+    assert(w.strategy[0][(1,1,4,4,5)][0]==(1,1))
+
+
+    #Solving over orbits of face relabelings gives the same
+    #results, for detected and declared symmetries.
+    for combo in ['yahtzee','full house','sixes','chance','small straight']:
+        ws=Widget(combo,symmetry=True)
+        wf=Widget(combo)
+        assert(eql_float(ws.expected,wf.expected))
+        assert(eql_floats(ws._values,wf._values).all())
+        assert(ws.strategy[0][(1,1,4,4,5)]==wf.strategy[0][(1,1,4,4,5)])
+    assert(ws.face_symmetry.generators==[(1,2,4,3,5,6)])
+    ws=Widget('chance weighted',symmetry=True)
+    assert(ws.face_symmetry==None)
+    assert(Widget('yahtzee',symmetry=True).face_symmetry.num_roll_orbits==7)
+    assert(Widget('sixes',symmetry=True).face_symmetry.num_roll_orbits==19)
+    wf=Widget('small straight')
+    ws=Widget('small straight',symmetry=[(6,5,4,3,2,1)])
+    assert(ws.face_symmetry.num_roll_orbits<ws.table.num_rolls)
+    assert(eql_float(ws.expected,wf.expected))
+    ws.expand_strategy()
+    assert(ws._strategy[0][1].tolist()==wf._strategy[0][1].tolist())
+
+    #Loaded dice: equal probabilities are fair dice, and the
+    #expected points agree with summing over every ordered
+    #outcome.
+    assert(Widget('yahtzee',probs=[2.]*6).table is w.table)
+    p=[0.1,0.1,0.1,0.2,0.2,0.3]
+    assert(eql_float(Widget('yahtzee',n_rolls=1,probs=p).expected,(array(p)**5).sum()))
+    wl=Widget('yahtzee',n_dice=2,n_faces=3,n_rolls=2,probs=[1,2,3])
+    q=array([1,2,3])/6.
+    total=0.
+    for a, b in product_iter(range(3),repeat=2):
+        total+=q[a]*q[b]*max((q*q).sum(),q[a],q[b],float(a==b))
+    assert(eql_float(wl.expected,total))
+    wl=Widget('full house weighted',probs=p)
+    assert(wl.table is roll_table(5,6,tuple(p)))
+    assert(solve_batch(['full house weighted'],probs=p)[0].expected==wl.expected)
+    wl=Widget('full house',probs=p)
+    ws=Widget('full house',probs=p,symmetry=True)
+    assert(ws.face_symmetry.generators==[(1,2,3,5,4,6),(1,3,2,4,5,6),(2,1,3,4,5,6)])
+    assert(eql_floats(ws._values,wl._values).all())